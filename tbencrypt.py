@@ -1,12 +1,31 @@
 #!/usr/bin/env python3
 # coding=utf-8
 import sys
+import os
+import json
+import csv
+import time
+import queue
+import threading
+import concurrent.futures
 import numbers
 import math
 import random
+import atexit
+import signal
+import logging
 import tbencryptlib
 from tbencryptlib import tbkeygen
 from tbencryptlib import tbnumerics
+from tbencryptlib import tbprimepool
+from tbencryptlib import tbder
+from tbencryptlib import tbssh
+from tbencryptlib import tbpad
+from tbencryptlib import tbrsakey
+from tbencryptlib import tbfilecrypt
+from tbencryptlib import tbaudit
+from tbencryptlib import tbbench
+from tbencryptlib import tbmetrics
 import argparse
 from collections import OrderedDict
 
@@ -74,34 +93,7 @@ ASN1_TYPES = {"BOOLEAN"            : 1,
 def print_ba(byar):
     ## sys.stdout.write("bytearray:")
     print("print_ba: Length of array: " + str(len(byar)))
-    for i in range(len(byar)):
-        val = byar[i]
-        sys.stdout.write("%02X" % val)
-
-    sys.stdout.write("\n")
-
-
-'''
-   Retrieve the most significant byte of a value
-'''
-def msb(i):
-    print("msb: start val: " + str(hex(i)))
-    a = bin(i)
-    print("msb: start bin: " + str(a[0:10]) + "  length: " + str(len(a)-2))
-    xl = len(a)
-    ''' a would be a string like 0b101001... '''
-    '''    we need to insert 0's (after the 0b) until the binary representation '''
-    '''    contains a number of bits that is a multiple of 8 '''
-    while (xl - 2)%8 != 0:
-        a = a[:2] + "0" + a[2:]
-        xl = len(a)
-
-    print("msb: fixup bin: " + str(a[0:10]))
-    b = a[2:10]    ## get the first EIGHT bits of the value, skip the 0b
-    c = int(b,2)
-    d = bin(c)
-    print("msb: final bin: " + str(d[0:10]))
-    return c
+    sys.stdout.write(byar.hex().upper() + "\n")
 
 
 '''
@@ -115,11 +107,37 @@ def write_der(fname, barray):
 
 
 '''
-   Print routine
+   key file formats: DER is PKCS #1 for both keys; PEM is PKCS #1 or,
+     with pkcs8, PKCS #8 for the private key and SubjectPublicKeyInfo
+     for the public key; SSH is an openssh-key-v1 private key and an
+     ssh-rsa authorized_keys line, both with comment
 '''
-def asn1_print(msg, ktype):
-    print("ASN.1 ENCODE " + str(ktype) + ": " + msg)
+KEY_FORMATS = ("der", "pem", "ssh")
 
+def encode_keypair(key, fmt="der", pkcs8=False, comment="tbkey"):
+    with tbmetrics.get_metrics().timer("encode"):
+        if fmt == "ssh":
+            return (key.openssh_private(comment), key.ssh_public_line(comment))
+        if fmt == "pem":
+            return (key.private_pem(pkcs8), key.public_pem())
+        if pkcs8:
+            return (key.pkcs8_der(), key.public_der())
+        return (key.private_der(), key.public_der())
+
+
+'''
+   write_metrics
+
+   the counters and stage timers of this process in the Prometheus
+     text format, to fname or to stdout for '-'
+'''
+def write_metrics(fname):
+    text = tbmetrics.get_metrics().prometheus()
+    if fname == "-":
+        sys.stdout.write(text)
+    else:
+        with open(fname, "w") as f:
+            f.write(text)
 
 
 '''
@@ -151,126 +169,58 @@ keydata = OrderedDict([
     - generate private or public DER file
     -
     - Assume the keydata dictionary contains the values
-      to be encoded and populate the appropriate bytearray
+      to be encoded and populate the appropriate bytearray.
+      The encoding itself is tbder's.
 '''
 def encode_asn1(private=True):
     global keydata
     global ba
     global ba_public
-    ka = None
-    bytes_needed = 0
     print("Encode ASN.1")
-    total_length = 0
-    KTYPE = ""
-    zero_prepend = False ## if most signifcant bit is 1 for a positive integer, then prepend 0x00 byte
-    ## in python 3, items not iteritems
 
     if private:
-        lst = ["version", "modulus", "publicExponent", "privateExponent", "prime1",
-             "prime2", "exponent1", "exponent2", "coefficient"]
         KTYPE = "PRIVATE"
+        ba = bytearray(tbder.encode_rsa_private_key(
+                 keydata['modulus'], keydata['publicExponent'],
+                 keydata['privateExponent'], keydata['prime1'], keydata['prime2'],
+                 keydata['exponent1'], keydata['exponent2'], keydata['coefficient']))
         ka = ba
     else:
-        lst = ["modulus", "publicExponent"]
         KTYPE = "PUBLIC"
+        ba_public = bytearray(tbder.encode_rsa_public_key(
+                        keydata['modulus'], keydata['publicExponent']))
         ka = ba_public
 
-
-    for k,v in keydata.items():
-
-        if k in lst:
-
-            asn1_print("\n***FIELD: " + str(k) + "           Val: " + str(hex(v)), KTYPE)
-            val = v
-            ## These numbers are all positive so if the MSB has its most sig bit set
-            ##       then we need to prepend a zero byte
-            MSB = msb(val)
-            if MSB > 0x7f:
-                zero_prepend = True
-            else:
-                zero_prepend = False
-
-            ## Handle the special case of a zero value (version)
-            if 0 == val:
-                bytes_needed = 1
-                asn1_print("val = 0, inserting byte: " + str(bytes_needed), KTYPE)
-                ka.insert(0, 0)
-            else:
-                bytes_needed = int(math.ceil(math.log(val, 256)))
-                asn1_print("val > 0, bytes_needed: " + str(bytes_needed), KTYPE)
-                i = 0
-                asn1_print("inserted bytes : " + str(hex(val)), KTYPE)
-                while val:
-                    ## push LSB's first
-                    ka.insert(0, val&0xff)
-                    val = val >> 8
-                    i = i+1
-
-                asn1_print("inserted " + str(hex(i)) + " bytes", KTYPE)
-                if zero_prepend:
-                    asn1_print("insert zero prepend: bytes", KTYPE)
-                    bytes_needed += 1
-                    ka.insert(0, 0x00)
-
-            ## Length byte
-            if bytes_needed < 128:
-                lb = 0x7f&bytes_needed
-                asn1_print("insert length byte (short) : " + str(hex(lb)), KTYPE)
-                ka.insert(0, lb)
-            else:
-                if 0 == bytes_needed%256:
-                    bytes_needed += 1
-                length_bytes_needed = int(math.ceil(math.log(bytes_needed, 256)))
-                lb = 0x80|length_bytes_needed
-                for i in range(length_bytes_needed):
-                    asn1_print("insert length extra byte (long) : " + str(hex(bytes_needed&0xff)), KTYPE)
-                    ka.insert(0, bytes_needed&0xff)
-                    bytes_needed = bytes_needed >> 8
-
-                asn1_print("insert length byte (long) : " + str(hex(lb)), KTYPE)
-                ka.insert(0, lb)
-
-            ## Header byte (these are all INTEGER)
-            ka.insert(0, 0x02)  ## Universal, not constructed, Integer
-
-    ## Sequence
-    asn1_print("\n\nEncode ASN.1:  ENCODE SEQUENCE:", KTYPE)
-    total_length = len(ka)
-    seq_byte =  0x20 | 0x10
-    if total_length < 128:
-        lb = 0x7f&len(ka)
-        asn1_print("SEQ length byte (short) : " + str(hex(lb)), KTYPE)
-        ka.insert(0, lb)
-    else:
-        bytes_needed = int(math.ceil(math.log(total_length, 256)))
-        if 0 == total_length%256:
-            bytes_needed += 1
-        asn1_print("SEQ Length bytes needed: " + str(bytes_needed), KTYPE)
-        lb = 0x80|bytes_needed
-        asn1_print("SEQ length byte (long) : " + str(hex(lb)), KTYPE)
-        for i in range(bytes_needed):
-            asn1_print("SEQ long encoded byte #: " + str(i) + " : " + str(hex(total_length&0xff)), KTYPE)
-            ka.insert(0, total_length&0xff)
-            total_length = total_length >> 8
-
-        ka.insert(0, lb)
-
-    ka.insert(0, seq_byte)
-    total_length = len(ka)
-    asn1_print("Total length: " + str(total_length), KTYPE)
-    asn1_print("ASN.1  byte array: Length:" + str(len(ka)) + " ", KTYPE)
+    print("ASN.1 ENCODE " + KTYPE + ": ASN.1  byte array: Length:" + str(len(ka)) + " ")
     print_ba(ka)
 
-    asn1_print("**** END ****", KTYPE)
-
 
+'''
+   fill_keydata
 
-def gen_keypair(bits):
-    numerics = tbkeygen.tbnumerics.tbnumerics()
-
+   populate keydata from a keygen that has generated a keypair
+'''
+def fill_keydata(keygen):
+    key = keygen.get_key_context()
+
+    keydata['version'] = 0
+    keydata['modulus'] = key.n
+    keydata['publicExponent'] = key.e
+    keydata['privateExponent'] = key.d
+    keydata['prime1'] = key.p
+    keydata['prime2'] = key.q
+    keydata['exponent1'] = key.dp
+    keydata['exponent2'] = key.dq
+    keydata['coefficient'] = key.qinv
+
+
+def gen_keypair(bits, workers=0, strategy=tbkeygen.EXPONENT_LEGACY_RANDOM, fmt="der",
+                pkcs8=False, authorized_keys=None):
     try:
-        keygen = tbencryptlib.tbkeygen.tbkeygen(bits, False)
+        keygen = tbencryptlib.tbkeygen.tbkeygen(bits, False, False, workers, strategy)
+        keygen.set_prime_pool(tbprimepool.default_pool_dir())
         keygen.generate_keypair()
+        keygen.close()
 
         sys.stdout.write("RESULTS:\n")
         (p1, p2) = keygen.get_primes()
@@ -282,23 +232,23 @@ def gen_keypair(bits):
         (D, N) = keygen.get_private_keypair()
         sys.stdout.write("Private Exponent D: " + str(hex(D)) + '\n\n')
 
-        ## Populate keydata
-        keydata['version'] = 0
-        keydata['modulus'] = N
-        keydata['publicExponent'] = E
-        keydata['privateExponent'] = D
-        keydata['prime1'] = p1
-        keydata['prime2'] = p2
-        keydata['exponent1'] = D%(p1-1)
-        keydata['exponent2'] = D%(p2-1)
-        keydata['coefficient'] = numerics.modinv(p2, p1)
-
-        #encode the private
-        encode_asn1()
-        #encode the public
-        encode_asn1(False)
-        write_der("tbprivate.der", ba)
-        write_der("tbpublic.der", ba_public)
+        fill_keydata(keygen)
+
+        if fmt == "der" and not pkcs8:
+            with tbmetrics.get_metrics().timer("encode"):
+                #encode the private
+                encode_asn1()
+                #encode the public
+                encode_asn1(False)
+            write_der("tbprivate.der", ba)
+            write_der("tbpublic.der", ba_public)
+        else:
+            (priv, pub) = encode_keypair(keygen.get_key_context(), fmt, pkcs8)
+            write_der("tbprivate." + fmt, priv)
+            write_der("tbpublic." + fmt, pub)
+        if authorized_keys:
+            tbssh.append_authorized_keys(authorized_keys,
+                                         [keygen.get_key_context().ssh_public_line("tbkey")])
 
     except Exception as e:
         sys.stdout.write("Exception during keygen: " + str(e) + '\n')
@@ -308,120 +258,681 @@ def gen_keypair(bits):
 
 
 '''
-   run_tests
+   fill_prime_pool
+
+   top up the prime pools used for 'bits' keys (the p and q sizes)
+     to 'count' primes each, each prime raced for by 'workers' processes
+'''
+def fill_prime_pool(bits, count, workers=0):
+    pool_dir = tbprimepool.default_pool_dir()
+    if not pool_dir:
+        print("fill_prime_pool: no pool directory, set TBENCRYPT_PRIME_POOL")
+        sys.exit(1)
+
+    for pbits in (bits//2 + 2, bits//2 - 2):
+        pool = tbprimepool.tbprimepool(pbits, pool_dir, max(count, tbprimepool.DEFAULT_CAPACITY))
+        try:
+            added = pool.refill(count, None, workers)
+            sys.stdout.write("Prime pool " + pool.fname + ": added " + str(added) +
+                             ", available " + str(pool.available()) + '\n')
+        finally:
+            pool.close()
 
-   choose a key bit-length from a list, generate keypair and
-     test encryption with that key
 
 '''
-def run_tests():
-    bits_select = [64, 128, 256, 512, 1024, 2048]
+   BATCH KEY GENERATION
+
+   Keypairs are generated in a pool of worker processes, each of which
+   loads the library and its prime table once and then serves many
+   keys.  Finished DER pairs go through a bounded queue to a single
+   writer thread, which writes them out in batches.  At most
+   2*workers keys are in flight and BATCH_QUEUE_SIZE files are waiting
+   to be written, however many keys the run produces.
+'''
+BATCH_QUEUE_SIZE = 256
+BATCH_WRITE_SIZE = 32
+BATCH_WRITE_BUFFER = 1 << 16
 
-    while 1:
-        s = random.randint(0,len(bits_select)-1)
-        desired_bits = bits_select[s]
+'''
+   pool worker: generate one keypair, return its encodings and, with
+     ssh_line, its authorized_keys line.  With verify, a key that fails
+     the per-key checks is thrown away and generated again, up to
+     VERIFY_RETRIES times.
+'''
+VERIFY_RETRIES = 100
 
-        keygen = tbencryptlib.tbkeygen.tbkeygen(desired_bits, True, False)
+def _batch_keygen(bits, strategy, fmt="der", pkcs8=False, comment="tbkey", ssh_line=False,
+                  verify=False):
+    keygen = tbencryptlib.tbkeygen.tbkeygen(bits, False, False, 0, strategy)
+    keygen.set_prime_pool(tbprimepool.default_pool_dir())
+    for attempt in range(VERIFY_RETRIES + 1):
         keygen.generate_keypair()
+        key = keygen.get_key_context()
+        issues = tbaudit.get_key_auditor().audit_key(key) if verify else []
+        if not issues:
+            break
+    else:
+        raise Exception("_batch_keygen: no " + str(bits) + " bit key passed the checks in " +
+                        str(VERIFY_RETRIES + 1) + " tries, the last failed " +
+                        "; ".join(check + ": " + msg for (check, msg) in issues))
+    (priv, pub) = encode_keypair(key, fmt, pkcs8, comment)
+    line = key.ssh_public_line(comment) if ssh_line else None
+    return (priv, pub, line)
 
-        sys.stdout.write("\n\nTEST PARAMETERS for next 10 tests: (bits=" + str(desired_bits) + ")\n")
-        (E, N) = keygen.get_public_keypair()
-        sys.stdout.write("Public Exponent: " + str(E) + '\n')
-        (D, N) = keygen.get_private_keypair()
-        sys.stdout.write("Private Exponent: " + str(D) + '\n')
-        sys.stdout.write("N: " + str(N) + '\n\n')
-
-        #Tests - encrypt, decrypt
 
-        testmsgs = []
-        for i in range(10):
-            testmsgs.append(random.randint(32, 65535))
+'''
+   writer thread: drain the queue in batches until None arrives
+'''
+def _batch_writer(wq, errors):
+    done = False
+    while not done:
+        batch = [wq.get()]
+        while len(batch) < BATCH_WRITE_SIZE:
+            try:
+                batch.append(wq.get_nowait())
+            except queue.Empty:
+                break
+
+        for item in batch:
+            if item is None:
+                done = True
+                continue
+            if errors:
+                continue    # keep draining so the producer never blocks
+            (path, data) = item
+            try:
+                with open(path, "wb", buffering=BATCH_WRITE_BUFFER) as f:
+                    f.write(data)
+            except OSError as e:
+                errors.append(e)
 
-        for msg in testmsgs:
-            enc = pow(msg, E, N)
-            print ("Encryption of " + str(msg) + " yields: " + str(enc))
 
-            dec = pow(enc, D, N)
-            print ("Decryption of " + str(enc) + " yields: " + str(dec))
+'''
+   read_batch_jobs
 
-            if dec != msg:
-                print ("FAILED: encrypt of " + str(msg) + " = " + str(enc) + " decrypt of " + str(enc) + " = " + str(dec))
-                sys.exit(1)
-            else:
-                #print ("PASSED: encrypt of " + str(msg) + " = " + str(enc) + " decrypt of " + str(enc) + " = " + str(dec))
-                print("TEST PASSED!")
+   JSONL job spec, one job per line:
+     {"bits": 2048, "count": 100, "name": "web"}
+   count defaults to 1, name to "tbkey<bits>"
+'''
+def read_batch_jobs(f):
+    jobs = []
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            bits = int(job["bits"])
+            count = int(job.get("count", 1))
+            name = str(job.get("name", "tbkey" + str(bits)))
+        except Exception as e:
+            raise Exception("read_batch_jobs: line " + str(lineno) + ": " + str(e))
+        jobs.append((bits, count, name))
+    return jobs
 
 
+'''
+   gen_keypair_batch
 
+   jobs is a list of (bits, count, name); key i of a job is written to
+   out_dir/<name>_<i>_private.<fmt> and out_dir/<name>_<i>_public.<fmt>,
+   with i zero-padded to six digits (tbkey2048_000000_private.der).
+   With authorized_keys, the keys' ssh-rsa lines are appended to that
+   file in one write at the end of the run.
+'''
+def gen_keypair_batch(jobs, out_dir, workers=0, strategy=tbkeygen.EXPONENT_LEGACY_RANDOM,
+                      fmt="der", pkcs8=False, authorized_keys=None, verify=False):
+    if not workers:
+        workers = os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+
+    def keys():
+        for (bits, count, name) in jobs:
+            for i in range(count):
+                yield (bits, os.path.join(out_dir, name + "_" + format(i, "06d")))
+
+    wq = queue.Queue(BATCH_QUEUE_SIZE)
+    errors = []
+    writer = threading.Thread(target=_batch_writer, args=(wq, errors))
+    writer.start()
+
+    ssh_lines = []
+    total = 0
+    start = time.time()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            todo = keys()
+            while True:
+                for (bits, base) in todo:
+                    pending[pool.submit(_batch_keygen, bits, strategy, fmt, pkcs8,
+                                        os.path.basename(base),
+                                        authorized_keys is not None, verify)] = base
+                    if len(pending) >= 2*workers:
+                        break
+                if not pending:
+                    break
+
+                (done, notdone) = concurrent.futures.wait(pending,
+                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in done:
+                    base = pending.pop(fut)
+                    (priv, pub, line) = fut.result()
+                    wq.put((base + "_private." + fmt, priv))
+                    wq.put((base + "_public." + fmt, pub))
+                    if line is not None:
+                        ssh_lines.append(line)
+                    total += 1
+                if errors:
+                    break
+    finally:
+        wq.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+    if authorized_keys:
+        tbssh.append_authorized_keys(authorized_keys, ssh_lines)
+
+    elapsed = time.time() - start
+    sys.stdout.write("Generated " + str(total) + " keypairs in " + out_dir + " in " +
+                     format(elapsed, ".2f") + "s (" +
+                     format(total/elapsed if elapsed else 0.0, ".2f") + " keys/s)\n")
+    return total
 
 
 '''
-   parse_own_args
+   crypt_file
 
+   encrypt or decrypt infile to outfile with the DER or PEM key in
+     keyfile, in a pool of 'workers' processes
 '''
-def parse_own_args(args):
-    if args[1] != '-r' and args[1] != '-g':
-        usage()
-    elif args[1] == '-r':
-        return('-r', None)
-    elif args[1] == '-g' and len(args) < 3:
-        usage()
-    elif args[1] == '-g' and len(args) > 2:
-        return ('-g', args[2])
+def crypt_file(encrypt, keyfile, infile, outfile, padding=tbpad.PAD_OAEP,
+               hashname=tbpad.DEFAULT_HASH, workers=0):
+    key = tbrsakey.load_key_file(keyfile)
+    crypt = tbfilecrypt.tbfilecrypt(key, padding, hashname, workers)
+    start = time.time()
+    if encrypt:
+        (nin, nout) = crypt.encrypt_file(infile, outfile)
     else:
-        return (None, None)
+        (nin, nout) = crypt.decrypt_file(infile, outfile)
+    elapsed = time.time() - start
+    sys.stdout.write(("Encrypted " if encrypt else "Decrypted ") + str(nin) + " bytes to " +
+                     str(nout) + " bytes in " + format(elapsed, ".2f") + "s (" +
+                     format(nin/elapsed/1024 if elapsed else 0.0, ".1f") + " KiB/s)\n")
+
 
 '''
-   usage
+   audit_keys
 
+   batch gcd over the key files in paths (files or directories);
+     prints the moduli that share a prime or are used by more than one
+     key and returns how many there are
 '''
-def usage():
-    print("tbencrypt {-r | -g bits}, where:")
-    print("            -r=run tests")
-    print("            -g=generate keys with 'bits' length")
-    print("  bits should be a large power of 2")
-    sys.exit(1)
+def audit_keys(paths, spill_dir=None):
+    audit = tbaudit.tbbatchgcd(spill_dir)
+    nfiles = 0
+    for path in paths:
+        nfiles += audit.add_path(path)
+
+    start = time.time()
+    findings = audit.run()
+    elapsed = time.time() - start
+    sys.stdout.write("Audited " + str(len(audit.moduli)) + " moduli from " + str(nfiles) +
+                     " files in " + format(elapsed, ".2f") + "s (" +
+                     tbnumerics.backend_name() + " backend)\n")
+    for (kind, n, p, sources) in findings:
+        if kind == tbaudit.SHARED_MODULUS:
+            what = "is used by more than one key, both primes are compromised"
+        else:
+            what = "shares prime " + hex(p)[:18] + "..."
+        sys.stdout.write("WEAK: modulus " + hex(n)[:18] + "... " + what + ": " +
+                         ", ".join(str(x) for x in sources) + '\n')
+    sys.stdout.write(str(len(findings)) + " weak moduli\n")
+    return len(findings)
+
 
+'''
+   audit_key_files
+
+   per-key checks (Fermat, Wiener, smooth p-1) of the key files in
+     paths in a pool of 'workers' processes; returns the number of
+     weak keys
+'''
+def audit_key_files(paths, workers=0):
+    if not workers:
+        workers = os.cpu_count() or 1
+    (results, elapsed) = tbaudit.tbkeyaudit().audit_files(paths, workers)
+    nkeys = 0
+    nweak = 0
+    for (path, issues, error) in results:
+        if error is not None:
+            continue    # not a key file
+        nkeys += 1
+        if issues:
+            nweak += 1
+        for (check, msg) in issues:
+            sys.stdout.write("WEAK: " + path + ": " + check + ": " + msg + '\n')
+    sys.stdout.write("Checked " + str(nkeys) + " keys in " + format(elapsed, ".2f") + "s (" +
+                     format(nkeys/elapsed if elapsed else 0.0, ".1f") + " keys/s, " +
+                     str(workers) + " workers): " + str(nweak) + " weak\n")
+    return nweak
+
+
+'''
+   run_benchmarks
+
+   time the tbbench cases in names (all of them if empty) at each key
+     size in sizes, print a line per case and write the report to
+     json_file if given
+'''
+def run_benchmarks(names, sizes, repeat, warmup, seed=None, json_file=None):
+    bench = tbbench.tbbench(repeat, warmup, seed)
+    sys.stdout.write("Benchmarks on the " + tbnumerics.backend_name() + " backend, " +
+                     str(bench.repeat) + " runs after " + str(bench.warmup) + " warmup" +
+                     (", seed " + str(seed) if seed is not None else "") + '\n')
+    results = []
+    for result in bench.results(names, sizes):
+        sys.stdout.write(tbbench.format_result(result) + '\n')
+        results.append(result)
+    report = {"meta": bench.meta(), "results": results}
+    if json_file is not None:
+        tbbench.save_report(report, json_file)
+        sys.stdout.write("Wrote " + json_file + '\n')
+
+
+'''
+   compare_benchmarks
+
+   compare the medians of two tbbench JSON reports and list the cases
+     found in only one of them; returns the number of cases more than
+     threshold percent slower in new than in base
+'''
+def compare_benchmarks(base_file, new_file, threshold):
+    base = tbbench.load_report(base_file)
+    new = tbbench.load_report(new_file)
+    if base["meta"].get("backend") != new["meta"].get("backend"):
+        sys.stdout.write("Warning: backends differ, " + str(base["meta"].get("backend")) +
+                         " and " + str(new["meta"].get("backend")) + '\n')
+
+    (rows, regressions, unmatched) = tbbench.compare(base, new, threshold)
+    for (name, bits, old, cur, change) in rows:
+        sys.stdout.write(format(name, "<18") + format(bits, ">6") +
+                         format(old * 1000, ">14.3f") + " ms" + format(cur * 1000, ">14.3f") +
+                         " ms" + format(change, ">+9.1f") + "%" +
+                         ("  REGRESSION" if change > threshold else "") + '\n')
+    for (name, bits, where) in unmatched:
+        sys.stdout.write(format(name, "<18") + format(bits, ">6") + "  only in " +
+                         (base_file if where == "base" else new_file) + '\n')
+    sys.stdout.write(str(len(rows)) + " cases compared, " + str(len(regressions)) +
+                     " slower by more than " + format(threshold, "g") + "%" +
+                     (", " + str(len(unmatched)) + " in only one report"
+                      if unmatched else "") + "\n")
+    return len(regressions)
+
+
+'''
+   STRESS MODE (-r)
+
+   Keypairs of sizes drawn from a weighted mix are generated in a pool
+   of worker processes, each followed by STRESS_OPS private operations
+   (with an encryption to check each one), until the duration is up or
+   the key count is reached (or Ctrl-C).  Nothing is printed per
+   operation; at the end keys/s, private ops/s and the keygen and
+   private-op latency percentiles are reported for each key size.
+   Each key's tbmetrics counts come back with it and are merged into
+   this process's, for --metrics.
+'''
+STRESS_MIX = ((64, 1), (128, 1), (256, 1), (512, 1), (1024, 1), (2048, 1))
+STRESS_OPS = 10
+STRESS_FIELDS = ("bits", "keys", "keys_per_s", "ops", "ops_per_s",
+                 "keygen_p50_ms", "keygen_p95_ms", "keygen_p99_ms",
+                 "op_p50_ms", "op_p95_ms", "op_p99_ms")
+
+'''
+   "1024:3,2048:1" -> ((1024, 3), (2048, 1)); a weight defaults to 1
+'''
+def parse_bits_mix(text):
+    mix = []
+    for item in text.split(","):
+        (bits, sep, weight) = item.strip().partition(":")
+        mix.append((int(bits), float(weight) if sep else 1.0))
+    if not mix or any(bits < 16 or weight <= 0 for (bits, weight) in mix):
+        raise ValueError("bad bit size mix " + repr(text) + ", expected BITS[:WEIGHT],...")
+    return tuple(mix)
+
+'''
+   pool worker setup: Ctrl-C is for the parent, which stops the run
+'''
+def _stress_init():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+'''
+   pool worker: one keypair and 'ops' private operations on it;
+     returns (bits, keygen seconds, [private op seconds], metrics
+     snapshot of the key)
+'''
+def _stress_key(bits, strategy, ops):
+    metrics = tbmetrics.get_metrics()
+    metrics.reset()
+    start = time.perf_counter()
+    keygen = tbencryptlib.tbkeygen.tbkeygen(bits, False, False, 0, strategy)
+    keygen.generate_keypair()
+    key = keygen.get_key_context()
+    keygen_time = time.perf_counter() - start
+
+    op_times = []
+    for i in range(ops):
+        msg = random.randrange(2, key.n - 1)
+        enc = key.encrypt(msg)
+        start = time.perf_counter()
+        dec = key.decrypt(enc)
+        op_times.append(time.perf_counter() - start)
+        if dec != msg:
+            raise Exception("decrypt of " + hex(enc) + " with a " + str(bits) +
+                            " bit key gave " + hex(dec) + ", expected " + hex(msg))
+    return (bits, keygen_time, op_times, metrics.snapshot())
+
+'''
+   the per size rows (dicts keyed by STRESS_FIELDS) of a stress run,
+     the last one (bits "all") for all the sizes together
+'''
+def stress_rows(samples, elapsed):
+    rows = []
+    sizes = sorted(samples)
+    for bits in sizes + ["all"]:
+        if bits == "all":
+            keygen_times = [t for b in sizes for t in samples[b][0]]
+            op_times = [t for b in sizes for t in samples[b][1]]
+        else:
+            (keygen_times, op_times) = samples[bits]
+        row = {"bits": bits, "keys": len(keygen_times), "ops": len(op_times),
+               "keys_per_s": len(keygen_times)/elapsed if elapsed else 0.0,
+               "ops_per_s": len(op_times)/elapsed if elapsed else 0.0}
+        for (name, times) in (("keygen", keygen_times), ("op", op_times)):
+            for pct in (50, 95, 99):
+                value = tbbench.percentile(times, pct)
+                row[name + "_p" + str(pct) + "_ms"] = value*1000 if value is not None else None
+        rows.append(row)
+    return rows
+
+def _ms(value):
+    return format(value, ">10.2f") if value is not None else format("-", ">10")
+
+def run_stress(mix=STRESS_MIX, duration=None, count=None, workers=0, ops=STRESS_OPS,
+               strategy=tbkeygen.EXPONENT_LEGACY_RANDOM, csv_file=None, json_file=None):
+    if not workers:
+        workers = os.cpu_count() or 1
+    sizes = [bits for (bits, weight) in mix]
+    weights = [weight for (bits, weight) in mix]
+    sys.stdout.write("Stress: " + ", ".join(str(b) + ":" + format(w, "g") for (b, w) in mix) +
+                     " bit keys, " + str(ops) + " private ops each, " + str(workers) +
+                     " workers, " + (format(duration, "g") + "s" if duration else
+                                     str(count) + " keys" if count else "until Ctrl-C") + '\n')
+
+    samples = {}
+    submitted = 0
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                  initializer=_stress_init)
+    pending = set()
+    try:
+        while True:
+            while (len(pending) < 2*workers and (count is None or submitted < count) and
+                   (deadline is None or time.perf_counter() < deadline)):
+                bits = random.choices(sizes, weights)[0]
+                pending.add(pool.submit(_stress_key, bits, strategy, ops))
+                submitted += 1
+            if not pending:
+                break
+            (done, pending) = concurrent.futures.wait(
+                pending, timeout=(max(0.0, deadline - time.perf_counter()) if deadline and
+                                  time.perf_counter() < deadline else None),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                (bits, keygen_time, op_times, snap) = fut.result()
+                tbmetrics.get_metrics().merge(snap)
+                entry = samples.setdefault(bits, ([], []))
+                entry[0].append(keygen_time)
+                entry[1].extend(op_times)
+    except KeyboardInterrupt:
+        sys.stdout.write("Interrupted, reporting the keys finished so far\n")
+    finally:
+        # the keys being generated are let finish, the queued ones dropped
+        pool.shutdown(wait=True, cancel_futures=True)
+    elapsed = time.perf_counter() - start
+
+    rows = stress_rows(samples, elapsed)
+    sys.stdout.write("Ran for " + format(elapsed, ".2f") + "s\n")
+    sys.stdout.write(format("bits", ">6") + format("keys", ">8") + format("keys/s", ">10") +
+                     format("ops", ">9") + format("ops/s", ">10") +
+                     "  keygen ms p50/p95/p99              op ms p50/p95/p99\n")
+    for row in rows:
+        sys.stdout.write(format(str(row["bits"]), ">6") + format(row["keys"], ">8") +
+                         format(row["keys_per_s"], ">10.2f") + format(row["ops"], ">9") +
+                         format(row["ops_per_s"], ">10.1f") + "  " +
+                         _ms(row["keygen_p50_ms"]) + _ms(row["keygen_p95_ms"]) +
+                         _ms(row["keygen_p99_ms"]) + "  " + _ms(row["op_p50_ms"]) +
+                         _ms(row["op_p95_ms"]) + _ms(row["op_p99_ms"]) + '\n')
+
+    if csv_file is not None:
+        with open(csv_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, STRESS_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    if json_file is not None:
+        meta = tbbench.tbbench().meta()
+        for name in ("seed", "repeat", "warmup"):
+            del meta[name]
+        meta.update({"workers": workers, "ops_per_key": ops, "elapsed": elapsed,
+                     "mix": [list(m) for m in mix], "exponent": strategy})
+        with open(json_file, "w") as f:
+            json.dump({"meta": meta, "results": rows}, f, indent=1)
+            f.write("\n")
+    return rows
+
+
+'''
+   parse_own_args
+
+'''
+def parse_own_args(args):
+    parser = argparse.ArgumentParser(prog="tbencrypt",
+                                     epilog="bits should be a large power of 2")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("-r", action="store_true",
+                      help="stress test: generate keys from --mix and time private "
+                           "operations with them, for --duration or --count keys")
+    mode.add_argument("-g", type=int, metavar="bits",
+                      help="generate keys with 'bits' length")
+    mode.add_argument("-f", type=int, nargs=2, metavar=("bits", "count"),
+                      help="fill the prime pool with 'count' primes for 'bits' keys")
+    mode.add_argument("--jobs", metavar="FILE",
+                      help="generate the keys listed in a JSONL job spec ('-' for stdin)")
+    mode.add_argument("--encrypt", nargs=3, metavar=("KEY", "IN", "OUT"),
+                      help="encrypt file IN to OUT with the public or private key file KEY")
+    mode.add_argument("--decrypt", nargs=3, metavar=("KEY", "IN", "OUT"),
+                      help="decrypt file IN to OUT with the private key file KEY")
+    mode.add_argument("--check", nargs="+", metavar="PATH",
+                      help="check each key file in PATHs (files or directories) for close "
+                           "primes, a small private exponent and smooth p-1")
+    mode.add_argument("--audit", nargs="+", metavar="PATH",
+                      help="batch gcd audit of the moduli of the key files in PATHs "
+                           "(files or directories) for shared primes")
+    mode.add_argument("--bench", nargs="*", metavar="NAME",
+                      help="time the library's hot paths (all of them, or the NAMEs from: " +
+                           ", ".join(tbbench.BENCHMARKS) + ")")
+    mode.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                      help="compare two --bench --json reports, exit 1 on a regression "
+                           "past --threshold")
+    parser.add_argument("-w", type=int, default=0, metavar="workers",
+                        help="worker processes: for the two primes with -g (at most 2), "
+                             "for each prime search with -f, for the keys with -r, --count, --jobs and --check, for the "
+                             "blocks with --encrypt and --decrypt")
+    parser.add_argument("--exponent", choices=tbkeygen.EXPONENT_STRATEGIES,
+                        default=tbkeygen.EXPONENT_LEGACY_RANDOM,
+                        help="public exponent strategy (default: legacy-random); "
+                             "f4 uses E = 65537")
+    parser.add_argument("--count", type=int, metavar="N",
+                        help="with -g, generate N keypairs into --out; with -r, stop "
+                             "after N keys")
+    parser.add_argument("--duration", type=float, metavar="SECONDS",
+                        help="with -r, stop starting new keys after SECONDS")
+    parser.add_argument("--mix", type=parse_bits_mix, default=STRESS_MIX,
+                        metavar="BITS[:WEIGHT],...",
+                        help="with -r, the key sizes and their relative weights "
+                             "(default: 64,128,256,512,1024,2048)")
+    parser.add_argument("--ops", type=int, default=STRESS_OPS, metavar="N",
+                        help="with -r, private operations per key (default: 10)")
+    parser.add_argument("--csv", metavar="FILE",
+                        help="with -r, write the per size results to FILE as CSV")
+    parser.add_argument("--out", metavar="DIR", default=".",
+                        help="output directory for --count and --jobs (default: .)")
+    parser.add_argument("--format", choices=KEY_FORMATS, default="der",
+                        help="key file format (default: der); pem public keys are "
+                             "SubjectPublicKeyInfo, ssh keys are openssh-key-v1 and "
+                             "authorized_keys lines")
+    parser.add_argument("--pkcs8", action="store_true",
+                        help="write the private key as PKCS #8 instead of PKCS #1")
+    parser.add_argument("--padding", choices=tbpad.PADDINGS, default=tbpad.PAD_OAEP,
+                        help="padding for --encrypt and --decrypt (default: oaep)")
+    parser.add_argument("--oaep-hash", default=tbpad.DEFAULT_HASH, metavar="HASH",
+                        help="hashlib hash for oaep padding and MGF1 (default: sha256)")
+    parser.add_argument("--verify", action="store_true",
+                        help="with --count and --jobs, check each new key and "
+                             "regenerate it if it fails")
+    parser.add_argument("--spill", metavar="DIR",
+                        help="with --audit, keep the gcd tree levels in files under DIR")
+    parser.add_argument("--authorized-keys", metavar="FILE",
+                        help="also append the public keys to an authorized_keys FILE")
+    parser.add_argument("--sizes", type=int, nargs="+", metavar="BITS",
+                        default=list(tbbench.DEFAULT_SIZES),
+                        help="key sizes for --bench (default: 512 1024 2048)")
+    parser.add_argument("--repeat", type=int, default=tbbench.DEFAULT_REPEAT, metavar="N",
+                        help="timed runs per --bench case (default: 5)")
+    parser.add_argument("--warmup", type=int, default=tbbench.DEFAULT_WARMUP, metavar="N",
+                        help="untimed runs before them (default: 1)")
+    parser.add_argument("--seed", metavar="SEED",
+                        help="with --bench, draw all the random numbers from SEED")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the --bench report or the -r results to FILE")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="on exit, write the counters and stage timers to FILE "
+                             "('-' for stdout) in the Prometheus text format")
+    parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"),
+                        help="log the library's messages at this level to stderr")
+    parser.add_argument("--threshold", type=float, default=tbbench.DEFAULT_THRESHOLD,
+                        metavar="PCT",
+                        help="with --compare, the slowdown in percent that fails (default: 10)")
+    return parser.parse_args(args[1:])
 
 '''
    main
 
    processes options from command line
-   -r : generate keys of various lengths and run tests until Ctrl-C.
-                         bits arg is ignored in this case
+   -r : stress test with -w workers: generate keys of the --mix sizes and
+                         time --ops private operations with each, for
+                         --duration seconds or --count keys (or until Ctrl-C);
+                         reports keys/s, ops/s and latency percentiles per
+                         size, --csv and --json write them to files
    -g : generate a 'bits' length key and generate DER encoded
                           public and private key files
+   -w : with -g, generate the two primes in parallel processes
+   -f : top up the prime pool for 'bits' keys to 'count' primes;
+                          -g takes its primes from the pool when it can
+   --count, --jobs : generate many keypairs into --out in a worker pool
+   --format, --pkcs8 : key file encoding for -g, --count and --jobs
+   --authorized-keys : append the new public keys to an authorized_keys file
+   --encrypt, --decrypt : encrypt or decrypt a file of any size with a key
+                          file, --padding and --oaep-hash select the padding
+   --audit : find key files whose moduli share a prime; --spill puts the
+                          gcd trees on disk; exits 2 if any are found
+   --check : run the per-key checks over key files; exits 2 if any fail
+   --verify : with --count and --jobs, run the per-key checks on each new
+                          key and generate it again if they fail
+   --bench : time the tbbench cases at --sizes, --repeat runs after --warmup,
+                          --seed for repeatable inputs, --json to save the report
+   --compare : compare two reports; exits 1 if a case is more than
+                          --threshold percent slower
+   --metrics : write the counters and stage timers on exit
+   --log-level : send the library's log messages to stderr
 '''
 def main():
     global keydata
     print("Encrypt main: start")
-    try:
-        (argopt, argbits) = parse_own_args(sys.argv)
-    except Exception as e:
-        print(str(sys.argv[0]) + ": Parse args failed: " + str(e))
-        usage()
-
-    if argopt == None:
-       usage()
-
-    if argopt =='-r':
+    opts = parse_own_args(sys.argv)
+    if opts.log_level is not None:
+        logging.basicConfig(level=opts.log_level.upper(),
+                            format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if opts.metrics is not None:
+        atexit.register(write_metrics, opts.metrics)
+
+    if opts.r:
         print("-r option")
-        run_tests()
-
-    elif argopt =='-g':
         try:
-            bits = int(argbits)
+            run_stress(opts.mix, opts.duration, opts.count, opts.w, opts.ops, opts.exponent,
+                       opts.csv, opts.json)
         except Exception as e:
-            print(str(sys.argv[0]) + ": Parse args failed: " + str(e))
-            usage()
-
+            sys.stdout.write("Exception during stress test: " + str(e) + '\n')
+            sys.exit(1)
 
-        print("-g option with " + str(bits) + " bits")
-        gen_keypair(bits)
+    elif opts.encrypt is not None or opts.decrypt is not None:
+        encrypt = opts.encrypt is not None
+        (keyfile, infile, outfile) = opts.encrypt if encrypt else opts.decrypt
+        try:
+            crypt_file(encrypt, keyfile, infile, outfile, opts.padding, opts.oaep_hash,
+                       opts.w)
+        except Exception as e:
+            sys.stdout.write("Exception during " + ("encrypt" if encrypt else "decrypt") +
+                             ": " + str(e) + '\n')
+            sys.exit(1)
 
-    else:
-        print("An option is required")
-        usage()
+    elif opts.bench is not None:
+        try:
+            run_benchmarks(opts.bench, opts.sizes, opts.repeat, opts.warmup, opts.seed,
+                           opts.json)
+        except Exception as e:
+            sys.stdout.write("Exception during benchmark: " + str(e) + '\n')
+            sys.exit(1)
+
+    elif opts.compare is not None:
+        if compare_benchmarks(opts.compare[0], opts.compare[1], opts.threshold):
+            sys.exit(1)
+
+    elif opts.check is not None:
+        if audit_key_files(opts.check, opts.w):
+            sys.exit(2)
+
+    elif opts.audit is not None:
+        if audit_keys(opts.audit, opts.spill):
+            sys.exit(2)
+
+    elif opts.jobs is not None:
+        if opts.jobs == "-":
+            jobs = read_batch_jobs(sys.stdin)
+        else:
+            with open(opts.jobs) as f:
+                jobs = read_batch_jobs(f)
+        print("--jobs with " + str(len(jobs)) + " jobs")
+        gen_keypair_batch(jobs, opts.out, opts.w, opts.exponent, opts.format, opts.pkcs8,
+                          opts.authorized_keys, opts.verify)
+
+    elif opts.g is not None and opts.count is not None:
+        print("-g option with " + str(opts.g) + " bits, " + str(opts.count) + " keypairs")
+        gen_keypair_batch([(opts.g, opts.count, "tbkey" + str(opts.g))], opts.out, opts.w,
+                          opts.exponent, opts.format, opts.pkcs8, opts.authorized_keys,
+                          opts.verify)
+
+    elif opts.g is not None:
+        print("-g option with " + str(opts.g) + " bits")
+        gen_keypair(opts.g, opts.w, opts.exponent, opts.format, opts.pkcs8,
+                    opts.authorized_keys)
+
+    elif opts.f is not None:
+        (bits, count) = opts.f
+        print("-f option with " + str(bits) + " bits, " + str(count) + " primes")
+        fill_prime_pool(bits, count, opts.w)
 
 
 if __name__ == "__main__":
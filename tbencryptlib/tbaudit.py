@@ -0,0 +1,509 @@
+import os
+import math
+import time
+import logging
+import shutil
+import tempfile
+import concurrent.futures
+from . import tbnumerics
+from . import tbrsakey
+from . import tbmetrics
+
+'''
+  tbaudit
+
+  Batch GCD (Bernstein; Heninger et al., "Mining your Ps and Qs")
+  over a set of RSA moduli N_1 .. N_k, finding every modulus that
+  shares a prime with another one:
+
+     product tree    level 0 is the moduli, each level above holds the
+                     products of adjacent pairs, the root is P = prod N_i
+     remainder tree  R_root = P, and going down R_node = R_parent mod node**2
+     leaves          g_i = gcd(R_i / N_i, N_i); g_i > 1 means N_i shares
+                     a prime with some other modulus
+
+  The cost is a few multiplications and divisions of the size of the
+  whole set per level, about log2(k) levels, instead of k**2/2 gcds.
+  With a spill directory, each level is written to a file as it is
+  built and the remainder tree is computed streaming, one parent and
+  one node at a time, so only the top few levels (which are few, but
+  large) are ever held in memory whole.
+
+  Duplicate moduli are folded together before the batch gcd, which
+  would otherwise see every prime of theirs as shared.  A modulus
+  used by more than one key is reported as a shared modulus: whoever
+  holds one of its private keys can factor it, so both primes are
+  compromised.  The private and public files of one key are not two
+  keys; a public key is taken for the public half of a private key
+  with the same e, and private keys with the same e and d are copies
+  of one key.  A modulus that shares both of its primes (g_i = N_i)
+  is split by pairwise gcds with the other moduli, the weak ones
+  first.
+'''
+
+SHARED_PRIME = "shared prime"
+SHARED_MODULUS = "shared modulus"
+RECORD_LEN_SIZE = 4
+SPILL_BUFFER = 1 << 20
+
+'''
+   level storage: a list in memory, or a file of length-prefixed
+   big-endian integers in the spill directory
+'''
+def _write_level(ints, path):
+    count = 0
+    with open(path, "wb", buffering=SPILL_BUFFER) as f:
+        for v in ints:
+            v = int(v)
+            b = v.to_bytes((v.bit_length() + 7)//8, 'big')
+            f.write(len(b).to_bytes(RECORD_LEN_SIZE, 'big'))
+            f.write(b)
+            count += 1
+    return count
+
+def _read_level(path, integer):
+    with open(path, "rb", buffering=SPILL_BUFFER) as f:
+        while True:
+            head = f.read(RECORD_LEN_SIZE)
+            if not head:
+                return
+            n = int.from_bytes(head, 'big')
+            yield integer(int.from_bytes(f.read(n), 'big'))
+
+def _pair_products(nodes):
+    it = iter(nodes)
+    for a in it:
+        b = next(it, None)
+        yield a if b is None else a*b
+
+def _remainders(parents, nodes):
+    parents = iter(parents)
+    r = None
+    for j, node in enumerate(nodes):
+        if j % 2 == 0:
+            r = next(parents)
+        yield r % (node*node)
+
+
+log = logging.getLogger(__name__)
+
+
+class tbbatchgcd:
+    def __init__(self, _spill_dir=None, _verbose=False, _debug=False):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbbatchgcd"
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
+        '''directory for tree level files, None: keep the trees in memory'''
+        self.spill_dir = _spill_dir
+        '''modulus -> list of (source, e, d), e and d None if not known'''
+        self.moduli = {}
+        self.backend = tbnumerics.get_backend()
+        self.__tmp = None
+
+    '''
+        PUBLIC
+    '''
+
+    def add(self, n, source=None, e=None, d=None):
+        self.moduli.setdefault(int(n), []).append((source, e, d))
+
+    '''
+        add the modulus of a DER or PEM key file, with its e and d
+    '''
+    def add_key_file(self, path):
+        key = tbrsakey.load_key_file(path)
+        self.add(key.n, path, key.e, key.d if key.has_private() else None)
+
+    '''
+        add a key file, or every key file under a directory; files that
+        are not keys are skipped.  Returns the number of files added.
+    '''
+    def add_path(self, path):
+        if not os.path.isdir(path):
+            self.add_key_file(path)
+            return 1
+        added = 0
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                fpath = os.path.join(dirpath, fname)
+                try:
+                    self.add_key_file(fpath)
+                    added += 1
+                except Exception as e:
+                    self.__verbose("add_path: skipping %s: %s", fpath, e)
+        return added
+
+    '''
+        run the batch gcd; returns a list of (kind, n, p, sources) for
+        every weak modulus n:
+           SHARED_PRIME    p is a prime n shares with another modulus
+           SHARED_MODULUS  n is used by more than one key; p is a prime
+                           it also shares with another modulus, or None
+    '''
+    def run(self):
+        moduli = list(self.moduli)
+        if len(moduli) < 2:
+            gcds = [1]*len(moduli)
+        else:
+            if self.spill_dir is not None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self.__tmp = tempfile.mkdtemp(prefix="tbaudit", dir=self.spill_dir)
+            try:
+                gcds = self.__batch_gcd(moduli)
+            finally:
+                if self.__tmp is not None:
+                    shutil.rmtree(self.__tmp, ignore_errors=True)
+                    self.__tmp = None
+
+        weak = [n for (n, g) in zip(moduli, gcds) if g != 1]
+        findings = []
+        for (n, g) in zip(moduli, gcds):
+            shared = self.__key_count(n) > 1
+            if g == 1 and not shared:
+                continue
+            if g == n:
+                # both primes are shared, find one with a single gcd
+                g = self.__split(n, weak + moduli)
+            kind = SHARED_MODULUS if shared else SHARED_PRIME
+            findings.append((kind, n, g if g != 1 else None,
+                             [source for (source, e, d) in self.moduli[n]]))
+        return findings
+
+    def set_debug(self, b_dbg):
+        if b_dbg:
+            self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
+        else:
+            self.DEBUG = False
+
+    def set_verbose(self, b_vrb):
+        if b_vrb:
+            self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
+        else:
+            self.VERBOSE = False
+
+    '''
+        PRIVATE
+    '''
+
+    '''
+        gcd(P/N_i, N_i) for each modulus, P the product of all of them
+    '''
+    def __batch_gcd(self, moduli):
+        integer = self.backend.integer
+
+        # product tree, bottom up
+        levels = [self.__store(0, (integer(n) for n in moduli))]
+        count = len(moduli)
+        while count > 1:
+            levels.append(self.__store(len(levels), _pair_products(self.__load(levels[-1]))))
+            count = (count + 1)//2
+            self.__dbgprnt("__batch_gcd: product level %d, %d nodes", len(levels) - 1, count)
+
+        # remainder tree, top down; each product level is dropped once used
+        rems = levels.pop()
+        while levels:
+            nodes = levels.pop()
+            below = self.__store("r" + str(len(levels)),
+                                 _remainders(self.__load(rems), self.__load(nodes)))
+            self.__drop(rems)
+            self.__drop(nodes)
+            rems = below
+
+        gcd = self.backend.gcd
+        gcds = []
+        for (n, r) in zip(moduli, self.__load(rems)):
+            gcds.append(int(gcd(r//n, n)))
+        return gcds
+
+    '''
+        how many keys the entries of modulus n are: a public key with
+        the e of a private key is its public half, private keys with the
+        same e and d are copies of one key, and every other entry is a
+        key of its own
+    '''
+    def __key_count(self, n):
+        private = set((e, d) for (source, e, d) in self.moduli[n] if d is not None)
+        private_es = set(e for (e, d) in private)
+        count = len(private)
+        for (source, e, d) in self.moduli[n]:
+            if d is None and (e is None or e not in private_es):
+                count += 1
+        return count
+
+    '''
+        a proper factor of n from its gcd with one of candidates, None
+        if none of them splits it
+    '''
+    def __split(self, n, candidates):
+        gcd = self.backend.gcd
+        for m in candidates:
+            if m != n:
+                g = int(gcd(n, m))
+                if 1 < g < n:
+                    return g
+        return None
+
+    def __store(self, name, ints):
+        if self.__tmp is None:
+            return list(ints)
+        path = os.path.join(self.__tmp, "level_" + str(name))
+        _write_level(ints, path)
+        return path
+
+    def __load(self, level):
+        if isinstance(level, list):
+            return level
+        return _read_level(level, self.backend.integer)
+
+    def __drop(self, level):
+        if not isinstance(level, list):
+            os.remove(level)
+
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
+
+    def __verbose(self, msg, *args):
+        if True == self.VERBOSE or log.isEnabledFor(logging.INFO):
+            log.info(msg, *args)
+
+
+
+'''
+  PER-KEY AUDIT
+
+  Structural checks of single keys, each cheap next to generating one:
+
+  fermat      |p-q| must exceed 2**(nlen/2 - 100) (FIPS 186-5 A.1.3),
+              or Fermat's method factors n from isqrt(n) up.  Without
+              the primes, FERMAT_ROUNDS steps of Fermat's method are run.
+  wiener      d must exceed 2**(nlen/2) (FIPS 186-5 A.1.1); a d below
+              n**(1/4)/3 is recovered from the continued fraction of e/n.
+              Without d, the convergents of e/n are tried.
+  smooth      p-1 and q-1 must keep at least SMOOTH_MIN_COFACTOR_BITS
+              bits (a quarter of the prime's bits for smaller primes)
+              after every prime of the small prime table is divided
+              out, or Pollard p-1 factors n.  Needs the primes.  Primes
+              below SMOOTH_MIN_PRIME_BITS are not checked: their keys
+              are factored directly faster than by p-1.
+
+  audit_files runs the checks over key files in a pool of worker
+  processes, each of which builds the product of the table primes once.
+'''
+CHECK_FERMAT = "fermat"
+CHECK_WIENER = "wiener"
+CHECK_SMOOTH = "smooth"
+FERMAT_MARGIN_BITS = 100
+FERMAT_ROUNDS = 1 << 12
+SMOOTH_MIN_COFACTOR_BITS = 64
+SMOOTH_MIN_PRIME_BITS = 128
+AUDIT_CHUNK = 16
+
+'''
+   one auditor per process, shared by the pool tasks
+'''
+_auditor = None
+
+def get_key_auditor():
+    global _auditor
+    if _auditor is None:
+        _auditor = tbkeyaudit()
+    return _auditor
+
+def _audit_file(path):
+    try:
+        return (path, get_key_auditor().audit_key(tbrsakey.load_key_file(path)), None)
+    except Exception as e:
+        return (path, [], str(e))
+
+
+class tbkeyaudit:
+    def __init__(self, _fermat_rounds=FERMAT_ROUNDS, _verbose=False, _debug=False):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbkeyaudit"
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
+        self.fermat_rounds = _fermat_rounds
+        self.backend = tbnumerics.get_backend()
+        self.primetable = tbnumerics.get_prime_table()
+        self.__table_product = None
+
+    '''
+        PUBLIC
+    '''
+
+    '''
+        list of (check, message) for everything wrong with key, a
+        tbrsakey or tbderkey; empty if it passes
+    '''
+    def audit_key(self, key):
+        issues = []
+        n = key.n
+        e = key.e
+        d = key.d if key.has_private() else None
+        p = key.p if key.has_private() else None
+        q = key.q if key.has_private() else None
+
+        msg = self.check_fermat(n, p, q)
+        if msg is not None:
+            issues.append((CHECK_FERMAT, msg))
+        msg = self.check_wiener(n, e, d)
+        if msg is not None:
+            issues.append((CHECK_WIENER, msg))
+        if p is not None and q is not None:
+            for (name, prime) in (("p", p), ("q", q)):
+                msg = self.check_smooth(prime)
+                if msg is not None:
+                    issues.append((CHECK_SMOOTH, name + "-1 " + msg))
+        return issues
+
+    def check_fermat(self, n, p=None, q=None):
+        half = (n.bit_length() + 1)//2
+        if p is not None and q is not None:
+            diff = abs(p - q)
+            if diff.bit_length() <= half - FERMAT_MARGIN_BITS:
+                return ("|p-q| < 2**" + str(diff.bit_length()) + ", at most 2**" +
+                        str(half - FERMAT_MARGIN_BITS) + " is allowed")
+            return None
+
+        a = math.isqrt(n)
+        if a*a < n:
+            a += 1
+        for i in range(self.fermat_rounds):
+            b2 = a*a - n
+            b = math.isqrt(b2)
+            if b*b == b2:
+                return "n = " + hex(a - b) + " * " + hex(a + b) + " by Fermat's method"
+            a += 1
+        return None
+
+    def check_wiener(self, n, e, d=None):
+        half = (n.bit_length() + 1)//2
+        if d is not None:
+            if d.bit_length() <= half:
+                return "d < 2**" + str(d.bit_length()) + ", must exceed 2**" + str(half)
+            return None
+
+        for (k, dk) in self.__convergents(e, n):
+            if k == 0 or (e*dk - 1) % k:
+                continue
+            phi = (e*dk - 1)//k
+            s = n - phi + 1
+            disc = s*s - 4*n
+            if disc >= 0:
+                r = math.isqrt(disc)
+                if r*r == disc:
+                    return "d = " + hex(dk) + " from the continued fraction of e/n"
+        return None
+
+    def check_smooth(self, p):
+        nbits = int(p).bit_length()
+        if nbits < SMOOTH_MIN_PRIME_BITS:
+            return None
+        need = min(SMOOTH_MIN_COFACTOR_BITS, nbits//4)
+        m = p - 1
+        gcd = self.backend.gcd
+        P = self.__get_table_product()
+        g = gcd(m, P)
+        while g > 1:
+            m //= g
+            g = gcd(m, g)
+        m = int(m)
+        if m.bit_length() < need:
+            return ("has only " + str(m.bit_length()) + " bits free of primes below " +
+                    str(self.primetable.limit))
+        return None
+
+    '''
+        audit the key files in paths (files or directories) in a pool of
+        workers; returns (results, elapsed seconds), results a list of
+        (path, issues, error)
+    '''
+    def audit_files(self, paths, workers=0):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for (dirpath, dirnames, filenames) in os.walk(path):
+                    dirnames.sort()
+                    files.extend(os.path.join(dirpath, f) for f in sorted(filenames))
+            else:
+                files.append(path)
+
+        start = time.time()
+        if workers is None or workers <= 1:
+            results = [_audit_file(f) for f in files]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_audit_file, files, chunksize=AUDIT_CHUNK))
+        return (results, time.time() - start)
+
+    def set_debug(self, b_dbg):
+        if b_dbg:
+            self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
+        else:
+            self.DEBUG = False
+
+    def set_verbose(self, b_vrb):
+        if b_vrb:
+            self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
+        else:
+            self.VERBOSE = False
+
+    '''
+        PRIVATE
+    '''
+
+    '''
+        product of every prime in the small prime table, built once as
+        a product tree
+    '''
+    def __get_table_product(self):
+        if self.__table_product is None:
+            integer = self.backend.integer
+            level = [integer(p) for p in self.primetable.primes()]
+            while len(level) > 1:
+                level = list(_pair_products(level))
+            self.__table_product = level[0]
+            self.__dbgprnt("__get_table_product: %d bits",
+                           int(self.__table_product).bit_length())
+        return self.__table_product
+
+    '''
+        convergents k/d of the continued fraction of a/b
+    '''
+    def __convergents(self, a, b):
+        (k0, k1) = (0, 1)
+        (d0, d1) = (1, 0)
+        while b:
+            (t, r) = divmod(a, b)
+            (k0, k1) = (k1, t*k1 + k0)
+            (d0, d1) = (d1, t*d1 + d0)
+            yield (k1, d1)
+            (a, b) = (b, r)
+
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
+
+
+'''
+ EOF
+'''
@@ -0,0 +1,316 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+import platform
+from . import tbnumerics
+from . import tbkeygen
+from . import tbder
+from . import tbmetrics
+
+'''
+  tbbench
+
+  Timings of the library's hot paths at a list of key sizes:
+
+     gen_nbit_prime    a bits/2 prime, as tbkeygen searches for p and q
+     is_prime          a bits/2 prime (every round runs)
+     egcd_iter         schoolbook extended gcd of a bits-bit pair
+     xgcd              Lehmer / half-gcd extended gcd of the same pair
+     modinv            inverse of a bits-bit value mod a bits-bit modulus
+     prime_factors     a bits-bit number, smooth over the trial division
+                       primes but for two 24-bit primes left to rho
+     generate_keypair  a bits keypair, E = 65537, no prime pool
+     der_encode        the PKCS #1 private and public DER encodings, as
+                       encode_asn1 builds them
+
+  Each case is set up once, run 'warmup' times untimed and then
+  'repeat' times, and the samples are summarized by their median and
+  percentiles.  With a seed, each case draws its inputs and the
+  numerics' random numbers (numerics.sysrandom) from its own
+  random.Random seeded with (seed, case, bits), so a run can be
+  repeated exactly; without one they come from SystemRandom.
+
+  A report is a dict that goes to and from JSON as is:
+     {"meta": {"backend": ..., "python": ..., "seed": ..., ...},
+      "results": [{"name": ..., "bits": ..., "samples": [...],
+                   "median": ..., "p90": ..., ...}, ...]}
+  compare() matches two reports case by case on the median.
+'''
+
+DEFAULT_SIZES = (512, 1024, 2048)
+DEFAULT_REPEAT = 5
+DEFAULT_WARMUP = 1
+DEFAULT_THRESHOLD = 10.0     # percent slower than the baseline median
+PERCENTILES = (50, 90, 95, 99)
+FACTOR_SPLIT_BITS = 24       # prime_factors: the two primes rho has to find
+
+
+'''
+   percentile: linear interpolation between the closest ranks of the
+     sorted samples, pct in 0..100
+   summarize: count, min, max, mean, median and the PERCENTILES
+'''
+def percentile(samples, pct):
+    data = sorted(samples)
+    if not data:
+        return None
+    pos = (len(data) - 1) * pct / 100.0
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (pos - lo)
+
+def summarize(samples):
+    summary = {"count": len(samples)}
+    if not samples:
+        return summary
+    summary["min"] = min(samples)
+    summary["max"] = max(samples)
+    summary["mean"] = sum(samples) / len(samples)
+    summary["median"] = percentile(samples, 50)
+    for pct in PERCENTILES:
+        if pct != 50:
+            summary["p" + str(pct)] = percentile(samples, pct)
+    return summary
+
+
+'''
+   CASES
+
+   each takes (numerics, rng, bits) and returns the function to time;
+   the numerics instance already draws from rng
+'''
+def _random_odd(rng, bits):
+    return rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+
+def _random_prime(numerics, rng, bits):
+    return numerics.search_prime(1 << (bits - 1), 1 << bits)
+
+def _case_gen_nbit_prime(numerics, rng, bits):
+    return lambda: numerics.gen_nbit_prime(bits // 2)
+
+def _case_is_prime(numerics, rng, bits):
+    p = _random_prime(numerics, rng, bits // 2)
+    return lambda: numerics.is_prime(p)
+
+def _coprime_pair(rng, bits):
+    m = _random_odd(rng, bits)
+    while True:
+        a = rng.getrandbits(bits)
+        if math.gcd(a, m) == 1:
+            return (a, m)
+
+def _case_egcd_iter(numerics, rng, bits):
+    (a, m) = _coprime_pair(rng, bits)
+    return lambda: numerics.egcd_iter(a, m)
+
+def _case_xgcd(numerics, rng, bits):
+    (a, m) = _coprime_pair(rng, bits)
+    return lambda: numerics.xgcd(a, m)
+
+def _case_modinv(numerics, rng, bits):
+    (a, m) = _coprime_pair(rng, bits)
+    return lambda: numerics.modinv(a, m)
+
+def _case_prime_factors(numerics, rng, bits):
+    small = [p for p in numerics.primetable.primes() if p < tbnumerics.FACTOR_TRIAL_BOUND]
+    n = _random_prime(numerics, rng, FACTOR_SPLIT_BITS) * \
+        _random_prime(numerics, rng, FACTOR_SPLIT_BITS)
+    while n.bit_length() < bits:
+        n *= rng.choice(small)
+
+    def run():
+        # a cached answer would time the cache
+        tbnumerics.factor_cache_clear()
+        return numerics.prime_factors(n)
+    return run
+
+def _case_generate_keypair(numerics, rng, bits):
+    keygen = tbkeygen.tbkeygen(bits, False, False, 0, tbkeygen.EXPONENT_F4)
+    keygen.numerics = numerics
+    return keygen.generate_keypair
+
+def _case_der_encode(numerics, rng, bits):
+    # the encoder only looks at the sizes, any integers will do
+    (n, d) = (_random_odd(rng, bits), rng.getrandbits(bits))
+    (p, q, dp, dq, qinv) = [rng.getrandbits(bits // 2) for i in range(5)]
+
+    def run():
+        tbder.encode_rsa_private_key(n, 65537, d, p, q, dp, dq, qinv)
+        return tbder.encode_rsa_public_key(n, 65537)
+    return run
+
+BENCHMARKS = {
+    "gen_nbit_prime": _case_gen_nbit_prime,
+    "is_prime": _case_is_prime,
+    "egcd_iter": _case_egcd_iter,
+    "xgcd": _case_xgcd,
+    "modinv": _case_modinv,
+    "prime_factors": _case_prime_factors,
+    "generate_keypair": _case_generate_keypair,
+    "der_encode": _case_der_encode,
+}
+
+
+log = logging.getLogger(__name__)
+
+
+class tbbench:
+    def __init__(self, _repeat=DEFAULT_REPEAT, _warmup=DEFAULT_WARMUP, _seed=None,
+                 _verbose=False, _debug=False):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbbench"
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
+        self.repeat = max(1, int(_repeat))
+        self.warmup = max(0, int(_warmup))
+        self.seed = _seed
+
+    '''
+        PUBLIC
+    '''
+
+    '''
+        run the named cases (all of them if names is empty) at each
+        size in sizes; returns the report
+    '''
+    def run(self, names=None, sizes=DEFAULT_SIZES):
+        return {"meta": self.meta(), "results": list(self.results(names, sizes))}
+
+    '''
+        the same, yielding each case's result as soon as it is timed
+    '''
+    def results(self, names=None, sizes=DEFAULT_SIZES):
+        names = list(names) if names else list(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                raise Exception(self.MOD_PREFIX + "::results: unknown benchmark " + name +
+                                ", choose from " + ", ".join(BENCHMARKS))
+
+        for name in names:
+            for bits in sizes:
+                samples = self.time_case(name, int(bits))
+                result = {"name": name, "bits": int(bits), "samples": samples}
+                result.update(summarize(samples))
+                self.__verbose("%s", format_result(result))
+                yield result
+
+    '''
+        the samples, in seconds, of one case at one size
+    '''
+    def time_case(self, name, bits):
+        if self.seed is None:
+            rng = random.SystemRandom()
+        else:
+            rng = random.Random(str(self.seed) + ":" + name + ":" + str(bits))
+        numerics = tbnumerics.tbnumerics()
+        numerics.sysrandom = rng
+        fn = BENCHMARKS[name](numerics, rng, bits)
+
+        for i in range(self.warmup):
+            fn()
+        samples = []
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+            self.__dbgprnt("time_case: %s %d sample %d: %s", name, bits, i, samples[-1])
+        return samples
+
+    def meta(self):
+        return {"backend": tbnumerics.backend_name(),
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "seed": self.seed,
+                "repeat": self.repeat,
+                "warmup": self.warmup,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+    def set_debug(self, b_dbg):
+        if b_dbg:
+            self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
+        else:
+            self.DEBUG = False
+
+    def set_verbose(self, b_vrb):
+        if b_vrb:
+            self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
+        else:
+            self.VERBOSE = False
+
+    '''
+        PRIVATE
+    '''
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
+
+    def __verbose(self, msg, *args):
+        if True == self.VERBOSE or log.isEnabledFor(logging.INFO):
+            log.info(msg, *args)
+
+
+'''
+   REPORTS
+'''
+def save_report(report, fname):
+    with open(fname, "w") as f:
+        json.dump(report, f, indent=1)
+        f.write("\n")
+
+def load_report(fname):
+    with open(fname) as f:
+        return json.load(f)
+
+def format_result(result):
+    return (format(result["name"], "<18") + format(result["bits"], ">6") +
+            "  median " + format(result["median"] * 1000, ">12.3f") + " ms" +
+            "  p90 " + format(result["p90"] * 1000, ">12.3f") + " ms" +
+            "  n=" + str(result["count"]))
+
+'''
+   compare
+
+   (rows, regressions, unmatched) for two reports: a row (name, bits,
+     base median, new median, percent change) for every case in both,
+     the rows more than threshold percent slower, and (name, bits,
+     report) for every case found only in the "base" or only in the
+     "new" report.  Against a zero baseline any time at all is an
+     infinite change.
+'''
+def compare(base, new, threshold=DEFAULT_THRESHOLD):
+    base_medians = {(r["name"], r["bits"]): r["median"] for r in base["results"]}
+    new_keys = set((r["name"], r["bits"]) for r in new["results"])
+    rows = []
+    unmatched = [(name, bits, "base") for (name, bits) in base_medians
+                 if (name, bits) not in new_keys]
+    for r in new["results"]:
+        key = (r["name"], r["bits"])
+        if key not in base_medians:
+            unmatched.append((r["name"], r["bits"], "new"))
+            continue
+        old = base_medians[key]
+        if old:
+            change = (r["median"] - old) / old * 100.0
+        else:
+            change = math.inf if r["median"] > 0 else 0.0
+        rows.append((r["name"], r["bits"], old, r["median"], change))
+    regressions = [row for row in rows if row[4] > threshold]
+    return (rows, regressions, unmatched)
+
+
+'''
+ EOF
+'''
@@ -0,0 +1,306 @@
+'''
+  tbder
+
+  DER encoding and decoding of PKCS #1 RSA keys.
+
+  Encoding: every TLV size is computed up front from int.bit_length, the output
+  buffer is allocated once at its final size, and each TLV is written
+  into it exactly once, front to back.  The functions keep no state
+  and touch no globals, so they are safe to call from threads and
+  worker processes.
+
+  Decoding works on a memoryview of the caller's buffer (bytes, or an
+  mmap of the key file) and copies nothing: the parse records where
+  each INTEGER lies, and an INTEGER becomes a Python int only when it
+  is first asked for.
+
+  RSAPublicKey ::= SEQUENCE {
+      modulus           INTEGER,  -- n
+      publicExponent    INTEGER   -- e
+  }
+
+  RSAPrivateKey ::= SEQUENCE {
+      version           Version,  -- 0, two-prime
+      modulus           INTEGER,  -- n
+      publicExponent    INTEGER,  -- e
+      privateExponent   INTEGER,  -- d
+      prime1            INTEGER,  -- p
+      prime2            INTEGER,  -- q
+      exponent1         INTEGER,  -- d mod (p-1)
+      exponent2         INTEGER,  -- d mod (q-1)
+      coefficient       INTEGER   -- (1/q) mod p
+  }
+
+  The same keys can be wrapped with the rsaEncryption algorithm
+  identifier, as PKCS #8 PrivateKeyInfo and X.509 SubjectPublicKeyInfo:
+
+  PrivateKeyInfo ::= SEQUENCE {
+      version           INTEGER,  -- 0
+      algorithm         AlgorithmIdentifier,
+      privateKey        OCTET STRING  -- RSAPrivateKey
+  }
+
+  SubjectPublicKeyInfo ::= SEQUENCE {
+      algorithm         AlgorithmIdentifier,
+      subjectPublicKey  BIT STRING    -- RSAPublicKey
+  }
+'''
+
+TAG_INTEGER = 0x02
+TAG_BIT_STRING = 0x03
+TAG_OCTET_STRING = 0x04
+TAG_SEQUENCE = 0x30     # SEQUENCE, constructed
+
+# AlgorithmIdentifier { rsaEncryption (1.2.840.113549.1.1.1), NULL }
+RSA_ALGORITHM_ID = bytes.fromhex("300d06092a864886f70d0101010500")
+
+'''
+   number of bytes of the length field for a content of n bytes
+'''
+def length_size(n):
+    if n < 0x80:
+        return 1
+    return 1 + (n.bit_length() + 7)//8
+
+'''
+   number of content bytes of an INTEGER: minimal two's complement,
+   so a positive value whose top bit is set gets a leading 0x00
+'''
+def integer_content_size(v):
+    if v < 0:
+        v = ~v
+    return v.bit_length()//8 + 1
+
+def integer_size(v):
+    c = integer_content_size(v)
+    return 1 + length_size(c) + c
+
+'''
+   write the length field for n content bytes at buf[off], return the
+   offset after it
+'''
+def write_length(buf, off, n):
+    if n < 0x80:
+        buf[off] = n
+        return off + 1
+    nbytes = (n.bit_length() + 7)//8
+    buf[off] = 0x80 | nbytes
+    buf[off+1:off+1+nbytes] = n.to_bytes(nbytes, 'big')
+    return off + 1 + nbytes
+
+def write_integer(buf, off, v):
+    c = integer_content_size(v)
+    buf[off] = TAG_INTEGER
+    off = write_length(buf, off + 1, c)
+    buf[off:off+c] = v.to_bytes(c, 'big', signed=True)
+    return off + c
+
+'''
+   encode_integer_sequence
+
+   DER of SEQUENCE { INTEGER, INTEGER, ... } for the given values
+'''
+def encode_integer_sequence(values):
+    content = 0
+    for v in values:
+        content += integer_size(v)
+
+    buf = bytearray(1 + length_size(content) + content)
+    buf[0] = TAG_SEQUENCE
+    off = write_length(buf, 1, content)
+    for v in values:
+        off = write_integer(buf, off, v)
+    return bytes(buf)
+
+def encode_integer(v):
+    buf = bytearray(integer_size(v))
+    write_integer(buf, 0, v)
+    return bytes(buf)
+
+def encode_rsa_public_key(n, e):
+    return encode_integer_sequence((n, e))
+
+def encode_rsa_private_key(n, e, d, p, q, dp, dq, qinv):
+    return encode_integer_sequence((0, n, e, d, p, q, dp, dq, qinv))
+
+def write_header(buf, off, tag, n):
+    buf[off] = tag
+    return write_length(buf, off + 1, n)
+
+def header_size(n):
+    return 1 + length_size(n)
+
+'''
+   encode_pkcs8_private_key
+
+   PrivateKeyInfo around the DER of an RSAPrivateKey
+'''
+def encode_pkcs8_private_key(rsa_der):
+    version = 3     # INTEGER 0
+    content = version + len(RSA_ALGORITHM_ID) + header_size(len(rsa_der)) + len(rsa_der)
+
+    buf = bytearray(header_size(content) + content)
+    off = write_header(buf, 0, TAG_SEQUENCE, content)
+    off = write_integer(buf, off, 0)
+    buf[off:off+len(RSA_ALGORITHM_ID)] = RSA_ALGORITHM_ID
+    off = write_header(buf, off + len(RSA_ALGORITHM_ID), TAG_OCTET_STRING, len(rsa_der))
+    buf[off:] = rsa_der
+    return bytes(buf)
+
+'''
+   encode_spki_public_key
+
+   SubjectPublicKeyInfo around the DER of an RSAPublicKey; the BIT
+   STRING starts with its count of unused bits, 0
+'''
+def encode_spki_public_key(rsa_der):
+    bits = 1 + len(rsa_der)
+    content = len(RSA_ALGORITHM_ID) + header_size(bits) + bits
+
+    buf = bytearray(header_size(content) + content)
+    off = write_header(buf, 0, TAG_SEQUENCE, content)
+    buf[off:off+len(RSA_ALGORITHM_ID)] = RSA_ALGORITHM_ID
+    off = write_header(buf, off + len(RSA_ALGORITHM_ID), TAG_BIT_STRING, bits)
+    buf[off] = 0
+    buf[off+1:] = rsa_der
+    return bytes(buf)
+
+
+'''
+   DECODING
+'''
+
+MOD_PREFIX = "MODULE tbencryptlib::tbder"
+
+'''
+   read the length field at view[off], return (length, offset after it)
+'''
+def read_length(view, off):
+    if off >= len(view):
+        raise Exception(MOD_PREFIX + "::read_length: truncated at " + str(off))
+    first = view[off]
+    if first < 0x80:
+        return (first, off + 1)
+    nbytes = first & 0x7f
+    if nbytes == 0 or nbytes > 4 or off + 1 + nbytes > len(view):
+        raise Exception(MOD_PREFIX + "::read_length: bad length at " + str(off))
+    return (int.from_bytes(view[off+1:off+1+nbytes], 'big'), off + 1 + nbytes)
+
+'''
+   read the TLV at view[off], return (tag, content start, content end)
+'''
+def read_tlv(view, off, end=None):
+    if end is None:
+        end = len(view)
+    if off >= end:
+        raise Exception(MOD_PREFIX + "::read_tlv: truncated at " + str(off))
+    tag = view[off]
+    (length, start) = read_length(view, off + 1)
+    if start + length > end:
+        raise Exception(MOD_PREFIX + "::read_tlv: length " + str(length) +
+                        " at " + str(off) + " runs past the end")
+    return (tag, start, start + length)
+
+
+class tbderintegers:
+    '''
+       lazily decoded SEQUENCE { INTEGER, ... }
+    '''
+    __slots__ = ("view", "spans", "values")
+
+    def __init__(self, data, off=0, end=None):
+        self.view = memoryview(data)
+        if end is None:
+            end = len(self.view)
+        (tag, start, stop) = read_tlv(self.view, off, end)
+        if tag != TAG_SEQUENCE:
+            raise Exception(MOD_PREFIX + "::tbderintegers: expected SEQUENCE, got tag " +
+                            hex(tag))
+        if stop != end:
+            raise Exception(MOD_PREFIX + "::tbderintegers: trailing data after SEQUENCE")
+
+        self.spans = []
+        while start < stop:
+            (tag, cstart, cend) = read_tlv(self.view, start, stop)
+            if tag != TAG_INTEGER or cstart == cend:
+                raise Exception(MOD_PREFIX + "::tbderintegers: expected INTEGER at " +
+                                str(start))
+            self.spans.append((cstart, cend))
+            start = cend
+        self.values = [None]*len(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, i):
+        v = self.values[i]
+        if v is None:
+            (start, end) = self.spans[i]
+            v = int.from_bytes(self.view[start:end], 'big', signed=True)
+            self.values[i] = v
+        return v
+
+def decode_integer_sequence(data, off=0, end=None):
+    return tbderintegers(data, off, end)
+
+'''
+   unwrap_rsa_key
+
+   locate the PKCS #1 key in a PKCS #1, PKCS #8 or SubjectPublicKeyInfo
+   DER; returns (offset, end) of the RSAPrivateKey or RSAPublicKey
+   inside data, which is not copied
+'''
+def unwrap_rsa_key(data):
+    view = memoryview(data)
+    (tag, start, stop) = read_tlv(view, 0)
+    if tag != TAG_SEQUENCE:
+        raise Exception(MOD_PREFIX + "::unwrap_rsa_key: expected SEQUENCE, got tag " +
+                        hex(tag))
+    if stop != len(view):
+        raise Exception(MOD_PREFIX + "::unwrap_rsa_key: trailing data after SEQUENCE")
+
+    off = start
+    (tag, cstart, cend) = read_tlv(view, off, stop)
+    if tag == TAG_INTEGER:
+        # PKCS #1 unless the version is followed by an AlgorithmIdentifier
+        if cend >= stop or view[cend] != TAG_SEQUENCE:
+            return (0, stop)
+        off = cend
+        (tag, cstart, cend) = read_tlv(view, off, stop)
+        wrapped = TAG_OCTET_STRING
+    else:
+        wrapped = TAG_BIT_STRING
+
+    if tag != TAG_SEQUENCE or view[off:cend] != RSA_ALGORITHM_ID:
+        raise Exception(MOD_PREFIX + "::unwrap_rsa_key: not an rsaEncryption key")
+
+    (tag, cstart, cend) = read_tlv(view, cend, stop)
+    if tag != wrapped or cend != stop:
+        raise Exception(MOD_PREFIX + "::unwrap_rsa_key: bad key wrapper")
+    if tag == TAG_BIT_STRING:
+        if cstart == cend or view[cstart] != 0:
+            raise Exception(MOD_PREFIX + "::unwrap_rsa_key: bad BIT STRING")
+        cstart += 1
+    return (cstart, cend)
+
+'''
+   decode_rsa_key
+
+   lazily decoded RSAPrivateKey (9 INTEGERs, version 0) or RSAPublicKey
+   (2 INTEGERs); returns (integers, is_private).  Without off and end
+   the key may also be wrapped as PKCS #8 or SubjectPublicKeyInfo.
+'''
+def decode_rsa_key(data, off=None, end=None):
+    if off is None:
+        (off, end) = unwrap_rsa_key(data)
+    ints = tbderintegers(data, off, end)
+    if len(ints) == 9 and ints[0] == 0:
+        return (ints, True)
+    if len(ints) == 2:
+        return (ints, False)
+    raise Exception(MOD_PREFIX + "::decode_rsa_key: not a PKCS #1 RSA key (" +
+                    str(len(ints)) + " INTEGERs)")
+
+'''
+ EOF
+'''
@@ -0,0 +1,222 @@
+import logging
+import collections
+import concurrent.futures
+from . import tbpad
+from . import tbrsakey
+from . import tbmetrics
+
+'''
+  tbfilecrypt
+
+  RSA encryption of whole files.  The input is cut into chunks of the
+  largest message one padded block can carry, and each chunk becomes
+  one ciphertext block of exactly k bytes, the modulus size:
+
+      plaintext   | chunk 0 | chunk 1 | ... | last, maybe short |
+      ciphertext  | block 0 | block 1 | ... | block n-1         |
+
+  The padding records each chunk's length, so the ciphertext needs no
+  header, and a one-block file is what openssl rsautl/pkeyutl writes.
+  Blocks are handled BATCH_BLOCKS at a time, in the calling process or
+  in a pool of worker processes that each build the key (with its CRT
+  parameters, for decryption) once.  At most 2*workers batches are in
+  flight and results are written in input order as they complete, so
+  memory use does not depend on the size of the file.
+'''
+
+BATCH_BLOCKS = 64
+STREAM_BUFFER = 1 << 16
+
+'''
+   pool worker state and tasks
+'''
+_worker = None
+
+def _init_worker(fields, padding, hashname):
+    global _worker
+    _worker = (tbrsakey.tbrsakey(*fields), padding, hashname)
+
+def _encrypt_batch(data, chunk):
+    (key, padding, hashname) = _worker
+    return encrypt_blocks(key, data, chunk, padding, hashname)
+
+def _decrypt_batch(data):
+    (key, padding, hashname) = _worker
+    return decrypt_blocks(key, data, padding, hashname)
+
+'''
+   encrypt data chunk bytes at a time; returns the ciphertext blocks
+'''
+def encrypt_blocks(key, data, chunk, padding=tbpad.PAD_OAEP, hashname=tbpad.DEFAULT_HASH):
+    k = (key.n.bit_length() + 7)//8
+    view = memoryview(data)
+    out = []
+    for off in range(0, len(view), chunk):
+        em = tbpad.pad(bytes(view[off:off+chunk]), k, padding, hashname)
+        out.append(key.encrypt(int.from_bytes(em, 'big')).to_bytes(k, 'big'))
+    return b"".join(out)
+
+'''
+   decrypt data, a whole number of k byte blocks; returns the plaintext
+'''
+def decrypt_blocks(key, data, padding=tbpad.PAD_OAEP, hashname=tbpad.DEFAULT_HASH):
+    k = (key.n.bit_length() + 7)//8
+    view = memoryview(data)
+    out = []
+    for off in range(0, len(view), k):
+        c = int.from_bytes(view[off:off+k], 'big')
+        out.append(tbpad.unpad(key.decrypt(c).to_bytes(k, 'big'), k, padding, hashname))
+    return b"".join(out)
+
+
+log = logging.getLogger(__name__)
+
+
+class tbfilecrypt:
+    def __init__(self, _key, _padding=tbpad.PAD_OAEP, _hash=tbpad.DEFAULT_HASH, _workers=0,
+                 _verbose=False, _debug=False):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbfilecrypt"
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
+        if _padding not in tbpad.PADDINGS:
+            raise Exception(self.MOD_PREFIX + "::__init__: unknown padding " + str(_padding))
+        '''a tbrsakey, or a tbderkey from tbrsakey.load_key_file'''
+        if isinstance(_key, tbrsakey.tbderkey):
+            _key = _key.to_key()
+        self.key = _key
+        self.padding = _padding
+        self.hashname = _hash
+        '''workers > 1 processes blocks in a pool of worker processes'''
+        self.workers = _workers
+        self.block_size = (self.key.n.bit_length() + 7)//8
+        self.chunk_size = tbpad.max_message_size(self.block_size, _padding, _hash)
+
+    '''
+        PUBLIC
+    '''
+
+    '''
+        encrypt fin to fout, both binary file objects;
+        returns (bytes read, bytes written)
+    '''
+    def encrypt_stream(self, fin, fout):
+        return self.__run(fin, fout, self.chunk_size, True)
+
+    def decrypt_stream(self, fin, fout):
+        if not self.key.has_private():
+            raise Exception(self.MOD_PREFIX + "::decrypt_stream: no private key")
+        return self.__run(fin, fout, self.block_size, False)
+
+    def encrypt_file(self, inname, outname):
+        with open(inname, "rb") as fin, open(outname, "wb", buffering=STREAM_BUFFER) as fout:
+            return self.encrypt_stream(fin, fout)
+
+    def decrypt_file(self, inname, outname):
+        with open(inname, "rb") as fin, open(outname, "wb", buffering=STREAM_BUFFER) as fout:
+            return self.decrypt_stream(fin, fout)
+
+    '''
+        size of the ciphertext of nbytes of plaintext
+    '''
+    def encrypted_size(self, nbytes):
+        nblocks = (nbytes + self.chunk_size - 1)//self.chunk_size
+        return nblocks*self.block_size
+
+    def set_debug(self, b_dbg):
+        if b_dbg:
+            self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
+        else:
+            self.DEBUG = False
+
+    def set_verbose(self, b_vrb):
+        if b_vrb:
+            self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
+        else:
+            self.VERBOSE = False
+
+    '''
+        PRIVATE
+    '''
+
+    '''
+        read fin unit bytes per block, BATCH_BLOCKS blocks per batch,
+        and write the processed batches to fout in order
+    '''
+    def __run(self, fin, fout, unit, encrypt):
+        batch_size = unit*BATCH_BLOCKS
+        nin = 0
+        nout = 0
+
+        if self.workers is None or self.workers <= 1:
+            while True:
+                data = self.__read_batch(fin, batch_size, unit, encrypt)
+                if not data:
+                    break
+                nin += len(data)
+                nout += fout.write(self.__process(data, encrypt))
+            self.__verbose("__run: %d bytes in, %d out", nin, nout)
+            return (nin, nout)
+
+        k = self.key
+        fields = (k.n, k.e, k.d, k.p, k.q, k.dp, k.dq, k.qinv)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(fields, self.padding, self.hashname)) as pool:
+            pending = collections.deque()
+            while True:
+                data = self.__read_batch(fin, batch_size, unit, encrypt)
+                if data:
+                    nin += len(data)
+                    if encrypt:
+                        pending.append(pool.submit(_encrypt_batch, data, self.chunk_size))
+                    else:
+                        pending.append(pool.submit(_decrypt_batch, data))
+                # write the oldest batch once the window is full or input is done
+                while pending and (not data or len(pending) >= 2*self.workers):
+                    nout += fout.write(pending.popleft().result())
+                if not data:
+                    break
+
+        self.__verbose("__run: %d bytes in, %d out", nin, nout)
+        return (nin, nout)
+
+    def __process(self, data, encrypt):
+        if encrypt:
+            return encrypt_blocks(self.key, data, self.chunk_size, self.padding, self.hashname)
+        return decrypt_blocks(self.key, data, self.padding, self.hashname)
+
+    def __read_batch(self, fin, size, unit, encrypt):
+        data = fin.read(size)
+        # short reads from pipes: fill the batch so chunks stay aligned
+        while data and len(data) < size:
+            more = fin.read(size - len(data))
+            if not more:
+                break
+            data += more
+        if not encrypt and len(data) % unit:
+            raise Exception(self.MOD_PREFIX + "::decrypt_stream: input is not a whole " +
+                            "number of " + str(unit) + " byte blocks")
+        self.__dbgprnt("__read_batch: %d bytes", len(data))
+        return data
+
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
+
+    def __verbose(self, msg, *args):
+        if True == self.VERBOSE or log.isEnabledFor(logging.INFO):
+            log.info(msg, *args)
+
+
+'''
+ EOF
+'''
@@ -1,6 +1,11 @@
-import sys
+import time
 import random
+import logging
+import concurrent.futures
 from . import tbnumerics
+from . import tbmetrics
+from . import tbprimepool
+from . import tbrsakey
 
 '''
   Credits
@@ -18,11 +23,60 @@ from . import tbnumerics
 
 '''
 
+'''
+   Public exponent strategies
+     f4            E = 65537; a prime p with p-1 divisible by E is
+                   replaced, the other prime is kept
+     small-prime   E is a random SMALL_EXPONENT_BITS-bit prime,
+                   redrawn until it is coprime with phi
+     legacy-random E is a random prime with as many bits as N has 1
+                   bits (from_primepair: a random prime below phi)
+'''
+EXPONENT_F4 = "f4"
+EXPONENT_SMALL_PRIME = "small-prime"
+EXPONENT_LEGACY_RANDOM = "legacy-random"
+EXPONENT_STRATEGIES = (EXPONENT_F4, EXPONENT_SMALL_PRIME, EXPONENT_LEGACY_RANDOM)
+F4 = 65537
+SMALL_EXPONENT_BITS = 17
+
+'''
+   Runs in a pool worker process: generate one prime of nbits;
+   returns (prime, seconds spent on it)
+'''
+def _gen_prime_worker(nbits, method):
+    start = time.perf_counter()
+    numerics = tbnumerics.tbnumerics()
+    (p, ent) = numerics.gen_nbit_prime(nbits, method)
+    return (p, time.perf_counter() - start)
+
+'''
+   p and q are the only two searches of a keypair, so more workers
+   than this would sit idle
+'''
+MAX_PRIME_WORKERS = 2
+
+
+log = logging.getLogger(__name__)
+
+
 class tbkeygen:
-    def __init__(self, _bits=1024, _verbose=False, _debug=False):
+    def __init__(self, _bits=1024, _verbose=False, _debug=False, _workers=0,
+                 _exponent_strategy=EXPONENT_LEGACY_RANDOM):
         self.MOD_PREFIX = "MODULE tbencryptlib::tbkeygen"
-        self.DEBUG = _debug
-        self.VERBOSE = _verbose
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
+        '''stage timers, see tbmetrics'''
+        self.metrics = tbmetrics.get_metrics()
+        '''workers > 1 searches for p and q in parallel processes, at
+           most MAX_PRIME_WORKERS of them'''
+        self.workers = _workers
+        self.__pool = None
+        '''directory of prime pools to take p and q from, None: always generate'''
+        self.prime_pool = None
+        self.exponent_strategy = None
+        self.set_exponent_strategy(_exponent_strategy)
 
         '''initialize key parameters and bits'''
         self.p1 = 0
@@ -51,28 +105,37 @@ class tbkeygen:
         coprime = False
 
         while not coprime:
-            E = self.numerics.gen_prime_ceil(rsa_phi)
-            (gcd, x, y) = self.numerics.egcd_iter(E, rsa_phi)
+            with self.metrics.timer("keygen_e"):
+                if self.exponent_strategy == EXPONENT_LEGACY_RANDOM:
+                    E = self.numerics.gen_prime_ceil(rsa_phi)
+                else:
+                    E = self.__choose_exponent(rsa_phi)
+            with self.metrics.timer("keygen_d"):
+                (gcd, D, y) = self.numerics.xgcd(E, rsa_phi)
+            if 1 != gcd and self.exponent_strategy == EXPONENT_F4:
+                # the primes are given, so there is nothing to retry
+                raise Exception(self.MOD_PREFIX + "::generate_keypair_from_primepair:" +
+                                "GCD(65537, rsa_phi) NOT equal to 1")
             if 1 != gcd:
-                sys.stderr.write(self.MOD_PREFIX + ":The random prime" +
-                                 " generated is not coprime with phi, retry" + "\n")
-                sys.stderr.write(self.MOD_PREFIX + "::generate_keypair_from_primepair:" +
-                                "GCD(E, rsa_phi) NOT equal to 1: Equals: " + str(gcd) + "\n")
+                self.__errprnt("::generate_keypair_from_primepair: GCD(E, rsa_phi) is %d, "
+                               "not 1; the random prime generated is not coprime with phi, "
+                               "retry", gcd)
             else:
                 coprime = True
 
-        D = self.numerics.modinv(E, rsa_phi)
+        # the coefficient of E is its inverse mod rsa_phi
+        D = D % rsa_phi
 
         if 1 != (D*E)%rsa_phi:
-            sys.stderr.write(self.MOD_PREFIX + ":The computed private" +
-                             " exponent is not the inverse of the public" +
-                             " exponent modulus rsa_phi, retry")
+            self.__errprnt("::generate_keypair_from_primepair: the computed private"
+                           " exponent is not the inverse of the public exponent"
+                           " modulus rsa_phi")
             raise Exception(self.MOD_PREFIX + "::generate_keypair_from_primepair:" +
                              "D*E is NOT 1 mod rsa_phi")
 
-        self.__verbose("::N = " + str(self.N))
-        self.__verbose("::E = " + str(self.E))
-        self.__verbose("::D = " + str(self.D))
+        self.__verbose("::N = %d", self.N)
+        self.__verbose("::E = %d", self.E)
+        self.__verbose("::D = %d", self.D)
         return(N, E, D)
 
 
@@ -80,7 +143,12 @@ class tbkeygen:
 
     def generate_keypair(self):
         ent = 0.0
-        # self.N = 1
+        # each call makes a new keypair, only the pools are kept
+        self.p1 = 0
+        self.p2 = 0
+        self.E = 0
+        self.D = 0
+        self.N = 1
         rsa_phi = 1
 
         '''
@@ -89,52 +157,47 @@ class tbkeygen:
             numbers is generally the sum of the bit lengths of the
             individual multiplicands.
         '''
-        (rnd, ent) = self.numerics.gen_nbit_prime(self.bits/2 + 2)
-        self.__verbose("Prime p: " + str(rnd) + '\n')
-        self.p1 = rnd
-        self.N = self.N*rnd
-        rsa_phi = rsa_phi*(rnd-1)
-
-        (rnd, ent) = self.numerics.gen_nbit_prime(self.bits/2 - 2)
-        self.__verbose("Prime q: " + str(rnd) + '\n')
-        self.p2 = rnd
-        self.N = self.N*rnd
-        rsa_phi = rsa_phi*(rnd-1)
+        (p, q) = self.__gen_primes(self.bits/2 + 2, self.bits/2 - 2)
+        if self.exponent_strategy == EXPONENT_F4:
+            p = self.__fit_prime_to_exponent(p, F4)
+            q = self.__fit_prime_to_exponent(q, F4)
+        self.__verbose("Prime p: %d\n", p)
+        self.p1 = p
+        self.N = self.N*p
+        rsa_phi = rsa_phi*(p-1)
+
+        self.__verbose("Prime q: %d\n", q)
+        self.p2 = q
+        self.N = self.N*q
+        rsa_phi = rsa_phi*(q-1)
 
         # At this point, rsa_phi = (p-1)(q-1)
 
-        '''
-            This is not necessarily how a 'standard' algorithm might
-            generate the public exponent. Here, we take the number of
-            1 bits in the rsa_n value and use it to generate a probable
-            prime.  Should be good if the entropy was good, which it
-            normally is, but we *could* add a check here
-        # commonly used public exponent 65537
-        # self.E = 65537
-        '''
-        one_bits = bin(self.N).count("1")
-        (self.E,ent) = self.numerics.gen_nbit_prime(one_bits)
+        with self.metrics.timer("keygen_e"):
+            self.E = self.__choose_exponent(rsa_phi)
 
-        if 1 != self.numerics.greatest_common_divisor(self.E, rsa_phi):
-            sys.stderr.write(self.MOD_PREFIX + ":The random prime" +
-                             " generated is not coprime with phi, retry")
+        with self.metrics.timer("keygen_d"):
+            (gcd, D, y) = self.numerics.xgcd(self.E, rsa_phi)
+        if 1 != gcd:
+            self.__errprnt("::__generate_keypair: the random prime generated is not"
+                           " coprime with phi")
             raise Exception(self.MOD_PREFIX + "::__generate_keypair:" +
                             "GCD(E, rsa_phi) NOT equal to 1")
 
-        self.D = self.numerics.modinv(self.E, rsa_phi)
+        self.D = D % rsa_phi
 
         if 1 != (self.D*self.E)%rsa_phi:
-            sys.stderr.write(self.MOD_PREFIX + ":The computed private" +
-                             " exponent is not the inverse of the public" +
-                             " exponent modulus rsa_phi, retry")
+            self.__errprnt("::__generate_keypair: the computed private exponent is not"
+                           " the inverse of the public exponent modulus rsa_phi")
             raise Exception(self.MOD_PREFIX + "::__generate_keypair:" +
                             "D*E is NOT 1 mod rsa_phi")
 
-        self.__verbose("::N = " + str(self.N))
-        self.__verbose("::E = " + str(self.E))
-        self.__verbose("::D = " + str(self.D))
+        self.__verbose("::N = %d", self.N)
+        self.__verbose("::E = %d", self.E)
+        self.__verbose("::D = %d", self.D)
 
-        result = self.test_keys()
+        with self.metrics.timer("keygen_self_test"):
+            result = self.test_keys()
         if False == result:
             self.__errprnt("::__generate_keypair:Tests failed for" +
                            "generated keys")
@@ -142,54 +205,81 @@ class tbkeygen:
                             "Tests failed for generated keys, retry")
 
 
+    def set_exponent_strategy(self, strategy):
+        if strategy not in EXPONENT_STRATEGIES:
+            raise Exception(self.MOD_PREFIX + "::set_exponent_strategy: unknown" +
+                            " strategy " + str(strategy) + ", use one of " +
+                            ", ".join(EXPONENT_STRATEGIES))
+        self.exponent_strategy = strategy
+
+    def set_prime_pool(self, pool_dir):
+        self.prime_pool = pool_dir
+
+    def set_workers(self, workers):
+        if workers != self.workers:
+            self.close()
+        self.workers = workers
+
+    '''
+        shut down the worker pool, if one was started
+    '''
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
     def set_debug(self, b_dbg):
         if b_dbg:
             self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
         else:
             self.DEBUG = False
 
     def set_verbose(self, b_vrb):
         if b_vrb:
             self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
         else:
             self.VERBOSE = False
 
     def get_public_keypair(self):
-        self.__verbose("::returning: E:" + str(self.E) +
-                       " N:" + str(self.N))
+        self.__verbose("::returning: E:%d N:%d", self.E, self.N)
         return (self.E, self.N)
 
     def get_private_keypair(self):
-        self.__verbose("::returning: D:" + str(self.D) +
-                       " N:" + str(self.N))
+        self.__verbose("::returning: D:%d N:%d", self.D, self.N)
         return (self.D, self.N)
 
     def get_primes(self):
         return (self.p1, self.p2)
 
+    '''
+        RSA key context (tbrsakey) for the generated keypair, with
+        the CRT parameters precomputed for fast private operations
+    '''
+    def get_key_context(self):
+        return tbrsakey.tbrsakey(self.N, self.E, self.D, self.p1, self.p2)
+
 
     def test_keys(self):
         testnums = []
         for i in range(10):
             testnums.append(random.randint(32, 65535))
 
+        key = self.get_key_context()
         for i, msg in enumerate(testnums):
-            self.__verbose("\n\nTEST #" + str(i+1))
-            enc = pow(msg, self.E, self.N)
+            self.__verbose("\n\nTEST #%d", i+1)
+            enc = key.encrypt(msg)
 
-            dec = pow(enc, self.D, self.N)
+            dec = key.decrypt(enc)
 
             if dec != msg:
-                self.__verbose("TEST FAILED: encrypt of " +
-                               str(msg) + " = " + str(enc) +
-                               " decrypt of " + str(enc) +
-                               " = " + str(dec))
+                self.__verbose("TEST FAILED: encrypt of %d = %d decrypt of %d = %d",
+                               msg, enc, enc, dec)
                 return False
             else:
-                self.__verbose("TEST PASSED: encrypt of " +
-                               str(msg) + " = " + str(enc) +
-                               " decrypt of " + str(enc) +
-                               " = " + str(dec))
+                self.__verbose("TEST PASSED: encrypt of %d = %d decrypt of %d = %d",
+                               msg, enc, enc, dec)
             i = i+1
 
         return True
@@ -199,16 +289,95 @@ class tbkeygen:
         PRIVATE
     '''
 
-    def __dbgprnt(self,msg):
-        if True == self.DEBUG:
-            print(self.MOD_PREFIX + " DEBUG:" + msg)
+    '''
+        Get the primes for p and q, from the prime pool if one is set
+        and has them.  Missing primes are generated; in parallel mode
+        both searches run at once in the worker pool, which is started
+        on first use and kept for later keypairs.
+    '''
+    def __gen_primes(self, pbits, qbits):
+        pbits = int(pbits)
+        qbits = int(qbits)
+        p = None
+        q = None
+        if self.prime_pool is not None:
+            p = tbprimepool.take_prime(pbits, self.prime_pool)
+            q = tbprimepool.take_prime(qbits, self.prime_pool)
+            self.__dbgprnt("::__gen_primes: pool p: %s q: %s", p is not None, q is not None)
+
+        method = self.numerics.primality_method
+        if self.workers is None or self.workers < 2 or p is not None or q is not None:
+            if p is None:
+                with self.metrics.timer("keygen_p"):
+                    (p, ent) = self.numerics.gen_nbit_prime(pbits, method)
+            if q is None:
+                with self.metrics.timer("keygen_q"):
+                    (q, ent) = self.numerics.gen_nbit_prime(qbits, method)
+            return (p, q)
+
+        # both at once, each timed in its worker
+        if self.__pool is None:
+            self.__pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self.workers, MAX_PRIME_WORKERS))
+        fp = self.__pool.submit(_gen_prime_worker, pbits, method)
+        fq = self.__pool.submit(_gen_prime_worker, qbits, method)
+        (p, ptime) = fp.result()
+        (q, qtime) = fq.result()
+        self.metrics.add_time("keygen_p", ptime)
+        self.metrics.add_time("keygen_q", qtime)
+        return (p, q)
+
+    '''
+        Public exponent for rsa_phi under the exponent strategy.
+        The caller checks that it is coprime with rsa_phi.
+    '''
+    def __choose_exponent(self, rsa_phi):
+        if self.exponent_strategy == EXPONENT_F4:
+            return F4
+
+        if self.exponent_strategy == EXPONENT_SMALL_PRIME:
+            while True:
+                (E, ent) = self.numerics.gen_nbit_prime(SMALL_EXPONENT_BITS)
+                if rsa_phi % E != 0:    # E is prime
+                    return E
+
+        '''
+            This is not necessarily how a 'standard' algorithm might
+            generate the public exponent. Here, we take the number of
+            1 bits in the rsa_n value and use it to generate a probable
+            prime.  Should be good if the entropy was good, which it
+            normally is, but we *could* add a check here
+        '''
+        one_bits = self.numerics.backend.popcount(self.N)
+        (E, ent) = self.numerics.gen_nbit_prime(one_bits)
+        return E
+
+    '''
+        E is fixed and prime, so gcd(E, prime-1) != 1 only when E
+        divides prime-1; only such a prime is replaced
+    '''
+    def __fit_prime_to_exponent(self, prime, E):
+        nbits = prime.bit_length()
+        while (prime - 1) % E == 0:
+            self.__dbgprnt("::__fit_prime_to_exponent: E divides prime-1, replacing prime")
+            (prime, ent) = self.numerics.gen_nbit_prime(nbits)
+        return prime
+
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug("DEBUG:" + msg, *args)
 
-    def __verbose(self,msg):
-        if True == self.VERBOSE:
-            print(self.MOD_PREFIX + ":" + msg)
+    def __verbose(self, msg, *args):
+        if True == self.VERBOSE or log.isEnabledFor(logging.INFO):
+            log.info(msg, *args)
 
-    def __errprnt(self,msg):
-            print(self.MOD_PREFIX + " ERROR: " + msg)
+    def __errprnt(self, msg, *args):
+            log.error("ERROR: " + msg, *args)
 
 
 '''
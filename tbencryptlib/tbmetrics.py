@@ -0,0 +1,151 @@
+import sys
+import time
+import logging
+import threading
+import contextlib
+
+'''
+  tbmetrics
+
+  Counters and timers for the hot paths of tbnumerics, tbkeygen and
+  tbrsakey, shared by every instance in the process (get_metrics()):
+
+     counters   name -> count, e.g. prime_candidates, sieve_rejects,
+                mr_rounds, pow_calls
+     timers     name -> count, total and longest time in seconds,
+                e.g. keygen_p, keygen_q, keygen_e, keygen_d,
+                keygen_self_test, encode
+
+  snapshot() returns them as a dict, prometheus() as the Prometheus
+  text exposition format, counters as <prefix>_<name>_total and timers
+  as summaries <prefix>_<name>_seconds_count / _sum.  Worker processes
+  count in their own copy; their work shows only where the parent
+  merge()s the snapshots they send back.
+
+  The library logs through logging, to the logger of each module.  The
+  messages are %-format strings with their arguments passed separately,
+  so nothing is formatted unless the record is going to be emitted.
+  log_to_console() gives a logger a stdout handler, which is what the
+  classes' _verbose/_debug flags turn on.
+'''
+
+DEFAULT_PREFIX = "tbencrypt"
+CONSOLE_FORMAT = "%(name)s:%(message)s"
+
+
+class tbmetrics:
+    def __init__(self):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbmetrics"
+        self.counters = {}
+        self.timers = {}
+        self.__lock = threading.Lock()
+
+    '''
+        PUBLIC
+    '''
+    '''
+        called for every prime candidate and Miller-Rabin round, so no
+        lock: the library counts from one thread, and a count lost to a
+        race between threads costs less than a lock on every call
+    '''
+    def incr(self, name, n=1):
+        counters = self.counters
+        counters[name] = counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        with self.__lock:
+            t = self.timers.get(name)
+            if t is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                t[0] += 1
+                t[1] += seconds
+                if seconds > t[2]:
+                    t[2] = seconds
+
+    '''
+        with metrics.timer("name"): ... adds the time spent in the block
+    '''
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    '''
+        add in a snapshot() taken elsewhere, e.g. in a worker process
+    '''
+    def merge(self, snap):
+        with self.__lock:
+            for (name, n) in snap["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for (name, t) in snap["timers"].items():
+                cur = self.timers.get(name)
+                if cur is None:
+                    self.timers[name] = [t["count"], t["total"], t["max"]]
+                else:
+                    cur[0] += t["count"]
+                    cur[1] += t["total"]
+                    if t["max"] > cur[2]:
+                        cur[2] = t["max"]
+
+    def reset(self):
+        with self.__lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        with self.__lock:
+            return {"counters": dict(self.counters),
+                    "timers": {name: {"count": t[0], "total": t[1], "max": t[2],
+                                      "mean": t[1] / t[0]}
+                               for (name, t) in self.timers.items()}}
+
+    def prometheus(self, prefix=DEFAULT_PREFIX):
+        snap = self.snapshot()
+        lines = []
+        for name in sorted(snap["counters"]):
+            metric = prefix + "_" + name + "_total"
+            lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + " " + str(snap["counters"][name]))
+        for name in sorted(snap["timers"]):
+            t = snap["timers"][name]
+            metric = prefix + "_" + name + "_seconds"
+            lines.append("# TYPE " + metric + " summary")
+            lines.append(metric + "_count " + str(t["count"]))
+            lines.append(metric + "_sum " + repr(t["total"]))
+            lines.append("# TYPE " + metric + "_max gauge")
+            lines.append(metric + "_max " + repr(t["max"]))
+        return "\n".join(lines) + "\n"
+
+
+'''
+   the process-wide metrics
+'''
+_metrics = tbmetrics()
+
+def get_metrics():
+    return _metrics
+
+'''
+   unless the application has set up logging itself (which then
+   decides what is shown), lower logger's level to level and give it
+   a stdout handler (once)
+'''
+def log_to_console(logger, level=logging.DEBUG):
+    if logging.getLogger().handlers:
+        return
+    if not any(getattr(h, "tb_console", False) for h in logger.handlers):
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handler.tb_console = True
+        logger.addHandler(handler)
+    if logger.level == logging.NOTSET or logger.level > level:
+        logger.setLevel(level)
+
+
+'''
+ EOF
+'''
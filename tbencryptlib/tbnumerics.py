@@ -1,7 +1,17 @@
 import sys
+import os
 import random
 from random import SystemRandom
 import math
+import bisect
+import collections
+import logging
+import multiprocessing
+import multiprocessing.connection
+try:
+    from . import tbmetrics
+except ImportError:
+    import tbmetrics
 
 '''Credits
   Abstract Algebra: Theory and Applications
@@ -17,50 +27,481 @@ import math
   For further information, see www.cacr.math.uwaterloo.ca/hac
 
   *** ROUTINES ***
-  __is_probable_prime(self,n):
+  __is_probable_prime(self,n,method):
   factor_powers_of_p(self, n, p):
   factor_powers_of_two(self, n):
+  bit_length(self, _x)
   prime_factors(self, n):
+  prime_factors2(self, n, _i):
+  factorize(self, n, start)
   egcd_iter(self, a, b)
+  xgcd(self, a, b)
   egcd(self, a, b)  ## recursive version
   greatest_common_divisor(self, a, b)
   modinv(self, a, m)
-  is_prime(self, prime_candidate)
-  gen_nbit_prime(self,nbits)
+  modinv_batch(self, values, m)
+  is_prime(self, prime_candidate, method)
+  jacobi(self, a, n)
+  lucas_sequence(self, n, P, Q, k)
+  set_primality_method(self, method)
+  mr_rounds(self, nbits)
+  search_prime(self, lo, hi, method, stop)
+  gen_nbit_prime(self,nbits,method,workers)
   gen_prime_ceil(self,ceil)
   next_multiple_of(self, num, blksize)
   sum_of_digits(self, _x)
+
+  tbprimetable:
+  is_small_prime(self, n)
+  primes(self)
+  primes_in_range(self, lo, hi)
+  passes_trial_division(self, n)
+  get_prime_table(limit)
+  factor_cache_get(n), factor_cache_put(n, factors), factor_cache_clear()
+
+  set_backend(name)
+  get_backend()
+  backend_name()
+
+  Counters (tbmetrics.get_metrics()): prime_candidates, sieve_rejects,
+  trial_division_rejects, mr_rounds, bpsw_tests, next_prime_calls,
+  pow_calls
+'''
+
+'''
+   SMALL PRIME TABLE
+
+   The table is an odd-only bitset sieve of Eratosthenes: bit i stands
+   for the odd number 2i+1.  It is written to the cache directory the
+   first time it is built and loaded from there afterwards.
+   Set TBENCRYPT_CACHE_DIR to move the cache, or to an empty string to
+   keep the table in memory only.
+'''
+SMALL_PRIME_LIMIT = 1 << 20       # table covers 0 <= n < SMALL_PRIME_LIMIT
+TRIAL_DIVISION_BOUND = 1 << 12    # candidates are trial divided by primes below this
+SIEVE_SEGMENT = 1 << 18           # odd numbers per segment in primes_in_range
+PRIME_TABLE_MAGIC = b"TBPT0001"
+SEARCH_SIEVE_BOUND = 1 << 16      # prime search sieves candidates with primes below this
+SEARCH_WINDOW_MIN = 256           # odd candidates sieved at a time by the prime search
+NEXT_PRIME_TRIES = 32             # random starts before a next_prime search walks from lo
+
+'''
+   FACTORIZATION PARAMETERS
+
+   factorize() trial divides by the primes below FACTOR_TRIAL_BOUND,
+   then splits each composite cofactor with Brent's variant of Pollard
+   rho (RHO_BATCH differences multiplied together per gcd, at most
+   RHO_ITERATIONS steps per attempt), then Pollard p-1 with bound
+   PM1_BOUND, then rho again with fresh constants until it succeeds.
+   The last FACTOR_CACHE_SIZE results are kept, least recently used
+   dropped first.
+'''
+FACTOR_TRIAL_BOUND = 1 << 16
+RHO_BATCH = 128
+RHO_ITERATIONS = 1 << 18
+PM1_BOUND = 1 << 16
+FACTOR_CACHE_SIZE = 1024
+
+'''
+   RADIX CONVERSION PARAMETERS
+
+   factor_powers_of_p() splits n in halves by the powers p**(2**k),
+   kept per base (at most RADIX_TOWER_CACHE bases) so that repeated
+   conversions to the same base share them.  Pieces below
+   p**(2**RADIX_BASECASE_LEVEL) are converted a digit at a time.
+   Bases 2, 8 and 16 are read off format(), other powers of two are
+   split with shifts.  sum_of_digits() converts to base
+   10**SUM_DIGITS_CHUNK and sums the digits of each chunk.
+'''
+RADIX_TOWER_CACHE = 8
+RADIX_BASECASE_LEVEL = 4
+RADIX_FORMATS = {2: 'b', 8: 'o', 16: 'x'}
+SUM_DIGITS_CHUNK = 18
+
+'''
+   EXTENDED GCD PARAMETERS
+
+   xgcd() runs Lehmer's algorithm: the quotients are found from the
+   leading LEHMER_DIGIT_BITS bits while they are certain to be those of
+   the full numbers (Knuth, TAOCP 4.5.2, Algorithm L), and the full
+   numbers are updated once per batch of quotients.  From
+   HGCD_THRESHOLD bits up it first halves the numbers with the
+   recursive half-gcd (Thull and Yap; Moller), which finds the
+   quotients of the top half of the bits by the same method.
+'''
+LEHMER_DIGIT_BITS = 60
+HGCD_THRESHOLD = 2048
+
+'''
+   MILLER-RABIN PARAMETERS
+
+   (bound, bases): the bases give an exact answer for every n < bound
+   (Jaeschke; Sorenson and Webster).
+
+   (bits, rounds): random-base rounds for candidates of at least that
+   many bits.  HAC Table 4.4 (error below 2**-80) up to 550 bits, the
+   FIPS 186-5 Table B.1 minimums for RSA primes above that.  Below
+   100 bits HAC has no entry and the 4**-rounds worst case is used.
+'''
+MR_DETERMINISTIC_BASES = [
+    (2047, (2,)),
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051, (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+    (3317044064679887385961981, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)),
+]
+
+PRIMALITY_MR = "miller-rabin"
+PRIMALITY_BPSW = "bpsw"
+
+MR_ROUNDS = [(1536, 4), (550, 5), (450, 6), (400, 7), (350, 8), (300, 9),
+             (250, 12), (200, 15), (150, 18), (100, 27), (0, 40)]
+
+'''
+   ARITHMETIC BACKEND
+
+   The big-number primitives tbnumerics and tbrsakey use: modular
+   exponentiation, inversion, gcd and extended gcd, probable primes and
+   popcount, and integer, the backend's own integer type for long products.
+   gmpy2 is used when it can be imported; otherwise CPython ints, where
+   invert, gcdext, is_prime, is_bpsw and next_prime are None and tbnumerics
+   falls back on its own xgcd, Miller-Rabin, Lucas and sieve code.
+   Set TBENCRYPT_BACKEND=python to keep gmpy2 out, and check
+   backend_name() to see which one is active.
+'''
+BACKEND_PYTHON = "python"
+BACKEND_GMPY2 = "gmpy2"
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+
+class tbpybackend:
+    name = BACKEND_PYTHON
+    integer = int
+    powmod = staticmethod(pow)
+    gcd = staticmethod(math.gcd)
+    invert = None
+    gcdext = None
+    is_prime = None
+    is_bpsw = None
+    next_prime = None
+
+    @staticmethod
+    def popcount(x):
+        return bin(x).count("1")
+
+
+class tbgmpy2backend:
+    '''
+       the functions return gmpy2 mpz values, which mix freely with
+       ints; convert with int() before to_bytes or pickling
+    '''
+    name = BACKEND_GMPY2
+
+    def __init__(self):
+        self.integer = gmpy2.mpz
+        self.powmod = gmpy2.powmod
+        self.gcd = gmpy2.gcd
+        self.invert = gmpy2.invert      # raises ZeroDivisionError without an inverse
+        self.gcdext = gmpy2.gcdext      # (g, s, t) with a*s + b*t = g
+        self.is_prime = gmpy2.is_prime  # (n, rounds): Miller-Rabin rounds
+        self.is_bpsw = gmpy2.is_bpsw_prp
+        self.next_prime = gmpy2.next_prime
+        self.popcount = gmpy2.popcount
+
+
+def available_backends():
+    if gmpy2 is None:
+        return (BACKEND_PYTHON,)
+    return (BACKEND_GMPY2, BACKEND_PYTHON)
+
+_backend = None
+
+'''
+   select the backend by name, or the best available for None
+'''
+def set_backend(name=None):
+    global _backend
+    if name is None:
+        name = os.environ.get("TBENCRYPT_BACKEND") or available_backends()[0]
+    if name not in available_backends():
+        raise Exception("MODULE tbencryptlib::tbnumerics::set_backend: backend " +
+                        str(name) + " is not available")
+    _backend = tbgmpy2backend() if name == BACKEND_GMPY2 else tbpybackend()
+    return _backend
+
+def get_backend():
+    if _backend is None:
+        set_backend()
+    return _backend
+
+def backend_name():
+    return get_backend().name
+
+def default_cache_dir():
+    cache_dir = os.environ.get("TBENCRYPT_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "tbencryptlib")
+    return cache_dir
+
+
+class tbprimetable:
+    def __init__(self, _limit=SMALL_PRIME_LIMIT, _cache_dir=None):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbprimetable"
+        # keep the bitset a whole number of bytes
+        self.limit = max(16, (int(_limit) + 15)//16*16)
+        if _cache_dir is None:
+            _cache_dir = default_cache_dir()
+        self.cache_dir = _cache_dir
+        self.bits = None
+        self.__primes = None
+        self.__trial_product = 1
+
+        if not self.__load():
+            self.__sieve()
+            self.__save()
+
+        for p in self.__odd_primes_below(TRIAL_DIVISION_BOUND):
+            self.__trial_product *= p
+
+    '''
+       PRIVATE
+    '''
+
+    def __cache_file(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "smallprimes_" + str(self.limit) + ".bin")
+
+    def __load(self):
+        fname = self.__cache_file()
+        if fname is None:
+            return False
+        try:
+            with open(fname, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        hlen = len(PRIME_TABLE_MAGIC) + 8
+        if (data[:len(PRIME_TABLE_MAGIC)] != PRIME_TABLE_MAGIC or
+                int.from_bytes(data[len(PRIME_TABLE_MAGIC):hlen], 'big') != self.limit or
+                len(data) != hlen + self.limit//16):
+            return False
+
+        self.bits = data[hlen:]
+        return True
+
+    def __save(self):
+        fname = self.__cache_file()
+        if fname is None:
+            return
+        # write to a private temporary and rename, so concurrent
+        # processes never see a partial table
+        tmpname = fname + "." + str(os.getpid()) + ".tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmpname, "wb") as f:
+                f.write(PRIME_TABLE_MAGIC)
+                f.write(self.limit.to_bytes(8, 'big'))
+                f.write(self.bits)
+            os.replace(tmpname, fname)
+        except OSError:
+            # the cache is an optimization only
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+    def __sieve(self):
+        half = self.limit//2
+        flags = bytearray([1])*half
+        flags[0] = 0    # 1 is not prime
+        for i in range(1, (math.isqrt(self.limit) - 1)//2 + 1):
+            if flags[i]:
+                p = 2*i + 1
+                start = p*p//2
+                flags[start::p] = bytes(len(range(start, half, p)))
+
+        # pack one flag per byte into one flag per bit: flags[0] must end
+        # up as the least significant bit, hence the reversed string
+        bitstr = flags.translate(bytes.maketrans(b'\x00\x01', b'01'))[::-1]
+        self.bits = int(bitstr, 2).to_bytes(half//8, 'little')
+
+    def __bit(self, i):
+        return (self.bits[i >> 3] >> (i & 7)) & 1
+
+    def __odd_primes_below(self, hi):
+        hi = min(int(hi), self.limit)
+        for i in range(1, hi//2):
+            if self.__bit(i):
+                yield 2*i + 1
+
+    '''
+       PUBLIC
+    '''
+
+    def is_small_prime(self, n):
+        if n >= self.limit:
+            raise Exception(self.MOD_PREFIX + "::is_small_prime: " + str(n) +
+                            " is outside the table")
+        if n < 2:
+            return False
+        if n == 2:
+            return True
+        if n % 2 == 0:
+            return False
+        return 1 == self.__bit(n >> 1)
+
+    def primes(self):
+        if self.__primes is None:
+            self.__primes = [2] + list(self.__odd_primes_below(self.limit))
+        return self.__primes
+
+    '''
+       PRIMES_IN_RANGE
+
+       Generate the primes p with lo <= p < hi.  The table answers the
+       part of the range below its limit; beyond that the range is
+       sieved in segments of SIEVE_SEGMENT odd numbers.
+    '''
+    def primes_in_range(self, lo, hi):
+        lo = max(int(lo), 2)
+        hi = int(hi)
+        if lo >= hi:
+            return
+
+        if lo == 2:
+            yield 2
+
+        top = min(hi, self.limit)
+        for i in range(max(lo//2, 1), top//2):
+            if self.__bit(i):
+                yield 2*i + 1
+
+        if hi <= self.limit:
+            return
+
+        root = math.isqrt(hi - 1)
+        if root < self.limit:
+            base = self.primes()[1:bisect.bisect_right(self.primes(), root)]
+        else:
+            base = list(self.primes_in_range(3, root + 1))
+
+        seg_lo = max(lo, self.limit) | 1
+        while seg_lo < hi:
+            seg_hi = min(seg_lo + 2*SIEVE_SEGMENT, hi)
+            count = (seg_hi - seg_lo + 1)//2    # odd numbers in [seg_lo, seg_hi)
+            flags = bytearray([1])*count
+            for p in base:
+                if p*p >= seg_hi:
+                    break
+                start = max(p*p, -(-seg_lo//p)*p)
+                if start % 2 == 0:
+                    start += p
+                idx = (start - seg_lo)//2
+                if idx < count:
+                    flags[idx::p] = bytes(len(range(idx, count, p)))
+
+            idx = flags.find(1)
+            while idx >= 0:
+                yield seg_lo + 2*idx
+                idx = flags.find(1, idx + 1)
+            seg_lo += 2*count
+
+    '''
+       PASSES_TRIAL_DIVISION
+
+       False if n has an odd prime factor below TRIAL_DIVISION_BOUND.
+       One gcd against the product of those primes replaces a few
+       hundred separate mods.
+    '''
+    def passes_trial_division(self, n):
+        return 1 == get_backend().gcd(n, self.__trial_product)
+
+
+_prime_tables = {}
+
+def get_prime_table(limit=SMALL_PRIME_LIMIT):
+    '''one table per limit, shared by every tbnumerics instance'''
+    table = _prime_tables.get(limit)
+    if table is None:
+        table = tbprimetable(limit)
+        _prime_tables[limit] = table
+    return table
+
+'''
+   FACTOR CACHE
+
+   n -> tuple of its prime factors, shared by every tbnumerics instance
 '''
+_factor_cache = collections.OrderedDict()
+
+def factor_cache_get(n):
+    factors = _factor_cache.get(n)
+    if factors is not None:
+        _factor_cache.move_to_end(n)
+    return factors
+
+def factor_cache_put(n, factors):
+    _factor_cache[n] = tuple(factors)
+    _factor_cache.move_to_end(n)
+    while len(_factor_cache) > FACTOR_CACHE_SIZE:
+        _factor_cache.popitem(last=False)
+
+def factor_cache_clear():
+    _factor_cache.clear()
+
+
+log = logging.getLogger(__name__)
+
 
 class tbnumerics:
     def __init__(self, _verbose=False, _debug=False):
         self.MOD_PREFIX = "MODULE tbencryptlib::tbnumerics"
-        self._mrpt_num_trials = 5 # number of bases to test
-        self.DEBUG = _debug
-        self.VERBOSE = _verbose
+        self._mrpt_num_trials = None # number of random bases to test, None: by bit size
+        self.primality_method = PRIMALITY_MR
+        self.DEBUG = False
+        self.VERBOSE = False
+        self.set_debug(_debug)
+        self.set_verbose(_verbose)
         self.sysrandom = SystemRandom()
+        self.primetable = get_prime_table()
+        self.backend = get_backend()
+        self.metrics = tbmetrics.get_metrics()
+        self.__power_towers = {}
 
     '''
        PRIVATE
     '''
 
-    def __dbgprnt(self,str):
-        if True == self.DEBUG:
-            sys.stdout.write(self.MOD_PREFIX + ":" +
-                             str + '\n')
+    '''
+        msg is a %-format string for args, formatted only when the
+        record is emitted: with the flag set, or when the application
+        has enabled the level for this module's logger
+    '''
+    def __dbgprnt(self, msg, *args):
+        if True == self.DEBUG or log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
 
-    def __verbose(self,str):
-        if True == self.VERBOSE:
-            sys.stdout.write(self.MOD_PREFIX + ":" +
-                             str + '\n')
+    def __verbose(self, msg, *args):
+        if True == self.VERBOSE or log.isEnabledFor(logging.INFO):
+            log.info(msg, *args)
 
-    def __errprnt(self,str):
-            sys.stderr.write(self.MOD_PREFIX + "ERROR: " +
-                             str + '\n')
+    def __errprnt(self, msg, *args):
+            log.error("ERROR: " + msg, *args)
 
-    def __is_probable_prime(self,n):
+    def __is_probable_prime(self,n,method=None):
         """
-        Miller-Rabin primality test.
+        Miller-Rabin or Baillie-PSW primality test.
 
         A return value of False means n is certainly not prime. A return value of
         True means n is very likely a prime.
@@ -73,36 +514,302 @@ class tbnumerics:
         # ensure n is odd
         if n % 2 == 0:
             return False
+        # small numbers are answered exactly by the prime table, the
+        # rest only reach Miller-Rabin if they survive trial division
+        if n < self.primetable.limit:
+            return self.primetable.is_small_prime(n)
+        if not self.primetable.passes_trial_division(n):
+            self.metrics.incr("trial_division_rejects")
+            return False
+        return self.__probable_prime_test(n, method)
+
+    '''
+       PROBABLE PRIME TEST
+
+       The Miller-Rabin or BPSW core of __is_probable_prime, for an odd
+       n at or above the prime table limit that has no factor below
+       TRIAL_DIVISION_BOUND, such as a survivor of the search sieve
+    '''
+    def __probable_prime_test(self, n, method=None):
+        if method is None:
+            method = self.primality_method
+        if method == PRIMALITY_BPSW and self.backend.is_bpsw is not None:
+            self.metrics.incr("bpsw_tests")
+            return bool(self.backend.is_bpsw(n))
+        if (method == PRIMALITY_MR and self.backend.is_prime is not None and
+                n >= MR_DETERMINISTIC_BASES[-1][0]):
+            rounds = self._mrpt_num_trials
+            if rounds is None:
+                rounds = self.mr_rounds(n.bit_length())
+            # at most: the backend stops at the first witness
+            self.metrics.incr("mr_rounds", rounds)
+            self.metrics.incr("pow_calls", rounds)
+            return bool(self.backend.is_prime(n, rounds))
+
         # write n-1 as 2**s * d
-        # repeatedly try to divide n-1 by 2
-        s = 0
         d = n-1
-        while True:
-            quotient, remainder = divmod(d, 2)
-            if remainder == 1:
-                break
-            s += 1
-            d = quotient
-        assert(2**s * d == n-1)
-
-        # test the base a to see whether it is a witness
-        # for the compositeness of n
-        def try_composite(a):
-            if pow(a, d, n) == 1:
+        s = (d & -d).bit_length() - 1
+        d >>= s
+
+        if method == PRIMALITY_BPSW:
+            # one strong base-2 test, then a strong Lucas test
+            self.metrics.incr("bpsw_tests")
+            if self.__mr_witness(2, d, s, n):
                 return False
-            for i in range(s):
-                if pow(a, 2**i * d, n) == n-1:
-                    return False
-            return True # n is definitely composite
-
-        for i in range(self._mrpt_num_trials):
-            # a = random.randrange(2, n)
-            a = self.sysrandom.randrange(2, n)
-            if try_composite(a):
+            return self.__is_strong_lucas_prp(n)
+        if method != PRIMALITY_MR:
+            raise Exception(self.MOD_PREFIX + "::__probable_prime_test:" +
+                            " unknown primality method " + str(method))
+
+        for a in self.__mr_bases(n):
+            if self.__mr_witness(a % n, d, s, n):
                 return False
 
         return True # no base tested showed n as composite
 
+    '''
+       MILLER-RABIN BASES
+
+       Below MR_DETERMINISTIC_BASES[-1][0] a fixed base set gives an
+       exact answer; above it random bases are drawn, as many as
+       mr_rounds() asks for at this bit length.
+    '''
+    def __mr_bases(self, n):
+        for bound, bases in MR_DETERMINISTIC_BASES:
+            if n < bound:
+                return bases
+
+        rounds = self._mrpt_num_trials
+        if rounds is None:
+            rounds = self.mr_rounds(n.bit_length())
+        return [self.sysrandom.randrange(2, n-1) for i in range(rounds)]
+
+    '''
+       MILLER-RABIN WITNESS
+
+       True if a proves n = 2**s * d + 1 composite.  a**d is the only
+       exponentiation; the rest of the chain is s-1 modular squarings.
+    '''
+    def __mr_witness(self, a, d, s, n):
+        if a == 0:
+            return False
+        self.metrics.incr("mr_rounds")
+        self.metrics.incr("pow_calls")
+        x = self.backend.powmod(a, d, n)
+        if x == 1 or x == n-1:
+            return False
+        for i in range(s-1):
+            x = x*x % n
+            if x == n-1:
+                return False
+        return True
+
+    '''
+       STRONG LUCAS PROBABLE PRIME TEST
+
+       Selfridge's method A: D is the first of 5, -7, 9, -11, ... with
+       (D/n) = -1, P = 1, Q = (1-D)/4.  With n+1 = 2**s * d, n is a strong
+       Lucas probable prime if U_d = 0 or V_(d*2**r) = 0 for some r < s.
+       n is odd, not a perfect square and free of small factors here.
+    '''
+    def __is_strong_lucas_prp(self, n):
+        if math.isqrt(n)**2 == n:
+            return False   # no D with (D/n) = -1 exists
+
+        D = 5
+        while True:
+            j = self.jacobi(D, n)
+            if j == -1:
+                break
+            if j == 0 and abs(D) != n:
+                return False
+            D = -D - 2 if D > 0 else -D + 2
+
+        P = 1
+        Q = (1 - D)//4
+
+        d = n+1
+        s = (d & -d).bit_length() - 1
+        d >>= s
+
+        U, V, Qk = self.lucas_sequence(n, P, Q, d)
+        if U == 0 or V == 0:
+            return True
+        for r in range(s-1):
+            # V_2k = V_k**2 - 2Q**k
+            V = (V*V - 2*Qk) % n
+            if V == 0:
+                return True
+            Qk = Qk*Qk % n
+        return False
+
+    '''
+       FIND A FACTOR
+
+       A nontrivial factor of n, which is odd and composite.
+    '''
+    def __find_factor(self, n):
+        r = math.isqrt(n)
+        if r*r == n:
+            return r
+
+        d = self.__pollard_brent(n, self.sysrandom.randrange(1, n-1), RHO_ITERATIONS)
+        if d is not None:
+            return d
+        d = self.__pollard_pm1(n, PM1_BOUND)
+        if d is not None:
+            return d
+        while True:
+            d = self.__pollard_brent(n, self.sysrandom.randrange(1, n-1))
+            if d is not None:
+                return d
+
+    '''
+       POLLARD RHO, BRENT'S VARIANT
+
+       Iterates y -> y**2 + c mod n, doubling the cycle length r each
+       round, and takes one gcd per RHO_BATCH products of |x - y|.  If a
+       batch collapses to n, the batch is replayed one gcd at a time.
+       Returns a factor, or None if this c fails or more than max_iter
+       steps are taken.
+    '''
+    def __pollard_brent(self, n, c, max_iter=None):
+        gcd = self.backend.gcd
+        y = self.sysrandom.randrange(1, n)
+        g = r = q = 1
+        x = ys = y
+        steps = 0
+        while g == 1:
+            x = y
+            for i in range(r):
+                y = (y*y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for i in range(min(RHO_BATCH, r - k)):
+                    y = (y*y + c) % n
+                    q = q*abs(x - y) % n
+                g = gcd(q, n)
+                k += RHO_BATCH
+            steps += 2*r
+            r *= 2
+            if g == 1 and max_iter is not None and steps > max_iter:
+                return None
+
+        if g == n:
+            while True:
+                ys = (ys*ys + c) % n
+                g = gcd(abs(x - ys), n)
+                if g > 1:
+                    break
+        if g == n:
+            return None
+        return int(g)
+
+    '''
+       POLLARD P-1
+
+       a = 2**M mod n, M the product of the prime powers up to bound;
+       gcd(a-1, n) is a factor when some p | n has a bound-smooth p-1
+    '''
+    def __pollard_pm1(self, n, bound):
+        powmod = self.backend.powmod
+        a = 2
+        primes = self.primetable.primes()
+        primes = primes[:bisect.bisect_right(primes, bound)]
+        self.metrics.incr("pow_calls", len(primes))
+        for p in primes:
+            pk = p
+            while pk*p <= bound:
+                pk *= p
+            a = powmod(a, pk, n)
+        g = self.backend.gcd(a - 1, n)
+        if 1 < g < n:
+            return int(g)
+        return None
+
+    '''
+       NEXT PRIME SEARCH
+
+       search_prime on a backend with next_prime: the first probable
+       prime at or above a random start, confirmed with method (so BPSW
+       still has the final say), restarting when it is not below hi.
+       After NEXT_PRIME_TRIES random starts the walk begins at lo, which
+       finds a prime if the range has one.  There is no sieve here, so
+       sieve_rejects is not counted.
+    '''
+    def __next_prime_search(self, lo, hi, method, stop):
+        next_prime = self.backend.next_prime
+        for attempt in range(NEXT_PRIME_TRIES + 1):
+            # next_prime(x) > x: start one below so that x itself counts
+            if attempt < NEXT_PRIME_TRIES:
+                p = self.sysrandom.randint(lo, hi-1) - 1
+            else:
+                p = lo - 1
+            while True:
+                if stop is not None and stop.is_set():
+                    return None
+                self.metrics.incr("next_prime_calls")
+                p = int(next_prime(p))
+                if p >= hi:
+                    break
+                self.metrics.incr("prime_candidates")
+                # next_prime has trial divided p already
+                if p < self.primetable.limit:
+                    if self.__is_probable_prime(p, method):
+                        return p
+                elif self.__probable_prime_test(p, method):
+                    return p
+        raise Exception(self.MOD_PREFIX + "::search_prime: no prime in [" + str(lo) +
+                        ", " + str(hi) + ")")
+
+    '''
+       RACING PRIME SEARCH
+
+       Run the prime search in several processes, each walking from
+       its own random start, so the candidate windows are split among
+       them.  The first process to find a probable prime sends it back
+       as bytes over its pipe; the rest are stopped as soon as it
+       arrives.  Not usable from inside a daemonic pool worker.
+    '''
+    def __race_search(self, lo, hi, method, workers):
+        stop = multiprocessing.Event()
+        procs = []
+        readers = []
+        winner = None
+        try:
+            for i in range(workers):
+                (reader, writer) = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=_race_worker,
+                                               args=(lo, hi, method, stop, writer),
+                                               daemon=True)
+                proc.start()
+                writer.close()
+                procs.append(proc)
+                readers.append(reader)
+
+            pending = list(readers)
+            while winner is None and pending:
+                for reader in multiprocessing.connection.wait(pending):
+                    try:
+                        winner = int.from_bytes(reader.recv_bytes(), 'big')
+                        break
+                    except EOFError:
+                        # this worker died without an answer
+                        pending.remove(reader)
+        finally:
+            stop.set()
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+            for reader in readers:
+                reader.close()
+
+        if winner is None:
+            raise Exception(self.MOD_PREFIX + "::__race_search: all " +
+                            str(workers) + " workers failed")
+        return winner
 
     '''
        PUBLIC
@@ -113,47 +820,49 @@ class tbnumerics:
 
     '''
     def factor_powers_of_p(self, n, p):
-        power_list = []
         '''
-        start with rn = n
-           find the highest possible exponent e
-           go through the exponents less than e,
-              the coefficient of each exponent is the quotient n//(p**e)
-           go to the next lower e with the remainder n%(p**e)
+        the digits of n in base p, most significant first:
+           n = sum(power_list[i] * p**(len(power_list)-1-i))
+        n is split by divmod with the largest cached p**(2**k) below it
+        and each half converted the same way, so the cost is a few
+        multiplications of the size of n instead of one division per digit
         '''
         try:
-            rn = int(n)
-            rp = int(p)
+            n = int(n)
+            p = int(p)
         except:
             self.__errprnt("::factor_powers_of_p:inputs must be integer type")
             raise
 
-        # find highest exponent
-        e=0;
-        while p**e <= n:
-            e = e+1
-
-        e = e-1
-        while e:
-             power_list.append(n//(p**e))
-             n = n % (p**e)
-             e = e - 1
-
-        power_list.append(n)
-        return power_list
+        if p < 2 or n < 0:
+            raise Exception(self.MOD_PREFIX + "::factor_powers_of_p: need n >= 0 and p >= 2, got n = " +
+                            str(n) + ", p = " + str(p))
+        if n < p:
+            return [n]
+        if p in RADIX_FORMATS:
+            return [int(c, p) for c in format(n, RADIX_FORMATS[p])]
 
+        power_list = []
+        if p & (p - 1) == 0:
+            shift = p.bit_length() - 1
+            k = 0
+            while shift << (k + 1) < n.bit_length():
+                k += 1
+            self.__shift_digits(n, shift, k, power_list)
+        else:
+            tower = self.__power_tower(p, n)
+            self.__radix_digits(self.backend.integer(n), p, tower, len(tower) - 1, power_list)
 
+        # the top half was padded out to a full 2**(k+1) digits
+        lead = 0
+        while power_list[lead] == 0:
+            lead += 1
+        return power_list[lead:]
 
     def factor_powers_of_two(self, n):
-        power_list = []
         '''
-        start with rn = n
-          divide: let ri = rn/2 until ri becomes 1
-           push the number of times divided onto the array
-           test rx = rn - 2^i
-            if this is: > 1 then let rn = rx
-                         == 1 push 0 on the array and return
-                         == 0 return
+        the exponents of the powers of two that sum to n, largest first,
+           e.g. 37 = 2**5 + 2**2 + 2**0 -> [5, 2, 0]
         '''
         try:
             rn = int(n)
@@ -161,60 +870,124 @@ class tbnumerics:
             self.__errprnt("::factor_powers_of_two:input must be integer type")
             raise
 
-        while rn>1:
-
-            rx = int(rn)
-            i=0
-            while rx>1:
-
-                ri = rx//2
-
-                if ri >= 1:
-                    i+=1
-                    rx = ri
-                    if rx==1:
-                        power_list.append(i)
-                        rn = rn - (2**i)
+        if rn < 0:
+            raise Exception(self.MOD_PREFIX + "::factor_powers_of_two: n must not be negative, got " +
+                            str(rn))
+        bits = format(rn, 'b')
+        top = len(bits) - 1
+        return [top - i for (i, c) in enumerate(bits) if c == '1']
 
-        if rn == 1:
-            power_list.append(0)
+    '''
+       RADIX CONVERSION HELPERS
 
-        return power_list
+       __power_tower: [p, p**2, p**4, ...] up to the first power whose
+          square exceeds n, extended as larger n come along
+       __radix_digits: append the 2**(k+1) digits (leading zeros
+          included) of n < tower[k]**2
+       __shift_digits: the same for p = 2**shift, by shifts and masks
+    '''
+    def __power_tower(self, p, n):
+        tower = self.__power_towers.get(p)
+        if tower is None:
+            if len(self.__power_towers) >= RADIX_TOWER_CACHE:
+                self.__power_towers.clear()
+            tower = [self.backend.integer(p)]
+            self.__power_towers[p] = tower
+
+        level = 0
+        while tower[level] * tower[level] <= n:
+            level += 1
+            if level == len(tower):
+                tower.append(tower[-1] * tower[-1])
+        return tower[:level + 1]
+
+    def __radix_digits(self, n, p, tower, k, out):
+        if k < RADIX_BASECASE_LEVEL:
+            start = len(out)
+            for i in range(2 << k):
+                (n, r) = divmod(n, p)
+                out.append(int(r))
+            out[start:] = out[start:][::-1]
+            return
+
+        (hi, lo) = divmod(n, tower[k])
+        self.__radix_digits(hi, p, tower, k - 1, out)
+        self.__radix_digits(lo, p, tower, k - 1, out)
+
+    def __shift_digits(self, n, shift, k, out):
+        if k < RADIX_BASECASE_LEVEL:
+            mask = (1 << shift) - 1
+            for i in range((2 << k) - 1, -1, -1):
+                out.append((n >> (i * shift)) & mask)
+            return
+
+        half = shift << k
+        self.__shift_digits(n >> half, shift, k - 1, out)
+        self.__shift_digits(n & ((1 << half) - 1), shift, k - 1, out)
 
     '''
        PRIME FACTORIZATION
+        all prime factors of n, with multiplicity, in ascending order,
+        see factorize
     '''
     def prime_factors(self, n):
-        i = 2
-        factors = []
-        while i * i <= n:
-            if n % i:
-                i += 1
-            else:
-                n //= i
-                factors.append(i)
-        if n > 1:
-            factors.append(n)
-        return factors
+        return self.prime_factors2(n, 2)
 
     '''
        PRIME FACTORIZATION 2
-        start at the given i
+        start trial division at the given i; factors below i that are
+        still there are found by the rest of the engine
     '''
     def prime_factors2(self, n, _i):
-        ## i = 2
-        i = _i
+        return self.factorize(n, _i)
+
+    '''
+       FACTORIZE
+
+       Trial division by the primes in [start, FACTOR_TRIAL_BOUND), then
+       each cofactor is either a probable prime or is split by
+       __find_factor and both parts go back on the work list.
+       Results are cached by n.
+    '''
+    def factorize(self, n, start=2):
+        n = int(n)
+        if n < 2:
+            return []
+        cached = factor_cache_get(n)
+        if cached is not None:
+            return list(cached)
+
         factors = []
-        while i * i <= n:
-            if n % i:
-                i += 1
+        m = n
+        primes = self.primetable.primes()
+        for p in primes[bisect.bisect_left(primes, start):
+                        bisect.bisect_left(primes, FACTOR_TRIAL_BOUND)]:
+            if p*p > m:
+                break
+            while m % p == 0:
+                m //= p
+                factors.append(p)
+
+        # with every prime below the bound tried, a cofactor below its
+        # square is prime
+        trial_bound = FACTOR_TRIAL_BOUND*FACTOR_TRIAL_BOUND if start <= 2 else 0
+        work = [m]
+        while work:
+            m = work.pop()
+            if m == 1:
+                continue
+            if m % 2 == 0:
+                factors.append(2)
+                work.append(m//2)
+            elif m < trial_bound or self.__is_probable_prime(m):
+                factors.append(m)
             else:
-                n //= i
-                factors.append(i)
-        if n > 1:
-            factors.append(n)
-        return factors
+                d = self.__find_factor(m)
+                work.extend((d, m//d))
 
+        factors.sort()
+        factor_cache_put(n, factors)
+        return factors
 
 
 
@@ -247,6 +1020,122 @@ class tbnumerics:
             g, y, x = self.egcd(b % a, a)
             return (g, x - (b // a) * y, y)
 
+    '''
+       EXTENDED GCD - Lehmer / half-gcd
+
+       (g, x, y) with a*x + b*y = g = gcd(a, b), x the coefficient of a
+       as in egcd_iter.  Only the coefficient of a is carried through
+       the reduction, y is found from it at the end.
+    '''
+    def xgcd(self, a, b):
+        try:
+            a = int(a)
+            b = int(b)
+        except:
+            self.__errprnt("::xgcd:inputs must be integer type")
+            raise
+
+        if self.backend.gcdext is not None:
+            (g, x, y) = self.backend.gcdext(a, b)
+            return (int(g), int(x), int(y))
+
+        (ua, ub) = (abs(a), abs(b))
+        if ua < ub:
+            (g, y, x) = self.xgcd(b, a)
+            return (g, x, y)
+        if ub == 0:
+            return (ua, 1 if a >= 0 else -1, 0)
+
+        (u, v, r0, r1) = (ua, ub, (1,), (0,))
+        while v.bit_length() >= HGCD_THRESHOLD:
+            if v.bit_length() > u.bit_length()//2 + 1:
+                (u, v, r0, r1) = self.__hgcd(u, v, r0, r1)
+            else:
+                # already past the half-gcd stop, one division step
+                (q, w) = divmod(u, v)
+                (u, v, r0, r1) = (v, w, r1, (r0[0] - q*r1[0],))
+        (g, v, r0, r1) = self.__lehmer(u, v, 0, r0, r1)
+
+        x = r0[0] if a >= 0 else -r0[0]
+        y = (g - a*x)//b
+        return (g, x, y)
+
+    '''
+       EXTENDED GCD HELPERS
+
+       both take u >= v >= 0 and rows r0, r1 of cofactors that go with
+       u and v, run Euclid steps on (u, v) and apply the same steps to
+       r0 and r1: (u, v, r0, r1) -> (u', v', r0', r1')
+
+       __lehmer: until v' < 2**stop
+       __hgcd: until v' < 2**(bits(u)//2 + 1), by two recursive calls
+          on the leading bits; the result is checked and redone with
+          __lehmer in the rare case the leading bits were not enough
+    '''
+    def __lehmer(self, u, v, stop, r0, r1):
+        bound = 1 << stop
+        while v >= bound:
+            k = u.bit_length() - LEHMER_DIGIT_BITS
+            if k > 0:
+                # uh, vh: leading bits; (A, B, C, D): the steps on them
+                (uh, vh) = (u >> k, v >> k)
+                (A, B, C, D) = (1, 0, 0, 1)
+                vlim = bound >> k
+                while vh > vlim and vh + C != 0 and vh + D != 0:
+                    q = (uh + A)//(vh + C)
+                    if q != (uh + B)//(vh + D):
+                        break
+                    (A, C) = (C, A - q*C)
+                    (B, D) = (D, B - q*D)
+                    (uh, vh) = (vh, uh - q*vh)
+
+                if B != 0:
+                    (u, v) = (A*u + B*v, C*u + D*v)
+                    (r0, r1) = (tuple(A*s + B*t for (s, t) in zip(r0, r1)),
+                                tuple(C*s + D*t for (s, t) in zip(r0, r1)))
+                    continue
+
+            # one full division step
+            (q, w) = divmod(u, v)
+            (u, v) = (v, w)
+            (r0, r1) = (r1, tuple(s - q*t for (s, t) in zip(r0, r1)))
+
+        return (u, v, r0, r1)
+
+    def __hgcd(self, u, v, r0, r1):
+        n = u.bit_length()
+        half = n//2 + 1
+        if n < HGCD_THRESHOLD:
+            return self.__lehmer(u, v, half, r0, r1)
+        bound = 1 << half
+
+        # the top n - half bits bring (u, v) down to about 3n/4 bits
+        (m0, m1) = self.__hgcd(u >> half, v >> half, (1, 0), (0, 1))[2:]
+        (x, y) = (m0[0]*u + m0[1]*v, m1[0]*u + m1[1]*v)
+        if not x > y >= 0:
+            return self.__lehmer(u, v, half, r0, r1)
+        (s0, s1) = (m0, m1)
+
+        if y >= bound:
+            (q, w) = divmod(x, y)
+            (x, y) = (y, w)
+            (s0, s1) = (s1, (s0[0] - q*s1[0], s0[1] - q*s1[1]))
+
+        if y >= bound:
+            # and 2*(bits(x) - half) of them the rest of the way
+            k = 2*half - x.bit_length()
+            if k > 0:
+                (m0, m1) = self.__hgcd(x >> k, y >> k, (1, 0), (0, 1))[2:]
+                (x2, y2) = (m0[0]*x + m0[1]*y, m1[0]*x + m1[1]*y)
+                if x2 > y2 >= 0:
+                    (x, y) = (x2, y2)
+                    (s0, s1) = ((m0[0]*s0[0] + m0[1]*s1[0], m0[0]*s0[1] + m0[1]*s1[1]),
+                                (m1[0]*s0[0] + m1[1]*s1[0], m1[0]*s0[1] + m1[1]*s1[1]))
+
+        (r0, r1) = (tuple(s0[0]*s + s0[1]*t for (s, t) in zip(r0, r1)),
+                    tuple(s1[0]*s + s1[1]*t for (s, t) in zip(r0, r1)))
+        return self.__lehmer(x, y, half, r0, r1)
+
     '''
        GREATEST COMMON DIVISOR
 
@@ -259,37 +1148,82 @@ class tbnumerics:
             self.__errprnt("::greatest_common_divisor:inputs must be integer type")
             raise
 
-        if a==b:
-            return a
-        if a>b:
-            self.greatest_common_divisor(b, a)
-
-        while True:
-            rn = b%a
-            if rn == 0:
-                return a
-            else:
-                b=a
-                a=rn
+        return int(self.backend.gcd(aint, bint))
 
     '''
        MODULAR INVERSE
 
     '''
     def modinv(self, a, m):
-        g, x, y = self.egcd_iter(a, m)
+        if self.backend.invert is not None:
+            try:
+                return int(self.backend.invert(a, m))
+            except ZeroDivisionError:
+                raise Exception('tbencryptlib:tbnumerics::modinv:modular ' +
+                                'inverse does not exist')
+        g, x, y = self.xgcd(a, m)
         if g != 1:
             raise Exception('tbencryptlib:tbnumerics::modinv:modular ' +
                             'inverse does not exist')
         else:
             return x % m
 
+    '''
+       BATCH MODULAR INVERSE - Montgomery's trick
+
+       the inverses of all the values mod m, None for the values that
+       have none.  One inversion of the product of the values, then
+       each inverse is peeled off it with two multiplications:
+          c[i] = v[0]*...*v[i]
+          inv(v[i]) = inv(c[i]) * c[i-1],  inv(c[i-1]) = inv(c[i]) * v[i]
+       When the product has no inverse the values sharing a factor with
+       m are found by gcd and left out.
+    '''
+    def modinv_batch(self, values, m):
+        try:
+            m = int(m)
+            values = [int(v) % m for v in values] if m > 0 else None
+        except:
+            self.__errprnt("::modinv_batch:inputs must be integer type")
+            raise
+
+        if values is None:
+            raise Exception(self.MOD_PREFIX + "::modinv_batch: modulus must be positive, got " +
+                            str(m))
+        if m == 1:
+            return [0]*len(values)
+
+        index = list(range(len(values)))
+        while True:
+            prefix = []
+            c = self.backend.integer(1)
+            for i in index:
+                c = c * values[i] % m
+                prefix.append(c)
+            if not prefix:
+                return [None]*len(values)
+
+            g, x, y = self.xgcd(int(c), m)
+            if g == 1:
+                break
+            gcd = self.backend.gcd
+            index = [i for i in index if gcd(values[i], m) == 1]
+
+        inverses = [None]*len(values)
+        inv = self.backend.integer(x % m)
+        for j in range(len(index) - 1, 0, -1):
+            i = index[j]
+            inverses[i] = int(inv * prefix[j - 1] % m)
+            inv = inv * values[i] % m
+        inverses[index[0]] = int(inv)
+        return inverses
+
 
     '''
        IS_PRIME
 
     '''
-    def is_prime(self, prime_candidate):
+    def is_prime(self, prime_candidate, method=None):
 
         try:
             pc = abs(int(prime_candidate))
@@ -300,22 +1234,159 @@ class tbnumerics:
         if pc == 1:
             return False
 
-        b = self.__is_probable_prime(pc)
+        b = self.__is_probable_prime(pc, method)
         return b
 
+    '''
+       JACOBI SYMBOL
+
+       (a/n) for odd positive n, by quadratic reciprocity
+    '''
+    def jacobi(self, a, n):
+        if n <= 0 or n % 2 == 0:
+            raise Exception(self.MOD_PREFIX + "::jacobi: n must be odd" +
+                            " and positive")
+        a %= n
+        result = 1
+        while a:
+            twos = (a & -a).bit_length() - 1
+            a >>= twos
+            if twos & 1 and n % 8 in (3, 5):
+                result = -result
+            a, n = n, a
+            if a % 4 == 3 and n % 4 == 3:
+                result = -result
+            a %= n
+
+        if n == 1:
+            return result
+        return 0
+
+    '''
+       LUCAS SEQUENCE
+
+       (U_k, V_k, Q**k) mod n for the Lucas sequences with parameters
+       P and Q, n odd.  Walks the bits of k, doubling the index with
+         U_2k = U_k*V_k,  V_2k = V_k**2 - 2Q**k
+       and stepping it by one with
+         U_k+1 = (P*U_k + V_k)/2,  V_k+1 = (D*U_k + P*V_k)/2
+       where D = P**2 - 4Q and the halving is done mod n.
+    '''
+    def lucas_sequence(self, n, P, Q, k):
+        D = P*P - 4*Q
+        U, V, Qk = 0, 2, 1
+        for bit in bin(k)[2:]:
+            U, V = U*V % n, (V*V - 2*Qk) % n
+            Qk = Qk*Qk % n
+            if bit == '1':
+                U, V = P*U + V, D*U + P*V
+                if U & 1:
+                    U += n
+                if V & 1:
+                    V += n
+                U, V = (U >> 1) % n, (V >> 1) % n
+                Qk = Qk*Q % n
+        return (U, V, Qk)
+
+    '''
+       SET_PRIMALITY_METHOD
+
+       Default test for is_prime and the prime generators:
+       PRIMALITY_MR ("miller-rabin") or PRIMALITY_BPSW ("bpsw")
+    '''
+    def set_primality_method(self, method):
+        if method not in (PRIMALITY_MR, PRIMALITY_BPSW):
+            raise Exception(self.MOD_PREFIX + "::set_primality_method:" +
+                            " unknown primality method " + str(method))
+        self.primality_method = method
+
+
+    '''
+       MR_ROUNDS
+
+       Number of random-base Miller-Rabin rounds for an nbits candidate
+    '''
+    def mr_rounds(self, nbits):
+        for bits, rounds in MR_ROUNDS:
+            if nbits >= bits:
+                return rounds
+
+
+    '''
+       PRIME SEARCH
+
+       Find a probable prime in [lo, hi) by walking the odd numbers up
+       from a random odd start.  The residues of the start modulo the
+       odd primes below SEARCH_SIEVE_BOUND are computed once; every
+       window of candidates is sieved with them, and they are carried
+       to the next window with an addition mod p.  Only the window
+       survivors go to Miller-Rabin, with no further trial division.  A walk that runs off the end of
+       the range starts again somewhere else.
+       If stop is given, the search returns None once it is set.
+       A backend with next_prime walks from the random start with it
+       instead, and each prime it finds must still pass method.
+    '''
+    def search_prime(self, lo, hi, method=None, stop=None):
+        if self.backend.next_prime is not None:
+            return self.__next_prime_search(lo, hi, method, stop)
+
+        primes = self.primetable.primes()
+        sieve_primes = primes[1:bisect.bisect_left(primes, SEARCH_SIEVE_BOUND)]
+        table_limit = self.primetable.limit
+        window = max(SEARCH_WINDOW_MIN, 2*hi.bit_length())
+
+        while True:
+            start = self.sysrandom.randint(lo, hi-1) | 1
+            if start >= hi:
+                start -= 2
+                if start < lo:
+                    continue
+            residues = [start % p for p in sieve_primes]
+
+            while start < hi:
+                if stop is not None and stop.is_set():
+                    return None
+                count = min(window, (hi - start + 1)//2)
+                flags = bytearray([1])*count
+                near_primes = start <= SEARCH_SIEVE_BOUND
+                for j, p in enumerate(sieve_primes):
+                    r = residues[j]
+                    # first k with start + 2k = 0 mod p; (p+1)/2 inverts 2
+                    k = (p - r)*((p + 1) >> 1) % p
+                    if near_primes and start + 2*k == p:
+                        k += p  # p itself is not composite
+                    if k < count:
+                        flags[k::p] = bytes(len(range(k, count, p)))
+                    residues[j] = (r + 2*count) % p
+                self.metrics.incr("sieve_rejects", count - flags.count(1))
+
+                idx = flags.find(1)
+                while idx >= 0:
+                    candidate = start + 2*idx
+                    self.metrics.incr("prime_candidates")
+                    # the sieve has done the trial division already
+                    if candidate < table_limit:
+                        if self.__is_probable_prime(candidate, method):
+                            return candidate
+                    elif self.__probable_prime_test(candidate, method):
+                        return candidate
+                    idx = flags.find(1, idx + 1)
+
+                start += 2*count
+
 
     '''
        GEN_NBIT_PRIME
 
        Generate a prime such that the magnitude is a certain number of bits
+       workers > 1 races that many processes for the prime
     '''
-    def gen_nbit_prime(self,nbits):
+    def gen_nbit_prime(self,nbits,method=None,workers=None):
 
         try:
             inum = int(nbits)
         except:
-            self.__errprnt("::gen_nbit_prime: " +
-                           str(nbits) + " is not a number!")
+            self.__errprnt("::gen_nbit_prime: %s is not a number!", nbits)
             raise
 
         if inum == 0:
@@ -326,32 +1397,21 @@ class tbnumerics:
         #    raise Exception("tbencryptlib::gen_nbit_prime: Too many bits, should be less than or equal to 4096")
         lo = 2**(inum-1)
         hi = 2**(inum)
-        self.__dbgprnt("gen_nbit_prime: gen prime between 0x" +
-                       format(lo, '0x') + " and 0x" +
-                       format(hi, '0x'))
-
-        # rand_p = random.randint(lo, hi-1)
-        rand_p = self.sysrandom.randint(lo, hi-1)
-        while not self.__is_probable_prime(rand_p):
-            if self.__is_probable_prime(rand_p):
-                break
-            else:
-                if rand_p < hi-1:
-                    rand_p += 1
-                else:
-                    # rand_p = random.randint(lo, hi-1)
-                    rand_p = self.sysrandom.randint(lo, hi-1)
+        self.__dbgprnt("gen_nbit_prime: gen prime between 0x%x and 0x%x", lo, hi)
 
+        if workers is not None and workers > 1:
+            rand_p = self.__race_search(lo, hi, method, workers)
+        else:
+            rand_p = self.search_prime(lo, hi, method)
 
-        one_bits = bin(rand_p).count("1")
+        one_bits = self.backend.popcount(rand_p)
         if float(one_bits) <= float(inum)/2.0:
             bit_entropy = float(one_bits)/float(inum)
         else:
             bit_entropy = (float(inum)-float(one_bits))/float(inum)
 
-        self.__dbgprnt("Algorithm gen " + str(inum) + "-bit prime: 0x" +
-                       format(rand_p, '0x') + " is prime: Entropy: " +
-                       str(bit_entropy))
+        self.__dbgprnt("Algorithm gen %d-bit prime: 0x%x is prime: Entropy: %s",
+                       inum, rand_p, bit_entropy)
 
         return (rand_p, bit_entropy)
 
@@ -366,8 +1426,7 @@ class tbnumerics:
         try:
             inum = int(ceil)
         except:
-            self.__errprnt("::gen_prime_ceil: " +
-                           str(ceil) + " is not a number!")
+            self.__errprnt("::gen_prime_ceil: %s is not a number!", ceil)
             raise
 
         if inum < nmin:
@@ -378,21 +1437,9 @@ class tbnumerics:
         #    raise Exception("tbencryptlib::gen_nbit_prime: Too many bits, should be less than or equal to 4096")
         ## lo = 2**(inum-1)
         hi = inum
-        self.__dbgprnt("gen_prime_ceil: gen prime less than 0x" + format(hi, '0x'))
+        self.__dbgprnt("gen_prime_ceil: gen prime less than 0x%x", hi)
 
-        # rand_p = random.randint(nmin, hi-1)
-        rand_p = self.sysrandom.randint(nmin, hi-1)
-        while not self.__is_probable_prime(rand_p):
-            if self.__is_probable_prime(rand_p):
-                break
-            else:
-                if rand_p < hi-1:
-                    rand_p += 1
-                else:
-                    # rand_p = random.randint(nmin, hi-1)
-                    rand_p = self.sysrandom.randint(nmin, hi-1)
-
-        return rand_p
+        return self.search_prime(nmin, hi)
 
     '''
         BLOCK ENCRYPTION ROUTINES
@@ -403,7 +1450,7 @@ class tbnumerics:
         b_blk = 0
         try:
             b_num = int(num)
-            b_blk = int(blk)
+            b_blk = int(blksize)
         except:
             return 0
 
@@ -416,21 +1463,24 @@ class tbnumerics:
     def sum_of_digits(self, _x):
         x = 0
         try:
-            x = int(_x)
+            x = abs(int(_x))
 
         except:
             print("sum_of_digits: _x must be integer")
             return -1
 
+        # str() of the whole number is quadratic, and refused past
+        # sys.get_int_max_str_digits() digits; the chunks are small
         total = 0
-        xs = str(x)
-        for c in xs:
-            total += int(c)
+        for chunk in self.factor_powers_of_p(x, 10**SUM_DIGITS_CHUNK):
+            total += sum(map(int, str(chunk)))
 
         return total
 
     '''
        BIT LENGTH OF A NUMBER
+        ceil(log2(x)): the bits needed for 0 .. x-1, one less than
+        x.bit_length() when x is a power of two
     '''
     def bit_length(self, _x):
         x = 0
@@ -438,10 +1488,12 @@ class tbnumerics:
             x = int(_x)
 
         except:
-            print("sum_of_digits: _x must be integer")
+            print("bit_length: _x must be integer")
             return -1
 
-        return math.ceil(math.log(x, 2))
+        if x < 1:
+            raise Exception(self.MOD_PREFIX + "::bit_length: x must be positive, got " + str(x))
+        return (x - 1).bit_length()
 
     '''
         DEBUGGING
@@ -449,15 +1501,27 @@ class tbnumerics:
     def set_debug(self, b_dbg):
         if True == b_dbg:
             self.DEBUG = True
+            tbmetrics.log_to_console(log, logging.DEBUG)
         else:
             self.DEBUG = False
 
     def set_verbose(self, b_vrb):
         if True == b_vrb:
             self.VERBOSE = True
+            tbmetrics.log_to_console(log, logging.INFO)
         else:
             self.VERBOSE = False
 
+'''
+   Runs in a racing worker process, see tbnumerics.__race_search
+'''
+def _race_worker(lo, hi, method, stop, conn):
+    numerics = tbnumerics()
+    p = numerics.search_prime(lo, hi, method, stop)
+    if p is not None:
+        conn.send_bytes(p.to_bytes((p.bit_length() + 7)//8, 'big'))
+    conn.close()
+
 '''
  EOF
 '''
@@ -0,0 +1,110 @@
+import os
+import hashlib
+
+'''
+  tbpad
+
+  RSA encryption padding (RFC 8017) for a modulus of k bytes:
+
+  pkcs1   RSAES-PKCS1-v1_5, EM = 0x00 || 0x02 || PS || 0x00 || M, PS at
+          least 8 random nonzero bytes; M up to k-11 bytes
+  oaep    RSAES-OAEP with MGF1 over the same hashlib hash,
+          EM = 0x00 || maskedSeed || maskedDB; M up to k-2*hLen-2 bytes
+
+  EM always starts with 0x00, so as an integer it is below the modulus.
+  The unpad functions raise one and the same error for every kind of
+  malformed block, so a caller cannot tell which check failed.
+'''
+
+PAD_PKCS1 = "pkcs1"
+PAD_OAEP = "oaep"
+PADDINGS = (PAD_PKCS1, PAD_OAEP)
+PKCS1_OVERHEAD = 11
+DEFAULT_HASH = "sha256"
+
+MOD_PREFIX = "MODULE tbencryptlib::tbpad"
+
+'''
+   largest message that fits in one block of a k byte modulus
+'''
+def max_message_size(k, padding=PAD_OAEP, hashname=DEFAULT_HASH):
+    if padding == PAD_PKCS1:
+        size = k - PKCS1_OVERHEAD
+    elif padding == PAD_OAEP:
+        size = k - 2*hashlib.new(hashname).digest_size - 2
+    else:
+        raise Exception(MOD_PREFIX + "::max_message_size: unknown padding " + str(padding))
+    if size < 1:
+        raise Exception(MOD_PREFIX + "::max_message_size: a " + str(k) +
+                        " byte modulus is too small for " + padding + " padding")
+    return size
+
+def nonzero_random(n):
+    ps = b""
+    while len(ps) < n:
+        ps += os.urandom(n - len(ps)).replace(b"\0", b"")
+    return ps
+
+def pkcs1_pad(msg, k):
+    if len(msg) > k - PKCS1_OVERHEAD:
+        raise Exception(MOD_PREFIX + "::pkcs1_pad: message too long")
+    return b"\x00\x02" + nonzero_random(k - len(msg) - 3) + b"\x00" + msg
+
+def pkcs1_unpad(em, k):
+    sep = em.find(b"\x00", 2)
+    if len(em) != k or em[0] != 0 or em[1] != 2 or sep < 10:
+        raise Exception(MOD_PREFIX + "::unpad: decryption error")
+    return em[sep+1:]
+
+'''
+   MGF1 mask of length bytes from seed
+'''
+def mgf1(seed, length, hashname=DEFAULT_HASH):
+    out = []
+    hlen = hashlib.new(hashname).digest_size
+    for counter in range((length + hlen - 1)//hlen):
+        out.append(hashlib.new(hashname, seed + counter.to_bytes(4, 'big')).digest())
+    return b"".join(out)[:length]
+
+def xor_bytes(a, b):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def oaep_pad(msg, k, hashname=DEFAULT_HASH, label=b""):
+    lhash = hashlib.new(hashname, label).digest()
+    hlen = len(lhash)
+    if len(msg) > k - 2*hlen - 2:
+        raise Exception(MOD_PREFIX + "::oaep_pad: message too long")
+    db = lhash + bytes(k - len(msg) - 2*hlen - 2) + b"\x01" + msg
+    seed = os.urandom(hlen)
+    masked_db = xor_bytes(db, mgf1(seed, k - hlen - 1, hashname))
+    masked_seed = xor_bytes(seed, mgf1(masked_db, hlen, hashname))
+    return b"\x00" + masked_seed + masked_db
+
+def oaep_unpad(em, k, hashname=DEFAULT_HASH, label=b""):
+    lhash = hashlib.new(hashname, label).digest()
+    hlen = len(lhash)
+    if len(em) != k or k < 2*hlen + 2:
+        raise Exception(MOD_PREFIX + "::unpad: decryption error")
+    masked_seed = em[1:1+hlen]
+    masked_db = em[1+hlen:]
+    seed = xor_bytes(masked_seed, mgf1(masked_db, hlen, hashname))
+    db = xor_bytes(masked_db, mgf1(seed, k - hlen - 1, hashname))
+    sep = db.find(b"\x01", hlen)
+    if (em[0] != 0 or db[:hlen] != lhash or sep < 0 or
+            db[hlen:sep].count(0) != sep - hlen):
+        raise Exception(MOD_PREFIX + "::unpad: decryption error")
+    return db[sep+1:]
+
+def pad(msg, k, padding=PAD_OAEP, hashname=DEFAULT_HASH):
+    if padding == PAD_PKCS1:
+        return pkcs1_pad(msg, k)
+    return oaep_pad(msg, k, hashname)
+
+def unpad(em, k, padding=PAD_OAEP, hashname=DEFAULT_HASH):
+    if padding == PAD_PKCS1:
+        return pkcs1_unpad(em, k)
+    return oaep_unpad(em, k, hashname)
+
+'''
+ EOF
+'''
@@ -0,0 +1,99 @@
+import binascii
+
+'''
+  tbpem
+
+  PEM armour (RFC 7468) for DER data:
+
+      -----BEGIN <label>-----
+      base64, 64 characters per line
+      -----END <label>-----
+
+  Encoding streams: the DER is taken 48 bytes at a time through a
+  memoryview, each slice becomes one complete 64 character line, and
+  the lines go straight to the caller or the file.  Decoding hands the
+  whole body to one a2b_base64 call, which skips the line breaks.
+
+  Labels used for RSA keys:
+      RSA PRIVATE KEY   PKCS #1 RSAPrivateKey
+      PRIVATE KEY       PKCS #8 PrivateKeyInfo
+      RSA PUBLIC KEY    PKCS #1 RSAPublicKey
+      PUBLIC KEY        SubjectPublicKeyInfo
+'''
+
+LABEL_RSA_PRIVATE = "RSA PRIVATE KEY"
+LABEL_PRIVATE = "PRIVATE KEY"
+LABEL_RSA_PUBLIC = "RSA PUBLIC KEY"
+LABEL_PUBLIC = "PUBLIC KEY"
+
+LINE_BYTES = 48     # 64 base64 characters
+
+MOD_PREFIX = "MODULE tbencryptlib::tbpem"
+
+'''
+   pem_lines
+
+   generator of the lines, as bytes with their newline, of the PEM
+   encoding of der
+'''
+def pem_lines(label, der):
+    yield b"-----BEGIN " + label.encode("ascii") + b"-----\n"
+    view = memoryview(der)
+    for off in range(0, len(view), LINE_BYTES):
+        yield binascii.b2a_base64(view[off:off+LINE_BYTES])
+    yield b"-----END " + label.encode("ascii") + b"-----\n"
+
+def encode_pem(label, der):
+    return b"".join(pem_lines(label, der))
+
+def write_pem(f, label, der):
+    f.writelines(pem_lines(label, der))
+
+'''
+   iter_pem
+
+   generator of (label, der) for each PEM block in data (bytes or str);
+   text outside the blocks is ignored
+'''
+def iter_pem(data):
+    if isinstance(data, str):
+        data = data.encode("ascii")
+    off = 0
+    while True:
+        begin = data.find(b"-----BEGIN ", off)
+        if begin < 0:
+            return
+        lend = data.find(b"-----", begin + 11)
+        if lend < 0:
+            raise Exception(MOD_PREFIX + "::iter_pem: unterminated BEGIN line")
+        label = data[begin+11:lend]
+        end_line = b"-----END " + label + b"-----"
+        body = lend + 5
+        end = data.find(end_line, body)
+        if end < 0:
+            raise Exception(MOD_PREFIX + "::iter_pem: no END line for " +
+                            label.decode("ascii", "replace"))
+        try:
+            der = binascii.a2b_base64(data[body:end])
+        except binascii.Error as e:
+            raise Exception(MOD_PREFIX + "::iter_pem: bad base64 in " +
+                            label.decode("ascii", "replace") + ": " + str(e))
+        yield (label.decode("ascii"), der)
+        off = end + len(end_line)
+
+'''
+   decode_pem
+
+   (label, der) of the first PEM block in data; with label given,
+   of the first block with that label
+'''
+def decode_pem(data, label=None):
+    for (blabel, der) in iter_pem(data):
+        if label is None or blabel == label:
+            return (blabel, der)
+    raise Exception(MOD_PREFIX + "::decode_pem: no " +
+                    (label if label is not None else "PEM") + " block found")
+
+'''
+ EOF
+'''
@@ -0,0 +1,214 @@
+import os
+import mmap
+import fcntl
+from . import tbnumerics
+
+'''
+  tbprimepool
+
+  A store of pre-generated, pre-verified primes of one bit size,
+  kept in a memory-mapped file so that key generation can take
+  primes from it instead of searching for them.
+
+  File layout (all integers big-endian):
+     0  magic     8 bytes   b"TBPP0001"
+     8  bits      4 bytes   bit length of every prime in the file
+    12  recsize   4 bytes   bytes per record, (bits+7)//8
+    16  capacity  8 bytes   number of record slots
+    24  count     8 bytes   free index: slots [0, count) hold primes
+    32  reserved up to HEADER_SIZE
+    HEADER_SIZE + i*recsize: record i
+
+  take() pops the record at count-1, put() appends at count.  Both
+  hold an exclusive flock on the file while they touch the header,
+  so several processes can share one pool.  count is only updated
+  after the records it covers have been written.
+'''
+
+POOL_MAGIC = b"TBPP0001"
+HEADER_SIZE = 64
+DEFAULT_CAPACITY = 4096
+
+def default_pool_dir():
+    pool_dir = os.environ.get("TBENCRYPT_PRIME_POOL")
+    if pool_dir is None:
+        cache_dir = tbnumerics.default_cache_dir()
+        if not cache_dir:
+            return None
+        pool_dir = os.path.join(cache_dir, "primepool")
+    return pool_dir
+
+def pool_file(pool_dir, bits):
+    return os.path.join(pool_dir, "primes_" + str(bits) + ".pool")
+
+
+class tbprimepool:
+    def __init__(self, _bits, _pool_dir=None, _capacity=DEFAULT_CAPACITY):
+        self.MOD_PREFIX = "MODULE tbencryptlib::tbprimepool"
+        self.bits = int(_bits)
+        if _pool_dir is None:
+            _pool_dir = default_pool_dir()
+        if not _pool_dir:
+            raise Exception(self.MOD_PREFIX + "::__init__: no pool directory")
+        self.pool_dir = _pool_dir
+        self.fname = pool_file(self.pool_dir, self.bits)
+        self.recsize = (self.bits + 7)//8
+        self.capacity = int(_capacity)
+        self.__file = None
+        self.__map = None
+        self.__open()
+
+    '''
+        PUBLIC
+    '''
+
+    '''
+        number of primes in the pool
+    '''
+    def available(self):
+        return self.__get_count()
+
+    '''
+        remove one prime from the pool, None if it is empty
+    '''
+    def take(self):
+        self.__lock()
+        try:
+            count = self.__get_count()
+            if count == 0:
+                return None
+            off = HEADER_SIZE + (count-1)*self.recsize
+            p = int.from_bytes(self.__map[off:off + self.recsize], 'big')
+            self.__map[off:off + self.recsize] = bytes(self.recsize)
+            self.__set_count(count-1)
+        finally:
+            self.__unlock()
+
+        if p.bit_length() != self.bits:
+            raise Exception(self.MOD_PREFIX + "::take: corrupt record in " +
+                            self.fname)
+        return p
+
+    '''
+        add primes to the pool, as many as fit; returns the number added
+    '''
+    def put(self, primes):
+        for p in primes:
+            if p.bit_length() != self.bits:
+                raise Exception(self.MOD_PREFIX + "::put: " + hex(p) +
+                                " is not a " + str(self.bits) + "-bit number")
+        self.__lock()
+        try:
+            count = self.__get_count()
+            added = 0
+            for p in primes[:self.capacity - count]:
+                off = HEADER_SIZE + (count + added)*self.recsize
+                self.__map[off:off + self.recsize] = p.to_bytes(self.recsize, 'big')
+                added += 1
+            self.__map.flush()
+            self.__set_count(count + added)
+            self.__map.flush()
+        finally:
+            self.__unlock()
+        return added
+
+    '''
+        top the pool up to target primes (default: capacity).
+        Primes are generated and verified outside the lock, then added.
+        Returns the number added.
+    '''
+    def refill(self, target=None, numerics=None, workers=None):
+        if target is None or target > self.capacity:
+            target = self.capacity
+        if numerics is None:
+            numerics = tbnumerics.tbnumerics()
+
+        added = 0
+        while self.available() < target:
+            (p, ent) = numerics.gen_nbit_prime(self.bits, None, workers)
+            # verify with a different test from the one that found it
+            if not numerics.is_prime(p, tbnumerics.PRIMALITY_BPSW):
+                continue
+            n = self.put([p])
+            if n == 0:
+                break
+            added += n
+        return added
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    '''
+        PRIVATE
+    '''
+
+    def __open(self):
+        os.makedirs(self.pool_dir, exist_ok=True)
+        fd = os.open(self.fname, os.O_RDWR | os.O_CREAT, 0o600)
+        self.__file = os.fdopen(fd, "r+b")
+
+        self.__lock()
+        try:
+            # whoever gets the lock first on a new file lays it out
+            if os.fstat(fd).st_size == 0:
+                self.__file.truncate(HEADER_SIZE + self.capacity*self.recsize)
+                self.__map = mmap.mmap(fd, 0)
+                self.__map[0:8] = POOL_MAGIC
+                self.__map[8:12] = self.bits.to_bytes(4, 'big')
+                self.__map[12:16] = self.recsize.to_bytes(4, 'big')
+                self.__map[16:24] = self.capacity.to_bytes(8, 'big')
+                self.__set_count(0)
+                self.__map.flush()
+            else:
+                self.__map = mmap.mmap(fd, 0)
+                self.__check_header()
+        finally:
+            self.__unlock()
+
+    def __check_header(self):
+        if (self.__map[0:8] != POOL_MAGIC or
+                int.from_bytes(self.__map[8:12], 'big') != self.bits or
+                int.from_bytes(self.__map[12:16], 'big') != self.recsize):
+            raise Exception(self.MOD_PREFIX + "::__open: " + self.fname +
+                            " is not a " + str(self.bits) + "-bit prime pool")
+        self.capacity = int.from_bytes(self.__map[16:24], 'big')
+        if len(self.__map) < HEADER_SIZE + self.capacity*self.recsize:
+            raise Exception(self.MOD_PREFIX + "::__open: " + self.fname +
+                            " is truncated")
+
+    def __get_count(self):
+        return int.from_bytes(self.__map[24:32], 'big')
+
+    def __set_count(self, count):
+        self.__map[24:32] = count.to_bytes(8, 'big')
+
+    def __lock(self):
+        fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+
+    def __unlock(self):
+        fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+
+
+'''
+  take a prime of bits from the pool in pool_dir, None if there is
+  no pool or it is empty
+'''
+def take_prime(bits, pool_dir=None):
+    if pool_dir is None:
+        pool_dir = default_pool_dir()
+    if not pool_dir or not os.path.exists(pool_file(pool_dir, bits)):
+        return None
+    pool = tbprimepool(bits, pool_dir)
+    try:
+        return pool.take()
+    finally:
+        pool.close()
+
+'''
+ EOF
+'''
@@ -0,0 +1,302 @@
+import mmap
+from . import tbnumerics
+from . import tbmetrics
+from . import tbder
+from . import tbpem
+from . import tbssh
+
+'''
+  tbrsakey
+
+  An RSA key with its CRT parameters computed once and kept, so that
+  private operations run as two half-size exponentiations joined by
+  Garner's recombination instead of one full pow(c, D, N):
+
+      m1 = c**dp mod p,  m2 = c**dq mod q
+      h  = qinv*(m1 - m2) mod p
+      m  = m2 + h*q
+
+  p, q, dp, dq and qinv are prime1, prime2, exponent1, exponent2 and
+  coefficient of the PKCS #1 RSAPrivateKey.  A public key has only n
+  and e.  The object uses __slots__, so thousands of keys can be held
+  in memory cheaply.  The exponentiations go through the tbnumerics
+  arithmetic backend.
+'''
+
+class tbrsakey:
+    __slots__ = ("n", "e", "d", "p", "q", "dp", "dq", "qinv")
+
+    MOD_PREFIX = "MODULE tbencryptlib::tbrsakey"
+
+    def __init__(self, n, e, d=None, p=None, q=None, dp=None, dq=None, qinv=None):
+        self.n = n
+        self.e = e
+        self.d = d
+        self.p = p
+        self.q = q
+        self.dp = dp
+        self.dq = dq
+        self.qinv = qinv
+
+        if d is not None and p is not None and q is not None:
+            if p*q != n:
+                raise Exception(self.MOD_PREFIX + "::__init__: p*q is not n")
+            if dp is None:
+                self.dp = d % (p-1)
+            if dq is None:
+                self.dq = d % (q-1)
+            if qinv is None:
+                self.qinv = tbnumerics.tbnumerics().modinv(q, p)
+
+    '''
+        key context of a tbkeygen that has generated a keypair
+    '''
+    @classmethod
+    def from_keygen(cls, keygen):
+        (p, q) = keygen.get_primes()
+        (e, n) = keygen.get_public_keypair()
+        (d, n) = keygen.get_private_keypair()
+        return cls(n, e, d, p, q)
+
+    '''
+        key context from PKCS #1 field names, as in tbencrypt.keydata
+    '''
+    @classmethod
+    def from_keydata(cls, kd):
+        return cls(kd["modulus"], kd["publicExponent"], kd.get("privateExponent"),
+                   kd.get("prime1"), kd.get("prime2"), kd.get("exponent1"),
+                   kd.get("exponent2"), kd.get("coefficient"))
+
+    '''
+        PUBLIC
+    '''
+
+    def has_private(self):
+        return self.d is not None
+
+    def public_key(self):
+        return tbrsakey(self.n, self.e)
+
+    def bits(self):
+        return self.n.bit_length()
+
+    '''
+        PKCS #1 DER encodings
+    '''
+    def private_der(self):
+        if self.p is None:
+            raise Exception(self.MOD_PREFIX + "::private_der: no private key with primes")
+        return tbder.encode_rsa_private_key(self.n, self.e, self.d, self.p, self.q,
+                                            self.dp, self.dq, self.qinv)
+
+    def public_der(self):
+        return tbder.encode_rsa_public_key(self.n, self.e)
+
+    '''
+        PKCS #8 PrivateKeyInfo and SubjectPublicKeyInfo DER
+    '''
+    def pkcs8_der(self):
+        return tbder.encode_pkcs8_private_key(self.private_der())
+
+    def spki_der(self):
+        return tbder.encode_spki_public_key(self.public_der())
+
+    '''
+        PEM: PKCS #1 or, with pkcs8, PKCS #8 private key;
+             SubjectPublicKeyInfo or, without spki, PKCS #1 public key
+    '''
+    def private_pem(self, pkcs8=False):
+        if pkcs8:
+            return tbpem.encode_pem(tbpem.LABEL_PRIVATE, self.pkcs8_der())
+        return tbpem.encode_pem(tbpem.LABEL_RSA_PRIVATE, self.private_der())
+
+    def public_pem(self, spki=True):
+        if spki:
+            return tbpem.encode_pem(tbpem.LABEL_PUBLIC, self.spki_der())
+        return tbpem.encode_pem(tbpem.LABEL_RSA_PUBLIC, self.public_der())
+
+    '''
+        OpenSSH: ssh-rsa authorized_keys line, openssh-key-v1 private key
+    '''
+    def ssh_public_line(self, comment=""):
+        return tbssh.authorized_key_line(self.n, self.e, comment)
+
+    def openssh_private(self, comment=""):
+        if self.p is None:
+            raise Exception(self.MOD_PREFIX + "::openssh_private: no private key with primes")
+        return tbssh.encode_private_key(self.n, self.e, self.d, self.qinv, self.p, self.q,
+                                        comment)
+
+    '''
+        public operation: m**e mod n
+    '''
+    def encrypt(self, m):
+        self.__check_range(m, "encrypt")
+        tbmetrics.get_metrics().incr("pow_calls")
+        return int(tbnumerics.get_backend().powmod(m, self.e, self.n))
+
+    def verify_raw(self, s):
+        self.__check_range(s, "verify_raw")
+        tbmetrics.get_metrics().incr("pow_calls")
+        return int(tbnumerics.get_backend().powmod(s, self.e, self.n))
+
+    '''
+        private operation: c**d mod n, by CRT when the primes are known
+    '''
+    def decrypt(self, c):
+        self.__check_range(c, "decrypt")
+        return self.__private_op(c)
+
+    def sign_raw(self, m):
+        self.__check_range(m, "sign_raw")
+        return self.__private_op(m)
+
+    '''
+        PRIVATE
+    '''
+
+    def __private_op(self, c):
+        if self.d is None:
+            raise Exception(self.MOD_PREFIX + "::__private_op: no private key")
+        powmod = tbnumerics.get_backend().powmod
+        if self.p is None:
+            tbmetrics.get_metrics().incr("pow_calls")
+            return int(powmod(c, self.d, self.n))
+        tbmetrics.get_metrics().incr("pow_calls", 2)
+
+        m1 = powmod(c % self.p, self.dp, self.p)
+        m2 = powmod(c % self.q, self.dq, self.q)
+        h = self.qinv*(m1 - m2) % self.p
+        return int(m2 + h*self.q)
+
+    def __check_range(self, x, op):
+        if x < 0 or x >= self.n:
+            raise Exception(self.MOD_PREFIX + "::" + op + ": input out of range")
+
+
+
+'''
+  tbderkey
+
+  An RSA key read from DER (PKCS #1, PKCS #8 or SubjectPublicKeyInfo)
+  without copying it.  Each field
+  is converted to an int the first time it is used: public operations
+  only touch n and e, and the first private operation builds a
+  tbrsakey from the CRT fields stored in the key.
+'''
+
+# PKCS #1 RSAPrivateKey field positions; RSAPublicKey is (n, e)
+_PRIVATE_FIELDS = {"n": 1, "e": 2, "d": 3, "p": 4, "q": 5, "dp": 6, "dq": 7, "qinv": 8}
+_PUBLIC_FIELDS = {"n": 0, "e": 1}
+
+class tbderkey:
+    __slots__ = ("ints", "private", "key")
+
+    MOD_PREFIX = "MODULE tbencryptlib::tbderkey"
+
+    def __init__(self, data, off=None, end=None):
+        (self.ints, self.private) = tbder.decode_rsa_key(data, off, end)
+        self.key = None
+
+    def field(self, name):
+        if self.private:
+            idx = _PRIVATE_FIELDS.get(name)
+        else:
+            idx = _PUBLIC_FIELDS.get(name)
+        if idx is None:
+            return None
+        return self.ints[idx]
+
+    n = property(lambda self: self.field("n"))
+    e = property(lambda self: self.field("e"))
+    d = property(lambda self: self.field("d"))
+    p = property(lambda self: self.field("p"))
+    q = property(lambda self: self.field("q"))
+    dp = property(lambda self: self.field("dp"))
+    dq = property(lambda self: self.field("dq"))
+    qinv = property(lambda self: self.field("qinv"))
+
+    def has_private(self):
+        return self.private
+
+    def bits(self):
+        return self.n.bit_length()
+
+    '''
+        fully decoded key context
+    '''
+    def to_key(self):
+        if self.key is None:
+            if self.private:
+                self.key = tbrsakey(self.n, self.e, self.d, self.p, self.q,
+                                    self.dp, self.dq, self.qinv)
+            else:
+                self.key = tbrsakey(self.n, self.e)
+        return self.key
+
+    def encrypt(self, m):
+        if self.key is not None:
+            return self.key.encrypt(m)
+        n = self.n
+        if m < 0 or m >= n:
+            raise Exception(self.MOD_PREFIX + "::encrypt: input out of range")
+        return int(tbnumerics.get_backend().powmod(m, self.e, n))
+
+    def verify_raw(self, s):
+        return self.encrypt(s)
+
+    def decrypt(self, c):
+        return self.to_key().decrypt(c)
+
+    def sign_raw(self, m):
+        return self.to_key().sign_raw(m)
+
+'''
+   load_der
+
+   key from DER bytes, bytearray, memoryview or mmap; the buffer is
+   referenced, not copied
+'''
+def load_der(data):
+    return tbderkey(data)
+
+'''
+   load_der_file
+
+   key from a DER file, read through a read-only mmap
+'''
+def load_der_file(fname):
+    with open(fname, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return tbderkey(data)
+
+'''
+   load_pem
+
+   key from the first RSA key block of PEM text
+'''
+PEM_KEY_LABELS = (tbpem.LABEL_RSA_PRIVATE, tbpem.LABEL_PRIVATE,
+                  tbpem.LABEL_RSA_PUBLIC, tbpem.LABEL_PUBLIC)
+
+def load_pem(data):
+    for (label, der) in tbpem.iter_pem(data):
+        if label in PEM_KEY_LABELS:
+            return tbderkey(der)
+    raise Exception("MODULE tbencryptlib::tbrsakey::load_pem: no RSA key found")
+
+'''
+   load_key_file
+
+   key from a DER or PEM file
+'''
+def load_key_file(fname):
+    with open(fname, "rb") as f:
+        head = f.read(1)
+    if head == bytes([tbder.TAG_SEQUENCE]):
+        return load_der_file(fname)
+    with open(fname, "rb") as f:
+        return load_pem(f.read())
+
+'''
+ EOF
+'''
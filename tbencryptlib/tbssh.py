@@ -0,0 +1,142 @@
+import os
+import binascii
+
+'''
+  tbssh
+
+  OpenSSH encodings of RSA keys (RFC 4251, RFC 4253, PROTOCOL.key):
+
+  string   uint32 length, then the bytes
+  mpint    string holding the minimal two's complement big-endian value;
+           0 is the empty string, a positive value with its top bit set
+           gets a leading 0x00 (the same content bytes as a DER INTEGER)
+
+  public key blob:   string "ssh-rsa", mpint e, mpint n
+  authorized_keys:   ssh-rsa <base64 of the blob> <comment>
+
+  openssh-key-v1 private key, unencrypted:
+      "openssh-key-v1\0"
+      string ciphername "none", string kdfname "none", string kdfoptions ""
+      uint32 number of keys, 1
+      string public key blob
+      string private section:
+          uint32 checkint, uint32 checkint (equal, random)
+          string "ssh-rsa", mpint n, e, d, iqmp, p, q
+          string comment
+          padding 1, 2, 3, ... to a multiple of 8 bytes
+
+  iqmp is (1/q) mod p, the PKCS #1 coefficient.  The result is armoured
+  as "OPENSSH PRIVATE KEY" with 70 base64 characters per line, as
+  ssh-keygen writes it.
+'''
+
+KEY_TYPE = b"ssh-rsa"
+AUTH_MAGIC = b"openssh-key-v1\0"
+CIPHER_NONE = b"none"
+BLOCK_SIZE = 8
+LINE_CHARS = 70
+PRIVATE_LABEL = b"OPENSSH PRIVATE KEY"
+
+MOD_PREFIX = "MODULE tbencryptlib::tbssh"
+
+def string(b):
+    return len(b).to_bytes(4, 'big') + b
+
+def mpint(v):
+    if v == 0:
+        return bytes(4)
+    c = (~v if v < 0 else v).bit_length()//8 + 1
+    return c.to_bytes(4, 'big') + v.to_bytes(c, 'big', signed=True)
+
+def public_blob(n, e):
+    return string(KEY_TYPE) + mpint(e) + mpint(n)
+
+'''
+   authorized_key_line
+
+   one authorized_keys / .pub line, with its newline
+'''
+def authorized_key_line(n, e, comment=""):
+    line = KEY_TYPE + b" " + binascii.b2a_base64(public_blob(n, e), newline=False)
+    if comment:
+        line += b" " + comment.encode("utf-8")
+    return line + b"\n"
+
+'''
+   encode_private_key
+
+   openssh-key-v1 private key file contents, unencrypted
+'''
+def encode_private_key(n, e, d, iqmp, p, q, comment="", checkint=None):
+    if checkint is None:
+        checkint = os.urandom(4)
+    else:
+        checkint = checkint.to_bytes(4, 'big')
+
+    priv = b"".join((checkint, checkint, string(KEY_TYPE),
+                     mpint(n), mpint(e), mpint(d), mpint(iqmp), mpint(p), mpint(q),
+                     string(comment.encode("utf-8"))))
+    npad = -len(priv) % BLOCK_SIZE
+    priv += bytes(range(1, npad + 1))
+
+    blob = b"".join((AUTH_MAGIC, string(CIPHER_NONE), string(CIPHER_NONE), string(b""),
+                     (1).to_bytes(4, 'big'), string(public_blob(n, e)), string(priv)))
+
+    b64 = binascii.b2a_base64(blob, newline=False)
+    lines = [b"-----BEGIN " + PRIVATE_LABEL + b"-----"]
+    lines.extend(b64[off:off+LINE_CHARS] for off in range(0, len(b64), LINE_CHARS))
+    lines.append(b"-----END " + PRIVATE_LABEL + b"-----\n")
+    return b"\n".join(lines)
+
+'''
+   parse_authorized_key_line
+
+   (n, e, comment) of an ssh-rsa authorized_keys line (bytes or str)
+'''
+def parse_authorized_key_line(line):
+    if isinstance(line, str):
+        line = line.encode("utf-8")
+    fields = line.strip().split(None, 2)
+    if len(fields) < 2 or fields[0] != KEY_TYPE:
+        raise Exception(MOD_PREFIX + "::parse_authorized_key_line: not an ssh-rsa key")
+    blob = memoryview(binascii.a2b_base64(fields[1]))
+
+    values = []
+    off = 0
+    for i in range(3):
+        if off + 4 > len(blob):
+            raise Exception(MOD_PREFIX + "::parse_authorized_key_line: truncated key")
+        ln = int.from_bytes(blob[off:off+4], 'big')
+        values.append(blob[off+4:off+4+ln])
+        off += 4 + ln
+    if off != len(blob) or bytes(values[0]) != KEY_TYPE:
+        raise Exception(MOD_PREFIX + "::parse_authorized_key_line: bad key blob")
+
+    e = int.from_bytes(values[1], 'big', signed=True)
+    n = int.from_bytes(values[2], 'big', signed=True)
+    comment = fields[2].decode("utf-8") if len(fields) > 2 else ""
+    return (n, e, comment)
+
+'''
+   append_authorized_keys
+
+   append lines (bytes, each ending with a newline) to an authorized_keys
+   file with one write; the file is created mode 0600 if it does not exist
+'''
+def append_authorized_keys(fname, lines):
+    lines = list(lines)
+    data = b"".join(lines)
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    with os.fdopen(fd, "ab") as f:
+        # start on a line of our own if the file lacks its final newline
+        if f.tell() > 0:
+            with open(fname, "rb") as r:
+                r.seek(-1, os.SEEK_END)
+                if r.read(1) != b"\n":
+                    data = b"\n" + data
+        f.write(data)
+    return len(lines)
+
+'''
+ EOF
+'''
@@ -0,0 +1,19 @@
+from tbencryptlib import tbnumerics
+
+"""
+Shared helpers for the tbencryptlib tests
+"""
+
+'''
+   numerics whose prime search hands out the given numbers first, then
+   falls back to a real search
+'''
+class ScriptedNumerics(tbnumerics.tbnumerics):
+    def __init__(self, script):
+        tbnumerics.tbnumerics.__init__(self)
+        self.script = list(script)
+
+    def gen_nbit_prime(self, nbits, method=None, workers=None):
+        if self.script:
+            return (self.script.pop(0), 0.0)
+        return tbnumerics.tbnumerics.gen_nbit_prime(self, nbits, method, workers)
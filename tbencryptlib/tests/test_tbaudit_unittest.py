@@ -0,0 +1,204 @@
+import io
+import random
+import tempfile
+import unittest
+import contextlib
+
+from tbencryptlib import tbaudit
+from tbencryptlib import tbkeygen
+from tbencryptlib import tbnumerics
+from tbencryptlib import tbrsakey
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbaudit_unittest -v
+
+```
+"""
+
+PRIMES = [1000003, 1000033, 1000037, 1000039, 1000081, 1000099, 1000117, 1000121,
+          1000133, 1000151]
+
+
+class TestTbBatchGcd(unittest.TestCase):
+
+    '''
+        run the audit of moduli, a list of n or (n, source, e, d), in
+        memory and with the tree levels spilled to files; both must agree
+    '''
+    def audit(self, moduli):
+        results = []
+        with tempfile.TemporaryDirectory() as spill:
+            for spill_dir in (None, spill):
+                audit = tbaudit.tbbatchgcd(spill_dir)
+                for (i, m) in enumerate(moduli):
+                    if isinstance(m, tuple):
+                        audit.add(*m)
+                    else:
+                        audit.add(m, "key" + str(i))
+                results.append(sorted(audit.run()))
+        self.assertEqual(results[0], results[1])
+        return results[0]
+
+    def test_no_findings(self):
+        p = PRIMES
+        self.assertEqual(self.audit([p[0]*p[1], p[2]*p[3], p[4]*p[5]]), [])
+
+    def test_shared_prime(self):
+        p = PRIMES
+        findings = self.audit([p[0]*p[1], p[0]*p[2], p[3]*p[4]])
+        self.assertEqual(findings, [
+            (tbaudit.SHARED_PRIME, p[0]*p[1], p[0], ["key0"]),
+            (tbaudit.SHARED_PRIME, p[0]*p[2], p[0], ["key1"])])
+
+    def test_exact_duplicate(self):
+        p = PRIMES
+        n = p[0]*p[1]
+        findings = self.audit([(n, "a.der", 65537, None), (n, "copy.der", 65537, None),
+                               p[2]*p[3]])
+        self.assertEqual(findings, [(tbaudit.SHARED_MODULUS, n, None, ["a.der", "copy.der"])])
+
+        # the same modulus with different exponents is two keys as well
+        findings = self.audit([(n, "a.der", 65537, None), (n, "b.der", 3, None),
+                               p[2]*p[3]])
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0][0], tbaudit.SHARED_MODULUS)
+
+    def test_private_and_public_of_one_key(self):
+        p = PRIMES
+        n = p[0]*p[1]
+        findings = self.audit([(n, "private.der", 65537, 12345),
+                               (n, "public.der", 65537, None),
+                               p[2]*p[3]])
+        self.assertEqual(findings, [])
+
+        # but two private keys with different d are two keys
+        findings = self.audit([(n, "a.der", 65537, 12345), (n, "b.der", 65537, 67890),
+                               p[2]*p[3]])
+        self.assertEqual(findings, [(tbaudit.SHARED_MODULUS, n, None, ["a.der", "b.der"])])
+
+    def test_both_primes_shared(self):
+        p = PRIMES
+        n = p[0]*p[1]
+        findings = self.audit([n, p[0]*p[2], p[1]*p[3], p[4]*p[5]])
+        self.assertEqual(len(findings), 3)
+        found = dict((m, (kind, g)) for (kind, m, g, sources) in findings)
+        self.assertEqual(found[n][0], tbaudit.SHARED_PRIME)
+        self.assertIn(found[n][1], (p[0], p[1]))
+        self.assertEqual(found[p[0]*p[2]], (tbaudit.SHARED_PRIME, p[0]))
+        self.assertEqual(found[p[1]*p[3]], (tbaudit.SHARED_PRIME, p[1]))
+
+    def test_logging(self):
+        # messages go to the module logger, never straight to stdout
+        p = PRIMES
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), \
+                self.assertLogs("tbencryptlib.tbaudit", "DEBUG") as logs:
+            audit = tbaudit.tbbatchgcd()
+            for n in (p[0]*p[1], p[2]*p[3], p[4]*p[5]):
+                audit.add(n)
+            audit.run()
+        self.assertEqual(out.getvalue(), "")
+        self.assertIn("product level 1, 2 nodes", "\n".join(logs.output))
+
+    def test_duplicate_sharing_a_prime(self):
+        p = PRIMES
+        n = p[0]*p[1]
+        findings = self.audit([(n, "a.der"), (n, "b.der"), p[0]*p[2]])
+        self.assertEqual(sorted(findings), [
+            (tbaudit.SHARED_MODULUS, n, p[0], ["a.der", "b.der"]),
+            (tbaudit.SHARED_PRIME, p[0]*p[2], p[0], ["key2"])])
+
+
+class TestTbKeyAudit(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.auditor = tbaudit.tbkeyaudit()
+        cls.numerics = tbnumerics.tbnumerics()
+        cls.numerics.sysrandom = random.Random(19)
+
+    def prime(self, bits):
+        return self.numerics.search_prime(1 << (bits - 1), 1 << bits)
+
+    def key(self, p, q, e=65537):
+        phi = (p - 1)*(q - 1)
+        return tbrsakey.tbrsakey(p*q, e, self.numerics.modinv(e, phi), p, q)
+
+    def test_normal_key(self):
+        keygen = tbkeygen.tbkeygen(1024, False, False, 0, tbkeygen.EXPONENT_F4)
+        keygen.generate_keypair()
+        key = keygen.get_key_context()
+        self.assertEqual(self.auditor.audit_key(key), [])
+        self.assertEqual(self.auditor.audit_key(key.public_key()), [])
+
+    def test_fermat(self):
+        p = self.prime(512)
+        q = self.numerics.search_prime(p + 2, p + (1 << 20))
+        key = self.key(p, q)
+        self.assertIsNotNone(self.auditor.check_fermat(key.n, p, q))
+        # without the primes, Fermat's method finds them
+        msg = self.auditor.check_fermat(key.n)
+        self.assertIn(hex(p), msg)
+        self.assertIn(hex(q), msg)
+        self.assertEqual([c for (c, m) in self.auditor.audit_key(key)], [tbaudit.CHECK_FERMAT])
+
+    def test_wiener(self):
+        (p, q) = (self.prime(512), self.prime(512))
+        phi = (p - 1)*(q - 1)
+        d = self.prime(200)
+        e = self.numerics.modinv(d, phi)
+        key = tbrsakey.tbrsakey(p*q, e, d, p, q)
+        self.assertIsNotNone(self.auditor.check_wiener(key.n, e, d))
+        # without d, the continued fraction of e/n gives it
+        self.assertIn(hex(d), self.auditor.check_wiener(key.n, e))
+        self.assertEqual([c for (c, m) in self.auditor.audit_key(key)], [tbaudit.CHECK_WIENER])
+
+    def test_smooth(self):
+        # p-1 a product of primes from the small prime table
+        small = self.auditor.primetable.primes()
+        rng = random.Random(7)
+        while True:
+            m = 2
+            while m.bit_length() < 512:
+                m *= rng.choice(small)
+            if self.numerics.is_prime(m + 1):
+                break
+        p = m + 1
+        q = self.prime(p.bit_length())
+        self.assertIsNotNone(self.auditor.check_smooth(p))
+        self.assertIsNone(self.auditor.check_smooth(q))
+        key = self.key(p, q)
+        issues = self.auditor.audit_key(key)
+        self.assertEqual(len(issues), 1)
+        self.assertEqual(issues[0][0], tbaudit.CHECK_SMOOTH)
+        self.assertTrue(issues[0][1].startswith("p-1 "))
+        # the public key alone does not show it
+        self.assertEqual(self.auditor.audit_key(key.public_key()), [])
+
+    def test_smooth_small_primes(self):
+        # below SMOOTH_MIN_PRIME_BITS nothing is flagged, smooth or not
+        small = self.auditor.primetable.primes()
+        self.assertIsNone(self.auditor.check_smooth(small[-1]))
+        self.assertIsNone(self.auditor.check_smooth(2*3*5*7*11*13*17*19*23*29*31*37*41*43*47 + 1))
+        for bits in (64, 127):
+            self.assertIsNone(self.auditor.check_smooth(self.prime(bits)))
+
+        # above it the cofactor needed is a quarter of the bits: a 160-bit
+        # p-1 keeping a 45-bit prime passes, one keeping a 30-bit prime not
+        rng = random.Random(11)
+        for (big, flagged) in ((45, False), (30, True)):
+            r = self.prime(big)
+            while True:
+                m = 2*r
+                while m.bit_length() < 160:
+                    m *= rng.choice(small)
+                if m.bit_length() == 160 and self.numerics.is_prime(m + 1):
+                    break
+            self.assertEqual(self.auditor.check_smooth(m + 1) is not None, flagged)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import math
+import unittest
+
+from tbencryptlib import tbbench
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbbench_unittest -v
+
+```
+"""
+
+def report(medians):
+    return {"meta": {}, "results": [{"name": name, "bits": bits, "median": median}
+                                    for ((name, bits), median) in medians.items()]}
+
+
+class TestTbBench(unittest.TestCase):
+
+    def test_percentile(self):
+        samples = [4.0, 1.0, 3.0, 2.0, 5.0]
+        self.assertEqual(tbbench.percentile(samples, 0), 1.0)
+        self.assertEqual(tbbench.percentile(samples, 50), 3.0)
+        self.assertEqual(tbbench.percentile(samples, 100), 5.0)
+        # between ranks: (5-1)*0.9 = 3.6, 4 + 0.6*(5-4)
+        self.assertAlmostEqual(tbbench.percentile(samples, 90), 4.6)
+        self.assertAlmostEqual(tbbench.percentile([1.0, 2.0], 50), 1.5)
+        self.assertEqual(tbbench.percentile([7.0], 99), 7.0)
+        self.assertIsNone(tbbench.percentile([], 50))
+
+    def test_summarize(self):
+        summary = tbbench.summarize([1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual((summary["min"], summary["max"]), (1.0, 4.0))
+        self.assertEqual(summary["mean"], 2.5)
+        self.assertEqual(summary["median"], 2.5)
+        self.assertAlmostEqual(summary["p90"], 3.7)
+        self.assertAlmostEqual(summary["p99"], 3.97)
+        self.assertNotIn("p50", summary)
+        self.assertEqual(tbbench.summarize([]), {"count": 0})
+
+    def test_compare(self):
+        base = report({("is_prime", 512): 1.0, ("xgcd", 512): 2.0, ("modinv", 512): 1.0})
+        new = report({("is_prime", 512): 1.25, ("xgcd", 512): 3.0, ("modinv", 512): 0.5,
+                      ("der_encode", 512): 9.0})
+        (rows, regressions, unmatched) = tbbench.compare(base, new, 25.0)
+        self.assertEqual([(r[0], r[1]) for r in rows],
+                         [("is_prime", 512), ("xgcd", 512), ("modinv", 512)])
+        self.assertEqual(unmatched, [("der_encode", 512, "new")])
+        self.assertEqual([r[4] for r in rows], [25.0, 50.0, -50.0])
+        # exactly at the threshold is not a regression
+        self.assertEqual([r[0] for r in regressions], ["xgcd"])
+        (rows, regressions, unmatched) = tbbench.compare(base, new, 50.0)
+        self.assertEqual(regressions, [])
+        (rows, regressions, unmatched) = tbbench.compare(base, new, 0.0)
+        self.assertEqual([r[0] for r in regressions], ["is_prime", "xgcd"])
+
+    def test_compare_unmatched(self):
+        # cases in only one report are not compared, but reported with the side they are on
+        base = report({("is_prime", 512): 1.0, ("xgcd", 512): 2.0, ("xgcd", 1024): 4.0})
+        new = report({("is_prime", 512): 1.0, ("xgcd", 2048): 8.0, ("modinv", 512): 0.5})
+        (rows, regressions, unmatched) = tbbench.compare(base, new, 10.0)
+        self.assertEqual([(r[0], r[1]) for r in rows], [("is_prime", 512)])
+        self.assertEqual(regressions, [])
+        self.assertEqual(sorted(unmatched), [("modinv", 512, "new"), ("xgcd", 512, "base"),
+                                             ("xgcd", 1024, "base"), ("xgcd", 2048, "new")])
+        (rows, regressions, unmatched) = tbbench.compare(base, report({}), 10.0)
+        self.assertEqual(rows, [])
+        self.assertEqual(len(unmatched), 3)
+
+    def test_compare_zero_baseline(self):
+        base = report({("is_prime", 512): 0.0, ("xgcd", 512): 0.0})
+        new = report({("is_prime", 512): 0.0, ("xgcd", 512): 0.001})
+        (rows, regressions, unmatched) = tbbench.compare(base, new, 10.0)
+        self.assertEqual(unmatched, [])
+        self.assertEqual(rows[0][4], 0.0)
+        self.assertEqual(rows[1][4], math.inf)
+        self.assertEqual([r[0] for r in regressions], ["xgcd"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from tbencryptlib import tbder
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbder_unittest -v
+
+```
+"""
+
+class TestTbDer(unittest.TestCase):
+
+    def test_encode_integer_small(self):
+        self.assertEqual(tbder.encode_integer(0), bytes.fromhex("020100"))
+        self.assertEqual(tbder.encode_integer(127), bytes.fromhex("02017f"))
+
+    def test_encode_integer_high_bit(self):
+        # a positive value with the top bit set needs a leading zero byte
+        self.assertEqual(tbder.encode_integer(128), bytes.fromhex("02020080"))
+        self.assertEqual(tbder.encode_integer(256), bytes.fromhex("02020100"))
+
+    def test_encode_long_length(self):
+        # 256 content bytes: 0x82 0x01 0x00 long form length
+        v = 1 << 2040
+        der = tbder.encode_integer(v)
+        self.assertEqual(der[:4], bytes.fromhex("02820100"))
+        self.assertEqual(len(der), 4 + 256)
+
+    def test_encode_rsa_public_key(self):
+        der = tbder.encode_rsa_public_key(3233, 17)
+        self.assertEqual(der, bytes.fromhex("300702020ca1020111"))
+
+    def test_decode_roundtrip_lazy(self):
+        values = (0, 3233, 17, 2753, 61, 53, 53, 49, 38)
+        der = tbder.encode_integer_sequence(values)
+        (ints, private) = tbder.decode_rsa_key(bytearray(der))
+        self.assertTrue(private)
+        self.assertEqual(ints.values.count(None), 8)
+        self.assertEqual(ints[1], 3233)
+        self.assertEqual(ints.values.count(None), 7)
+        self.assertEqual(tuple(ints[i] for i in range(len(ints))), values)
+
+    def test_decode_rejects_bad_input(self):
+        der = tbder.encode_rsa_public_key(3233, 17)
+        self.assertRaises(Exception, tbder.decode_rsa_key, der[:-1])
+        self.assertRaises(Exception, tbder.decode_rsa_key, der + b"\x00")
+        self.assertRaises(Exception, tbder.decode_rsa_key, tbder.encode_integer(5))
+
+    def test_wrapped_keys(self):
+        rsa_pub = tbder.encode_rsa_public_key(3233, 17)
+        spki = tbder.encode_spki_public_key(rsa_pub)
+        self.assertEqual(spki[:2], bytes.fromhex("301b"))
+        (ints, private) = tbder.decode_rsa_key(spki)
+        self.assertFalse(private)
+        self.assertEqual((ints[0], ints[1]), (3233, 17))
+
+        rsa_priv = tbder.encode_rsa_private_key(3233, 17, 2753, 61, 53, 53, 49, 38)
+        pkcs8 = tbder.encode_pkcs8_private_key(rsa_priv)
+        (off, end) = tbder.unwrap_rsa_key(pkcs8)
+        self.assertEqual(pkcs8[off:end], rsa_priv)
+        self.assertEqual(tbder.unwrap_rsa_key(rsa_priv), (0, len(rsa_priv)))
+
+
+if __name__ == '__main__':
+    unittest.main()
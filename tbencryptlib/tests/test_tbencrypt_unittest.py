@@ -0,0 +1,192 @@
+import io
+import os
+import re
+import csv
+import json
+import tempfile
+import unittest
+import contextlib
+import unittest.mock
+
+import tbencrypt
+from tbencryptlib import tbbench
+from tbencryptlib import tbmetrics
+from tbencryptlib import tbrsakey
+
+"""
+Tests of the batch and stress mode helpers of tbencrypt.py.
+
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbencrypt_unittest -v
+
+```
+"""
+
+class TestTbEncryptStress(unittest.TestCase):
+
+    def test_parse_bits_mix(self):
+        self.assertEqual(tbencrypt.parse_bits_mix("1024:3,2048:1"), ((1024, 3.0), (2048, 1.0)))
+        self.assertEqual(tbencrypt.parse_bits_mix("512"), ((512, 1.0),))
+        self.assertEqual(tbencrypt.parse_bits_mix(" 512 , 1024:0.5"),
+                         ((512, 1.0), (1024, 0.5)))
+        for bad in ("", "x", "1024:", "1024:a", "1024:0", "1024:-1", "8", "1024,,2048"):
+            with self.assertRaises(ValueError):
+                tbencrypt.parse_bits_mix(bad)
+
+    def test_stress_rows(self):
+        samples = {2048: ([0.4, 0.2], [0.001, 0.003, 0.002]),
+                   512: ([0.1], [0.0005])}
+        rows = tbencrypt.stress_rows(samples, 2.0)
+        self.assertEqual([r["bits"] for r in rows], [512, 2048, "all"])
+        for row in rows:
+            self.assertEqual(set(row), set(tbencrypt.STRESS_FIELDS))
+        (small, large, total) = rows
+        self.assertEqual((small["keys"], small["ops"]), (1, 1))
+        self.assertEqual((large["keys"], large["ops"]), (2, 3))
+        self.assertEqual((total["keys"], total["ops"]), (3, 4))
+        self.assertEqual(large["keys_per_s"], 1.0)
+        self.assertEqual(total["ops_per_s"], 2.0)
+        self.assertAlmostEqual(large["keygen_p50_ms"], 300.0)
+        self.assertAlmostEqual(large["op_p50_ms"], 2.0)
+        self.assertAlmostEqual(small["keygen_p99_ms"], 100.0)
+        self.assertAlmostEqual(total["keygen_p50_ms"], 200.0)
+
+        # a size with no private ops, and a run that took no time
+        rows = tbencrypt.stress_rows({64: ([0.01], [])}, 0.0)
+        self.assertEqual(rows[0]["op_p95_ms"], None)
+        self.assertEqual(rows[0]["keys_per_s"], 0.0)
+        self.assertEqual(tbencrypt.stress_rows({}, 1.0)[0]["keys"], 0)
+
+    def test_run_stress(self):
+        metrics = tbmetrics.get_metrics()
+        metrics.reset()
+        with tempfile.TemporaryDirectory() as d:
+            (csv_file, json_file) = (os.path.join(d, "s.csv"), os.path.join(d, "s.json"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                rows = tbencrypt.run_stress(((128, 1), (256, 1)), None, 4, 2, 3,
+                                            "f4", csv_file, json_file)
+            with open(csv_file, newline="") as f:
+                table = list(csv.DictReader(f))
+            with open(json_file) as f:
+                report = json.load(f)
+
+        self.assertEqual(rows[-1]["keys"], 4)
+        self.assertEqual(rows[-1]["ops"], 12)
+        self.assertEqual(table[-1]["bits"], "all")
+        self.assertEqual(int(table[-1]["keys"]), 4)
+        self.assertEqual(report["results"], rows)
+        self.assertEqual(report["meta"]["workers"], 2)
+        # the workers' counts are merged into this process
+        snap = metrics.snapshot()
+        self.assertEqual(snap["timers"]["keygen_self_test"]["count"], 4)
+        self.assertGreaterEqual(snap["counters"]["pow_calls"], 12)
+        metrics.reset()
+
+
+
+class TestTbEncryptBatch(unittest.TestCase):
+
+    def test_verify_small_keys(self):
+        # a small key can pass every check, so --verify ends
+        for i in range(5):
+            (priv, pub, line) = tbencrypt._batch_keygen(128, "f4", verify=True)
+            self.assertTrue(priv and pub)
+
+    def test_verify_retries(self):
+        class failing:
+            def audit_key(self, key):
+                return [("smooth", "p-1 is smooth")]
+        with unittest.mock.patch.object(tbencrypt.tbaudit, "get_key_auditor", failing), \
+                unittest.mock.patch.object(tbencrypt, "VERIFY_RETRIES", 2):
+            with self.assertRaisesRegex(Exception, "3 tries.*smooth: p-1 is smooth"):
+                tbencrypt._batch_keygen(128, "f4", verify=True)
+
+    def test_read_batch_jobs(self):
+        spec = io.StringIO('{"bits": 512, "count": 3, "name": "web"}\n'
+                           '\n'
+                           '  {"bits": "1024"}  \n')
+        self.assertEqual(tbencrypt.read_batch_jobs(spec),
+                         [(512, 3, "web"), (1024, 1, "tbkey1024")])
+        self.assertEqual(tbencrypt.read_batch_jobs(io.StringIO("")), [])
+
+        # the error names the line, counting blank ones
+        for bad in ('{"bits": 512', '{"count": 2}', '{"bits": 512, "count": "x"}',
+                    '[512]', 'bits=512'):
+            spec = io.StringIO('{"bits": 512}\n\n' + bad + '\n')
+            with self.assertRaisesRegex(Exception, "read_batch_jobs: line 3: "):
+                tbencrypt.read_batch_jobs(spec)
+
+    def test_gen_keypair_batch(self):
+        with tempfile.TemporaryDirectory() as d:
+            out = os.path.join(d, "keys")
+            authorized = os.path.join(d, "authorized_keys")
+            with contextlib.redirect_stdout(io.StringIO()):
+                total = tbencrypt.gen_keypair_batch([(128, 2, "a"), (256, 1, "b")], out, 1,
+                                                    "f4", authorized_keys=authorized)
+            self.assertEqual(total, 3)
+            self.assertEqual(sorted(os.listdir(out)), [
+                "a_000000_private.der", "a_000000_public.der",
+                "a_000001_private.der", "a_000001_public.der",
+                "b_000000_private.der", "b_000000_public.der"])
+            moduli = set()
+            for (name, bits) in (("a_000000", 128), ("a_000001", 128), ("b_000000", 256)):
+                private = tbrsakey.load_key_file(os.path.join(out, name + "_private.der"))
+                public = tbrsakey.load_key_file(os.path.join(out, name + "_public.der"))
+                self.assertEqual((public.n, public.e), (private.n, private.e))
+                self.assertEqual(private.p*private.q, private.n)
+                self.assertIn(private.n.bit_length(), (bits - 1, bits))
+                moduli.add(private.n)
+            self.assertEqual(len(moduli), 3)
+            with open(authorized) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertTrue(all(line.startswith("ssh-rsa ") for line in lines))
+
+    def test_gen_keypair_encodes_once(self):
+        metrics = tbmetrics.get_metrics()
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as d:
+            os.chdir(d)
+            try:
+                for fmt in ("der", "pem", "ssh"):
+                    metrics.reset()
+                    out = io.StringIO()
+                    with contextlib.redirect_stdout(out):
+                        tbencrypt.gen_keypair(256, 0, "f4", fmt)
+                    self.assertEqual(metrics.snapshot()["timers"]["encode"]["count"], 1)
+                    # the DER dump is for DER output only
+                    self.assertEqual("ASN.1 ENCODE" in out.getvalue(), fmt == "der")
+                    self.assertTrue(os.path.exists("tbprivate." + fmt))
+            finally:
+                os.chdir(cwd)
+                metrics.reset()
+
+
+class TestTbEncryptCompare(unittest.TestCase):
+
+    def test_compare_benchmarks_unmatched(self):
+        def report(medians):
+            return {"meta": {"backend": "gmpy2"},
+                    "results": [{"name": name, "bits": bits, "median": median}
+                                for ((name, bits), median) in medians]}
+        with tempfile.TemporaryDirectory() as d:
+            (base_file, new_file) = (os.path.join(d, "base.json"), os.path.join(d, "new.json"))
+            tbbench.save_report(report([(("is_prime", 512), 1.0), (("xgcd", 512), 2.0)]),
+                                base_file)
+            tbbench.save_report(report([(("is_prime", 512), 2.0), (("modinv", 512), 1.0)]),
+                                new_file)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                slower = tbencrypt.compare_benchmarks(base_file, new_file, 10.0)
+        self.assertEqual(slower, 1)
+        text = out.getvalue()
+        self.assertRegex(text, "xgcd +512  only in " + re.escape(base_file))
+        self.assertRegex(text, "modinv +512  only in " + re.escape(new_file))
+        self.assertIn("1 cases compared, 1 slower by more than 10%, 2 in only one report",
+                      text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import os
+import tempfile
+import unittest
+
+from tbencryptlib import tbfilecrypt
+from tbencryptlib import tbkeygen
+from tbencryptlib import tbpad
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbfilecrypt_unittest -v
+
+```
+"""
+
+class TestTbFileCrypt(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        keygen = tbkeygen.tbkeygen(1024, False, False, 0, tbkeygen.EXPONENT_F4)
+        keygen.generate_keypair()
+        cls.key = keygen.get_key_context()
+
+    def roundtrip(self, data, padding=tbpad.PAD_OAEP, workers=0):
+        crypt = tbfilecrypt.tbfilecrypt(self.key, padding, tbpad.DEFAULT_HASH, workers)
+        # encryption needs only the public key
+        public = tbfilecrypt.tbfilecrypt(self.key.public_key(), padding)
+        cipher = io.BytesIO()
+        self.assertEqual(public.encrypt_stream(io.BytesIO(data), cipher),
+                         (len(data), crypt.encrypted_size(len(data))))
+        cipher = cipher.getvalue()
+        self.assertEqual(len(cipher) % crypt.block_size, 0)
+
+        plain = io.BytesIO()
+        self.assertEqual(crypt.decrypt_stream(io.BytesIO(cipher), plain),
+                         (len(cipher), len(data)))
+        self.assertEqual(plain.getvalue(), data)
+        return cipher
+
+    def test_roundtrip(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        chunk = crypt.chunk_size
+        # more than one batch, with a short last block
+        data = os.urandom(chunk*(tbfilecrypt.BATCH_BLOCKS + 3) + 17)
+        for padding in tbpad.PADDINGS:
+            cipher = self.roundtrip(data, padding)
+        self.assertEqual(len(cipher), crypt.block_size*(tbfilecrypt.BATCH_BLOCKS + 4))
+
+    def test_roundtrip_workers(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        data = os.urandom(crypt.chunk_size*(3*tbfilecrypt.BATCH_BLOCKS) + 1)
+        self.roundtrip(data, tbpad.PAD_OAEP, 2)
+
+    def test_empty(self):
+        for padding in tbpad.PADDINGS:
+            self.assertEqual(self.roundtrip(b"", padding), b"")
+
+    def test_exact_multiple(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        for nblocks in (1, 3, tbfilecrypt.BATCH_BLOCKS):
+            cipher = self.roundtrip(os.urandom(crypt.chunk_size*nblocks))
+            self.assertEqual(len(cipher), crypt.block_size*nblocks)
+
+    def test_file(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        data = os.urandom(crypt.chunk_size*5 + 1)
+        with tempfile.TemporaryDirectory() as d:
+            (clear, cipher, back) = [os.path.join(d, f) for f in ("clear", "cipher", "back")]
+            with open(clear, "wb") as f:
+                f.write(data)
+            crypt.encrypt_file(clear, cipher)
+            self.assertEqual(os.path.getsize(cipher), crypt.encrypted_size(len(data)))
+            crypt.decrypt_file(cipher, back)
+            with open(back, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_truncated(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        cipher = self.roundtrip(os.urandom(crypt.chunk_size*3))
+        for cut in (1, crypt.block_size - 1, crypt.block_size + 5):
+            with self.assertRaises(Exception):
+                crypt.decrypt_stream(io.BytesIO(cipher[:-cut]), io.BytesIO())
+
+    def test_corrupted(self):
+        crypt = tbfilecrypt.tbfilecrypt(self.key)
+        k = crypt.block_size
+        cipher = self.roundtrip(os.urandom(crypt.chunk_size*3))
+
+        # a flipped byte in the second block fails the OAEP check
+        bad = bytearray(cipher)
+        bad[k + k//2] ^= 0x40
+        with self.assertRaises(Exception):
+            crypt.decrypt_stream(io.BytesIO(bytes(bad)), io.BytesIO())
+
+        # a block that is not below n fails with either padding
+        bad = cipher[:k] + b"\xff"*k + cipher[2*k:]
+        for padding in tbpad.PADDINGS:
+            crypt = tbfilecrypt.tbfilecrypt(self.key, padding)
+            with self.assertRaises(Exception):
+                crypt.decrypt_stream(io.BytesIO(bad), io.BytesIO())
+
+
+if __name__ == '__main__':
+    unittest.main()
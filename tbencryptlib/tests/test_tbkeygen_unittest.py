@@ -0,0 +1,131 @@
+import math
+import unittest
+
+from tbencryptlib import tbkeygen
+from tbencryptlib import tbmetrics
+from tbencryptlib import tbnumerics
+from tbencryptlib.tests.helpers import ScriptedNumerics
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbkeygen_unittest -v
+
+```
+"""
+
+
+class TestTbKeygen(unittest.TestCase):
+
+    def assertValidKey(self, keygen, bits):
+        (p, q) = keygen.get_primes()
+        (E, N) = keygen.get_public_keypair()
+        (D, N) = keygen.get_private_keypair()
+        self.assertEqual(p*q, N)
+        self.assertIn(N.bit_length(), (bits - 1, bits))
+        self.assertEqual((D*E) % ((p - 1)*(q - 1)), 1)
+        self.assertTrue(keygen.test_keys())
+
+    def test_two_keypairs_from_one_instance(self):
+        keygen = tbkeygen.tbkeygen(256, False, False, 0, tbkeygen.EXPONENT_F4)
+        keygen.generate_keypair()
+        self.assertValidKey(keygen, 256)
+        first = keygen.get_public_keypair()
+        keygen.generate_keypair()
+        self.assertValidKey(keygen, 256)
+        self.assertNotEqual(keygen.get_public_keypair(), first)
+
+    def test_two_keypairs_with_workers(self):
+        for workers in (2, 4):
+            keygen = tbkeygen.tbkeygen(256, False, False, workers, tbkeygen.EXPONENT_F4)
+            keygen.metrics = tbmetrics.tbmetrics()
+            try:
+                for i in range(2):
+                    keygen.generate_keypair()
+                    self.assertValidKey(keygen, 256)
+            finally:
+                keygen.close()
+            # each prime is timed on its own, as without workers
+            timers = keygen.metrics.snapshot()["timers"]
+            self.assertEqual(timers["keygen_p"]["count"], 2)
+            self.assertEqual(timers["keygen_q"]["count"], 2)
+            self.assertNotIn("keygen_pq", timers)
+
+    '''
+        keypair under strategy; checks it and returns (keygen, E)
+    '''
+    def keypair(self, strategy, keygen=None):
+        if keygen is None:
+            keygen = tbkeygen.tbkeygen(512, False, False, 0, strategy)
+        keygen.generate_keypair()
+        self.assertValidKey(keygen, 512)
+        (p, q) = keygen.get_primes()
+        (E, N) = keygen.get_public_keypair()
+        self.assertEqual(math.gcd(E, (p - 1)*(q - 1)), 1)
+        key = keygen.get_key_context()
+        for m in (2, 65535, N - 2):
+            self.assertEqual(key.decrypt(key.encrypt(m)), m)
+        return (keygen, E)
+
+    def test_exponent_f4(self):
+        (keygen, E) = self.keypair(tbkeygen.EXPONENT_F4)
+        self.assertEqual(E, tbkeygen.F4)
+        (p, q) = keygen.get_primes()
+        self.assertNotEqual((p - 1) % tbkeygen.F4, 0)
+        self.assertNotEqual((q - 1) % tbkeygen.F4, 0)
+
+    def test_exponent_f4_replaces_prime(self):
+        # a prime p with 65537 | p-1 must not be used with E = 65537
+        numerics = tbnumerics.tbnumerics()
+        pbits = 512//2 + 2
+        k = (1 << (pbits - 2))//tbkeygen.F4
+        while not numerics.is_prime(2*k*tbkeygen.F4 + 1):
+            k += 1
+        bad = 2*k*tbkeygen.F4 + 1
+        self.assertEqual(bad.bit_length(), pbits)
+
+        keygen = tbkeygen.tbkeygen(512, False, False, 0, tbkeygen.EXPONENT_F4)
+        keygen.numerics = ScriptedNumerics([bad])
+        self.keypair(tbkeygen.EXPONENT_F4, keygen)
+        self.assertNotIn(bad, keygen.get_primes())
+        self.assertEqual(keygen.get_primes()[0].bit_length(), pbits)
+
+    def test_exponent_small_prime(self):
+        numerics = tbnumerics.tbnumerics()
+        for i in range(3):
+            (keygen, E) = self.keypair(tbkeygen.EXPONENT_SMALL_PRIME)
+            self.assertEqual(E.bit_length(), tbkeygen.SMALL_EXPONENT_BITS)
+            self.assertTrue(numerics.is_prime(E))
+
+    def test_exponent_legacy_random(self):
+        numerics = tbnumerics.tbnumerics()
+        (keygen, E) = self.keypair(tbkeygen.EXPONENT_LEGACY_RANDOM)
+        N = keygen.get_public_keypair()[1]
+        self.assertEqual(E.bit_length(), bin(N).count("1"))
+        self.assertTrue(numerics.is_prime(E))
+
+    def test_exponent_from_primepair(self):
+        numerics = tbnumerics.tbnumerics()
+        p = numerics.gen_nbit_prime(256)[0]
+        q = numerics.gen_nbit_prime(256)[0]
+        while (p - 1) % tbkeygen.F4 == 0 or (q - 1) % tbkeygen.F4 == 0:
+            q = numerics.gen_nbit_prime(256)[0]
+        phi = (p - 1)*(q - 1)
+        for strategy in tbkeygen.EXPONENT_STRATEGIES:
+            keygen = tbkeygen.tbkeygen(512, False, False, 0, strategy)
+            (N, E, D) = keygen.generate_keypair_from_primepair(p, q)
+            self.assertEqual(N, p*q)
+            self.assertEqual(math.gcd(E, phi), 1)
+            self.assertEqual((D*E) % phi, 1)
+            if strategy == tbkeygen.EXPONENT_F4:
+                self.assertEqual(E, tbkeygen.F4)
+            self.assertEqual(pow(pow(12345, E, N), D, N), 12345)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(Exception):
+            tbkeygen.tbkeygen(512, False, False, 0, "e3")
+
+
+if __name__ == '__main__':
+    unittest.main()
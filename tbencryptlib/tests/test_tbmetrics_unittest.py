@@ -0,0 +1,66 @@
+import unittest
+
+from tbencryptlib import tbmetrics
+from tbencryptlib.tbnumerics import tbnumerics
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbmetrics_unittest -v
+
+```
+"""
+
+class TestTbMetrics(unittest.TestCase):
+
+    def test_counters_and_timers(self):
+        m = tbmetrics.tbmetrics()
+        m.incr("pow_calls")
+        m.incr("pow_calls", 2)
+        m.add_time("keygen_p", 0.5)
+        m.add_time("keygen_p", 1.5)
+        with m.timer("encode"):
+            pass
+        snap = m.snapshot()
+        self.assertEqual(snap["counters"], {"pow_calls": 3})
+        self.assertEqual(snap["timers"]["keygen_p"],
+                         {"count": 2, "total": 2.0, "max": 1.5, "mean": 1.0})
+        self.assertEqual(snap["timers"]["encode"]["count"], 1)
+
+        text = m.prometheus()
+        self.assertIn("# TYPE tbencrypt_pow_calls_total counter\ntbencrypt_pow_calls_total 3\n", text)
+        self.assertIn("tbencrypt_keygen_p_seconds_count 2\n", text)
+        self.assertIn("tbencrypt_keygen_p_seconds_sum 2.0\n", text)
+        m.reset()
+        self.assertEqual(m.snapshot(), {"counters": {}, "timers": {}})
+
+    def test_merge(self):
+        worker = tbmetrics.tbmetrics()
+        worker.incr("pow_calls", 4)
+        worker.incr("mr_rounds")
+        worker.add_time("keygen_p", 2.0)
+        m = tbmetrics.tbmetrics()
+        m.incr("pow_calls")
+        m.add_time("keygen_p", 1.0)
+        m.merge(worker.snapshot())
+        m.merge(worker.snapshot())
+        snap = m.snapshot()
+        self.assertEqual(snap["counters"], {"pow_calls": 9, "mr_rounds": 2})
+        self.assertEqual(snap["timers"]["keygen_p"],
+                         {"count": 3, "total": 5.0, "max": 2.0, "mean": 5.0/3})
+
+    def test_prime_search_counts(self):
+        tbn = tbnumerics()
+        tbn.metrics = tbmetrics.tbmetrics()
+        tbn.gen_nbit_prime(256)
+        counters = tbn.metrics.snapshot()["counters"]
+        self.assertTrue(counters.get("prime_candidates", 0) > 0 or
+                        counters.get("next_prime_calls", 0) > 0)
+
+    def tearDown(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
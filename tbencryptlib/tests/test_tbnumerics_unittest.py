@@ -1,12 +1,16 @@
 import unittest
+import unittest.mock
+import multiprocessing
 
-from tbnumerics import tbnumerics
+from tbencryptlib import tbmetrics
+from tbencryptlib import tbnumerics as tbnumerics_module
+from tbencryptlib.tbnumerics import tbnumerics, tbprimetable
 
 """
-To run: from one level above this file:
+To run: from the directory above tbencryptlib:
    
 ```
-    python -m tests.test_tbnumerics_unittest -v
+    python -m unittest tbencryptlib.tests.test_tbnumerics_unittest -v
 
 ```
 """
@@ -29,16 +33,149 @@ class TestTbNumerics(unittest.TestCase):
         lst = self.tbn.factor_powers_of_p(38, 3)
         self.assertListEqual(lst, [1, 1, 0, 2])
  
+    def test_factor_powers_of_p_large(self):
+        # past the digit-at-a-time base case, and past the str() limit
+        n = 7**5000 * 3 + 7**1234 * 5 + 6
+        lst = self.tbn.factor_powers_of_p(n, 7)
+        self.assertEqual(len(lst), 5001)
+        self.assertEqual([i for (i, d) in enumerate(reversed(lst)) if d], [0, 1234, 5000])
+        self.assertEqual(self.tbn.sum_of_digits(10**9000 - 1), 9 * 9000)
+        self.assertListEqual(self.tbn.factor_powers_of_p(2**70 + 5, 32)[-2:], [0, 5])
+        self.assertListEqual(self.tbn.factor_powers_of_two(37), [5, 2, 0])
+
+    def test_bit_length(self):
+        self.assertEqual(self.tbn.bit_length(2**1000), 1000)
+        self.assertEqual(self.tbn.bit_length(2**1000 + 1), 1001)
+        self.assertEqual(self.tbn.bit_length(1), 0)
+
     def test_factor_is_prime_31(self):
         b = self.tbn.is_prime(31)
         self.assertEqual(b, True)
 
+    def test_gen_nbit_prime_race(self):
+        # the racing search: a prime of exactly nbits, and no worker left behind
+        for (nbits, method) in ((256, None), (512, tbnumerics_module.PRIMALITY_BPSW)):
+            (p, ent) = self.tbn.gen_nbit_prime(nbits, method, 2)
+            self.assertEqual(p.bit_length(), nbits)
+            self.assertTrue(self.tbn.is_prime(p, tbnumerics_module.PRIMALITY_BPSW))
+            self.assertEqual(multiprocessing.active_children(), [])
+
+    def test_gen_prime_ceil_one_prime(self):
+        # [2, 4) and [2, 5) hold one usable prime, 3
+        for ceil in (4, 5):
+            for i in range(20):
+                self.assertEqual(self.tbn.gen_prime_ceil(ceil), 3)
+        self.assertEqual(self.tbn.search_prime(24, 30), 29)
+        self.assertEqual(self.tbn.search_prime(2**61 - 1, 2**61), 2**61 - 1)
+
+    def test_search_prime_method(self):
+        # the requested test is the final check on every backend
+        tbn = tbnumerics()
+        tbn.metrics = tbmetrics.tbmetrics()
+        p = tbn.search_prime(2**255, 2**256, tbnumerics_module.PRIMALITY_BPSW)
+        counters = tbn.metrics.snapshot()["counters"]
+        self.assertGreaterEqual(counters["bpsw_tests"], 1)
+        self.assertGreaterEqual(counters["prime_candidates"], 1)
+        self.assertTrue(tbn.is_prime(p))
+
+    def test_search_prime_skips_trial_division(self):
+        # sieve survivors go straight to the probable prime test
+        tbn = tbnumerics()
+        with unittest.mock.patch.object(tbn.primetable, "passes_trial_division",
+                                        side_effect=AssertionError("trial divided")):
+            for method in (tbnumerics_module.PRIMALITY_MR, tbnumerics_module.PRIMALITY_BPSW):
+                p = tbn.search_prime(2**255, 2**256, method)
+                self.assertEqual(p.bit_length(), 256)
+        self.assertTrue(tbn.is_prime(p, tbnumerics_module.PRIMALITY_BPSW))
+
+    @unittest.skipIf(tbnumerics_module.get_backend().next_prime is None,
+                     "the backend has no next_prime")
+    def test_search_prime_no_prime(self):
+        with self.assertRaises(Exception):
+            self.tbn.search_prime(24, 29)
+
     def test_gen_prime_ceil_100(self):
         p = self.tbn.gen_prime_ceil(100)
         self.assertEqual(self.tbn.is_prime(p), True)
         self.assertGreater(100, p)
+
+    def test_primes_in_range_segmented(self):
+        # a tiny in-memory table forces the segmented sieve path
+        table = tbprimetable(64, False)
+        lst = list(table.primes_in_range(7900, 7960))
+        self.assertListEqual(lst, [7901, 7907, 7919, 7927, 7933, 7937, 7949, 7951])
+
+    def test_prime_factors_past_table(self):
+        lst = self.tbn.prime_factors(12 * 1048583 * 2147483647)
+        self.assertListEqual(lst, [2, 2, 3, 1048583, 2147483647])
+
+    def test_factorize_rho(self):
+        # two 32-bit primes are out of reach of the trial division
+        n = 4294967291 * 4294967279 * 9
+        self.assertListEqual(self.tbn.factorize(n), [3, 3, 4294967279, 4294967291])
+        self.assertEqual(tbnumerics_module.factor_cache_get(n), (3, 3, 4294967279, 4294967291))
+        self.assertListEqual(self.tbn.prime_factors((2**61 - 1)**2), [2**61 - 1, 2**61 - 1])
        
 
+    def test_is_prime_strong_pseudoprimes(self):
+        # strong pseudoprimes to the bases 2..23 and 2..37
+        self.assertEqual(self.tbn.is_prime(3825123056546413051), False)
+        self.assertEqual(self.tbn.is_prime(318665857834031151167461), False)
+        self.assertEqual(self.tbn.is_prime(2**127 - 1), True)
+
+    def test_mr_rounds(self):
+        self.assertEqual(self.tbn.mr_rounds(1024), 5)
+        self.assertEqual(self.tbn.mr_rounds(2048), 4)
+        self.assertEqual(self.tbn.mr_rounds(256), 12)
+
+    def test_is_prime_bpsw(self):
+        self.assertEqual(self.tbn.is_prime(3825123056546413051, "bpsw"), False)
+        self.assertEqual(self.tbn.is_prime(2**521 - 1, "bpsw"), True)
+
+    def test_jacobi_15(self):
+        lst = [self.tbn.jacobi(a, 15) for a in range(8)]
+        self.assertListEqual(lst, [0, 1, 1, 0, 1, 0, 0, -1])
+
+    def test_modinv_batch(self):
+        m = 3120
+        values = [17, 4, 7, 0, 3121, -17]
+        self.assertListEqual(self.tbn.modinv_batch(values, m),
+                             [2753, None, 1783, None, 1, 367])
+        self.assertListEqual(self.tbn.modinv_batch([4, 6], 8), [None, None])
+        self.assertListEqual(self.tbn.modinv_batch([], 8), [])
+
+    def test_greatest_common_divisor(self):
+        self.assertEqual(self.tbn.greatest_common_divisor(12, 18), 6)
+        self.assertEqual(self.tbn.greatest_common_divisor(18, 12), 6)
+        self.assertEqual(self.tbn.greatest_common_divisor(0, 5), 5)
+
+    def test_next_multiple_of(self):
+        self.assertEqual(self.tbn.next_multiple_of(10, 8), 16)
+        self.assertEqual(self.tbn.next_multiple_of(16, 8), 24)
+
+    def test_backends_agree(self):
+        try:
+            for name in tbnumerics_module.available_backends():
+                tbnumerics_module.set_backend(name)
+                tbn = tbnumerics()
+                self.assertEqual(tbnumerics_module.backend_name(), name)
+                self.assertEqual(tbn.modinv(17, 3120), 2753)
+                self.assertRaises(Exception, tbn.modinv, 4, 8)
+                self.assertEqual(tbn.is_prime(2**127 - 1), True)
+                self.assertEqual(tbn.is_prime(3825123056546413051, "bpsw"), False)
+                # far enough past HGCD_THRESHOLD for the half-gcd to recurse
+                a = 3**20000 * 7
+                b = 5**12000 * 7
+                (g, x, y) = tbn.xgcd(a, b)
+                self.assertEqual((g, a*x + b*y), (7, 7))
+                self.assertEqual(tbn.xgcd(17, 3120), tbn.egcd_iter(17, 3120))
+                self.assertEqual(tbn.modinv(a // 7, b), pow(a // 7, -1, b))
+                p = tbn.search_prime(1 << 63, 1 << 64)
+                self.assertTrue(tbn.is_prime(p))
+            self.assertRaises(Exception, tbnumerics_module.set_backend, "no-such-backend")
+        finally:
+            tbnumerics_module.set_backend()
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,48 @@
+import unittest
+
+from tbencryptlib import tbpad
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbpad_unittest -v
+
+```
+"""
+
+class TestTbPad(unittest.TestCase):
+
+    def test_max_message_size(self):
+        self.assertEqual(tbpad.max_message_size(256, tbpad.PAD_PKCS1), 245)
+        self.assertEqual(tbpad.max_message_size(256, tbpad.PAD_OAEP, "sha256"), 190)
+        self.assertEqual(tbpad.max_message_size(256, tbpad.PAD_OAEP, "sha1"), 214)
+        self.assertRaises(Exception, tbpad.max_message_size, 64, tbpad.PAD_OAEP, "sha256")
+
+    def test_roundtrip(self):
+        k = 128
+        for padding in tbpad.PADDINGS:
+            for n in (0, 1, tbpad.max_message_size(k, padding)):
+                msg = bytes(range(n))
+                em = tbpad.pad(msg, k, padding)
+                self.assertEqual(len(em), k)
+                self.assertEqual(em[0], 0)
+                self.assertEqual(tbpad.unpad(em, k, padding), msg)
+
+    def test_pkcs1_layout(self):
+        em = tbpad.pkcs1_pad(b"abc", 64)
+        self.assertEqual(em[:2], b"\x00\x02")
+        self.assertNotIn(0, em[2:-4])
+        self.assertEqual(em[-4:], b"\x00abc")
+
+    def test_unpad_rejects(self):
+        k = 128
+        em = bytearray(tbpad.oaep_pad(b"secret", k))
+        em[-1] ^= 1
+        self.assertRaises(Exception, tbpad.oaep_unpad, bytes(em), k)
+        self.assertRaises(Exception, tbpad.pkcs1_unpad, bytes(k), k)
+        self.assertRaises(Exception, tbpad.pad, bytes(k), k, tbpad.PAD_PKCS1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from tbencryptlib import tbpem
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbpem_unittest -v
+
+```
+"""
+
+class TestTbPem(unittest.TestCase):
+
+    def test_line_wrapping(self):
+        der = bytes(range(256))*2
+        pem = tbpem.encode_pem(tbpem.LABEL_PUBLIC, der)
+        lines = pem.split(b"\n")
+        self.assertEqual(lines[0], b"-----BEGIN PUBLIC KEY-----")
+        self.assertEqual(lines[-2], b"-----END PUBLIC KEY-----")
+        body = lines[1:-2]
+        self.assertTrue(all(len(l) == 64 for l in body[:-1]))
+        self.assertTrue(0 < len(body[-1]) <= 64)
+
+    def test_roundtrip(self):
+        for n in (0, 1, 47, 48, 49, 1000):
+            der = bytes((i*7) & 0xff for i in range(n))
+            pem = tbpem.encode_pem(tbpem.LABEL_RSA_PRIVATE, der)
+            self.assertEqual(tbpem.decode_pem(pem), (tbpem.LABEL_RSA_PRIVATE, der))
+
+    def test_select_label(self):
+        text = ("junk\n" + tbpem.encode_pem("CERTIFICATE", b"abc").decode() +
+                tbpem.encode_pem(tbpem.LABEL_PRIVATE, b"xyz").decode())
+        self.assertEqual(tbpem.decode_pem(text, tbpem.LABEL_PRIVATE)[1], b"xyz")
+        self.assertEqual(len(list(tbpem.iter_pem(text))), 2)
+        self.assertRaises(Exception, tbpem.decode_pem, text, tbpem.LABEL_PUBLIC)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+from tbencryptlib import tbnumerics
+from tbencryptlib import tbprimepool
+from tbencryptlib.tests.helpers import ScriptedNumerics
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbprimepool_unittest -v
+
+```
+"""
+
+
+class TestTbPrimePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.numerics = tbnumerics.tbnumerics()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def primes(self, bits, count):
+        return [self.numerics.gen_nbit_prime(bits)[0] for i in range(count)]
+
+    def test_header(self):
+        pool = tbprimepool.tbprimepool(64, self.dir, 8)
+        pool.close()
+        fname = tbprimepool.pool_file(self.dir, 64)
+        with open(fname, "rb") as f:
+            head = f.read(tbprimepool.HEADER_SIZE)
+        self.assertEqual(head[0:8], tbprimepool.POOL_MAGIC)
+        self.assertEqual(int.from_bytes(head[8:12], 'big'), 64)
+        self.assertEqual(int.from_bytes(head[12:16], 'big'), 8)
+        self.assertEqual(int.from_bytes(head[16:24], 'big'), 8)
+        self.assertEqual(os.path.getsize(fname), tbprimepool.HEADER_SIZE + 8*8)
+
+        # a reopen takes the capacity from the file
+        pool = tbprimepool.tbprimepool(64, self.dir, 100)
+        self.assertEqual(pool.capacity, 8)
+        pool.close()
+
+    def test_bad_magic(self):
+        fname = tbprimepool.pool_file(self.dir, 64)
+        tbprimepool.tbprimepool(64, self.dir, 8).close()
+        with open(fname, "r+b") as f:
+            f.write(b"NOTAPOOL")
+        with self.assertRaises(Exception):
+            tbprimepool.tbprimepool(64, self.dir)
+
+    def test_wrong_size(self):
+        # a 64-bit pool renamed to the 128-bit file name
+        tbprimepool.tbprimepool(64, self.dir, 8).close()
+        os.rename(tbprimepool.pool_file(self.dir, 64), tbprimepool.pool_file(self.dir, 128))
+        with self.assertRaises(Exception):
+            tbprimepool.tbprimepool(128, self.dir)
+
+    def test_truncated(self):
+        tbprimepool.tbprimepool(64, self.dir, 8).close()
+        fname = tbprimepool.pool_file(self.dir, 64)
+        os.truncate(fname, tbprimepool.HEADER_SIZE + 4*8)
+        with self.assertRaises(Exception):
+            tbprimepool.tbprimepool(64, self.dir)
+
+    def test_take_put_roundtrip(self):
+        primes = self.primes(64, 3)
+        pool = tbprimepool.tbprimepool(64, self.dir, 8)
+        self.assertEqual(pool.put(primes), 3)
+        pool.close()
+
+        # a second opener sees them, last in first out
+        pool = tbprimepool.tbprimepool(64, self.dir)
+        self.assertEqual(pool.available(), 3)
+        self.assertEqual([pool.take() for i in range(3)], primes[::-1])
+        pool.close()
+
+    def test_put_wrong_size(self):
+        pool = tbprimepool.tbprimepool(64, self.dir, 8)
+        with self.assertRaises(Exception):
+            pool.put(self.primes(63, 1))
+        self.assertEqual(pool.available(), 0)
+        pool.close()
+
+    def test_full(self):
+        primes = self.primes(64, 6)
+        pool = tbprimepool.tbprimepool(64, self.dir, 4)
+        self.assertEqual(pool.put(primes[:3]), 3)
+        self.assertEqual(pool.put(primes[3:]), 1)
+        self.assertEqual(pool.put(primes[5:]), 0)
+        self.assertEqual(pool.available(), 4)
+        self.assertEqual(pool.refill(), 0)
+        self.assertEqual(pool.take(), primes[3])
+        pool.close()
+
+    def test_empty(self):
+        pool = tbprimepool.tbprimepool(64, self.dir, 4)
+        self.assertIsNone(pool.take())
+        self.assertEqual(pool.available(), 0)
+        pool.close()
+        self.assertIsNone(tbprimepool.take_prime(64, self.dir))
+        # no pool file at all
+        self.assertIsNone(tbprimepool.take_prime(128, self.dir))
+
+    def test_refill_verifies(self):
+        # the search hands out a 64-bit composite first, then a prime
+        (p, q) = self.primes(32, 2)
+        composite = p*q
+        while composite.bit_length() != 64:
+            (p, q) = self.primes(32, 2)
+            composite = p*q
+        prime = self.primes(64, 1)[0]
+
+        pool = tbprimepool.tbprimepool(64, self.dir, 8)
+        added = pool.refill(3, ScriptedNumerics([composite, prime]))
+        self.assertEqual(added, 3)
+        # last in first out: the scripted prime is the bottom record
+        stored = [pool.take() for i in range(3)]
+        self.assertNotIn(composite, stored)
+        self.assertEqual(stored[-1], prime)
+        for x in stored:
+            self.assertEqual(x.bit_length(), 64)
+            self.assertTrue(self.numerics.is_prime(x, tbnumerics.PRIMALITY_BPSW))
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
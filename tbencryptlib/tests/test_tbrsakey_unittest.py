@@ -0,0 +1,95 @@
+import random
+import unittest
+
+from tbencryptlib import tbkeygen
+from tbencryptlib import tbrsakey
+
+"""
+To run: from the directory above tbencryptlib:
+
+```
+    python -m unittest tbencryptlib.tests.test_tbrsakey_unittest -v
+
+```
+"""
+
+class TestTbRsaKey(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.keygen = tbkeygen.tbkeygen(512, False, False, 0, tbkeygen.EXPONENT_F4)
+        cls.keygen.generate_keypair()
+        cls.key = tbrsakey.tbrsakey.from_keygen(cls.keygen)
+
+    '''
+        inputs that exercise the recombination: the ends of the range,
+        multiples of p and q and random values
+    '''
+    def inputs(self):
+        (n, p, q) = (self.key.n, self.key.p, self.key.q)
+        rng = random.Random(1)
+        return [0, 1, 2, n - 1, p, q, 2*p, (q - 1)*p] + [rng.randrange(n) for i in range(20)]
+
+    def assertPrivateOps(self, key):
+        (n, d) = (self.key.n, self.key.d)
+        for c in self.inputs():
+            self.assertEqual(key.decrypt(c), pow(c, d, n))
+            self.assertEqual(key.sign_raw(c), pow(c, d, n))
+            self.assertEqual(key.encrypt(key.decrypt(c)), c)
+
+    def test_from_keygen(self):
+        self.assertIsNotNone(self.key.qinv)
+        self.assertEqual((self.key.q*self.key.qinv) % self.key.p, 1)
+        self.assertPrivateOps(self.key)
+
+    def test_from_keydata(self):
+        k = self.key
+        kd = {"modulus": k.n, "publicExponent": k.e, "privateExponent": k.d,
+              "prime1": k.p, "prime2": k.q, "exponent1": k.dp, "exponent2": k.dq,
+              "coefficient": k.qinv}
+        self.assertPrivateOps(tbrsakey.tbrsakey.from_keydata(kd))
+
+        # the CRT fields are computed when they are missing
+        for name in ("exponent1", "exponent2", "coefficient"):
+            del kd[name]
+        key = tbrsakey.tbrsakey.from_keydata(kd)
+        self.assertEqual((key.dp, key.dq, key.qinv), (k.dp, k.dq, k.qinv))
+        self.assertPrivateOps(key)
+
+    def test_derkey(self):
+        key = tbrsakey.load_der(self.key.private_der())
+        self.assertTrue(key.has_private())
+        self.assertPrivateOps(key)
+        key = tbrsakey.load_pem(self.key.private_pem(True))
+        self.assertPrivateOps(key)
+
+    def test_without_primes(self):
+        key = tbrsakey.tbrsakey(self.key.n, self.key.e, self.key.d)
+        self.assertIsNone(key.qinv)
+        self.assertPrivateOps(key)
+
+    def test_public_key(self):
+        for key in (self.key.public_key(), tbrsakey.load_der(self.key.public_der())):
+            self.assertFalse(key.has_private())
+            self.assertEqual(key.encrypt(12345), pow(12345, self.key.e, self.key.n))
+            with self.assertRaises(Exception):
+                key.decrypt(12345)
+
+    def test_wrong_primes(self):
+        k = self.key
+        with self.assertRaises(Exception):
+            tbrsakey.tbrsakey(k.n, k.e, k.d, k.p, k.q + 2)
+        with self.assertRaises(Exception):
+            tbrsakey.tbrsakey(k.n + 2, k.e, k.d, k.p, k.q)
+
+    def test_out_of_range(self):
+        n = self.key.n
+        for key in (self.key, tbrsakey.load_der(self.key.private_der())):
+            for x in (-1, n, n + 1):
+                for op in (key.encrypt, key.verify_raw, key.decrypt, key.sign_raw):
+                    with self.assertRaises(Exception):
+                        op(x)
+
+
+if __name__ == '__main__':
+    unittest.main()